@@ -0,0 +1,428 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module checks the accuracy and measures the speed of the methods used
+to calculate the features of the stars, using synthetic light curves.
+It is intended to be used from a command line indicating the benchmark to run.
+
+"""
+
+import sys
+import time
+import resource
+import multiprocessing
+import numpy as np
+import lightcurve
+import lombscargle
+import periodfinder
+
+def synthetic_curves(number_of_curves, number_of_obs, seed = 0):
+    """ Returns a list of synthetic light curves as (mags, unix_times) pairs.
+        The curves are sinusoids of random period plus noise, sampled at
+        random times along thirty days.
+
+        number_of_curves - Number of curves to generate.
+        number_of_obs - Number of observations of each curve.
+        seed - Seed for the random numbers.
+
+    """
+
+    rng = np.random.RandomState(seed)
+
+    curves = []
+
+    for i in range(number_of_curves):
+        unix_times = 1.3e9 + np.sort(rng.uniform(0, 30 * 86400, number_of_obs))
+
+        # Angular frequency of the curve, periods from hours to days.
+        freq = 2 * np.pi / rng.uniform(3600, 5 * 86400)
+
+        mags = 15 + rng.uniform(0.05, 0.5) * np.sin(freq * unix_times) + \
+            0.02 * rng.randn(number_of_obs)
+
+        curves.append((mags, unix_times))
+
+    return curves
+
+def synthetic_eclipsing_curves(number_of_curves, number_of_obs, seed = 0):
+    """ Returns a list of synthetic light curves of eclipsing binaries as 
+        (mags, unix_times) pairs and a vector with their angular 
+        frequencies. Each curve has a primary eclipse and a shallower 
+        secondary one at half the period, plus noise, sampled at random
+        times along thirty days.
+
+        number_of_curves - Number of curves to generate.
+        number_of_obs - Number of observations of each curve.
+        seed - Seed for the random numbers.
+
+    """
+
+    rng = np.random.RandomState(seed)
+
+    curves = []
+    freqs = np.zeros(number_of_curves)
+
+    for i in range(number_of_curves):
+        unix_times = 1.3e9 + np.sort(rng.uniform(0, 30 * 86400, number_of_obs))
+
+        freqs[i] = 2 * np.pi / rng.uniform(0.3 * 86400, 5 * 86400)
+
+        phase = (freqs[i] * unix_times / (2 * np.pi)) % 1
+        duration = rng.uniform(0.04, 0.1)
+
+        depth = rng.uniform(0.3, 0.8)
+
+        mags = 15 + depth * (phase < duration) + \
+            0.4 * depth * (np.abs(phase - 0.5) < duration / 2) + \
+            0.02 * rng.randn(number_of_obs)
+
+        curves.append((mags, unix_times))
+
+    return curves, freqs
+
+def check_fast_accuracy(number_of_curves = 20, number_of_obs = 500,
+                        freqs_to_calculate = (200, 2000, 20000)):
+    """ Compares the periodgrams calculated with the fast method with those
+        of the direct method. Prints the maximum error relative to the
+        maximum of the periodgram and the percentage of curves whose
+        maximums are found at the same frequency.
+
+        number_of_curves - Number of synthetic curves to use.
+        number_of_obs - Number of observations of each curve.
+        freqs_to_calculate - Sizes of the frequency grids to check.
+
+    """
+
+    curves = synthetic_curves(number_of_curves, number_of_obs)
+
+    prepared_curves = [lightcurve.prepare_curve(mags, unix_times)
+                       for mags, unix_times in curves]
+
+    for n_freqs in freqs_to_calculate:
+        # The maximum frequency is chosen to keep the step of the grid.
+        max_freq = 0.01 + n_freqs * 5e-6
+
+        direct = lombscargle.LombScargle(lombscargle.LSProperties(
+            max_freq_to_seek_ = max_freq, freq_to_calculate_ = n_freqs))
+        fast = lombscargle.LombScargle(lombscargle.LSProperties(
+            max_freq_to_seek_ = max_freq, freq_to_calculate_ = n_freqs,
+            method_ = lombscargle.LSProperties.FAST_METHOD))
+
+        direct_pgrams, freqs, direct_max, peak_freqs, peak_values = \
+            direct.calculate_periodgrams(prepared_curves)
+        fast_pgrams, freqs, fast_max, peak_freqs, peak_values = \
+            fast.calculate_periodgrams(prepared_curves)
+
+        error = np.max(np.abs(fast_pgrams - direct_pgrams) /
+                       np.max(direct_pgrams, axis=1)[:, np.newaxis])
+
+        same_max = np.mean(fast_max[:, 0] == direct_max[:, 0]) * 100
+
+        print("Frequencies: %7d  max. relative error: %.2e  same maximum: %5.1f%%" %
+              (n_freqs, error, same_max))
+
+def check_fap(number_of_curves = 20, number_of_obs = 300, 
+              number_of_shuffles = 200, mean_mag = 0.0):
+    """ Checks the false alarm probabilities of the maximums of the 
+        periodgrams of curves of pure noise and of curves with a strong
+        sinusoid. Prints the mean probability of the highest maximum of each
+        kind of curve with each method, they should be high for the noise
+        and near 0 for the sinusoids. The periodgram doesn't subtract the
+        mean, so with a mean far from 0 the maximums found are those of the
+        mean at the lowest frequencies, and their probabilities are near 1.
+
+        number_of_curves - Number of curves of each kind.
+        number_of_obs - Number of observations of each curve.
+        number_of_shuffles - Number of shuffles of each curve for the
+            bootstrap.
+        mean_mag - Mean of the magnitudes of the curves.
+
+    """
+
+    rng = np.random.RandomState(0)
+
+    noise_curves = []
+    signal_curves = []
+
+    for i in range(number_of_curves):
+        unix_times = 1.3e9 + np.sort(rng.uniform(0, 30 * 86400, number_of_obs))
+
+        noise_curves.append((mean_mag + 0.05 * rng.randn(number_of_obs), 
+                             unix_times))
+
+        # Periods from hours to days, inside the frequencies calculated.
+        freq = 2 * np.pi / rng.uniform(0.5 * 86400, 5 * 86400)
+
+        signal_curves.append((mean_mag + 0.3 * np.sin(freq * unix_times) +
+                              0.05 * rng.randn(number_of_obs), unix_times))
+
+    for fap_method in [lombscargle.LSProperties.BALUEV_FAP, 
+                       lombscargle.LSProperties.BOOTSTRAP_FAP]:
+        ls = lombscargle.LombScargle(lombscargle.LSProperties(
+            grid_mode_ = lombscargle.LSProperties.BASELINE_GRID,
+            fap_method_ = fap_method, bootstrap_shuffles_ = number_of_shuffles,
+            fap_processes_ = 1))
+
+        for name, curves in [('noise', noise_curves), ('sinusoid', signal_curves)]:
+            prepared_curves = [lightcurve.prepare_curve(mags, unix_times)
+                               for mags, unix_times in curves]
+
+            pgrams, freqs, index_max_values, peak_freqs, peak_values = \
+                ls.calculate_periodgrams(prepared_curves)
+
+            faps = ls.calculate_faps(prepared_curves, freqs, peak_freqs)
+
+            print("FAP %-9s %-8s mean of the highest maximum: %.3f" %
+                  (fap_method, name, np.mean(faps[:, 0])))
+
+def benchmark_fast(number_of_curves = 20, number_of_obs = 500,
+                   direct_freqs = 200, fast_freqs = (200, 20000, 200000)):
+    """ Measures the number of periodgrams per second calculated with the
+        direct method using the default grid and with the fast method using
+        denser grids.
+
+        number_of_curves - Number of synthetic curves to use.
+        number_of_obs - Number of observations of each curve.
+        direct_freqs - Size of the frequency grid for the direct method.
+        fast_freqs - Sizes of the frequency grids for the fast method.
+
+    """
+
+    curves = synthetic_curves(number_of_curves, number_of_obs)
+
+    configurations = [(lombscargle.LSProperties.DIRECT_METHOD, direct_freqs)] + \
+        [(lombscargle.LSProperties.FAST_METHOD, n) for n in fast_freqs]
+
+    for method, n_freqs in configurations:
+        lsprop = lombscargle.LSProperties(freq_to_calculate_ = n_freqs,
+                                          method_ = method)
+        ls = lombscargle.LombScargle(lsprop)
+
+        start = time.time()
+
+        for mags, unix_times in curves:
+            ls.calculate_periodgram_from_curve(mags, unix_times)
+
+        elapsed = time.time() - start
+
+        print("Method: %-6s  frequencies: %7d  periodgrams/s: %8.1f" %
+              (method, n_freqs, number_of_curves / elapsed))
+
+def run_measured(queue, function, args):
+    """ Runs a function and puts in the queue its result, the time elapsed 
+        and the increase of the peak of resident memory of the process, in 
+        MB, while running the function.
+        
+        queue - Queue to put the results.
+        function - Function to run.
+        args - Tuple with the arguments of the function.
+    
+    """
+    
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.time()
+    
+    result = function(*args)
+    
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    
+    # ru_maxrss is measured in kB.
+    queue.put((result, elapsed, (peak_rss - start_rss) / 1024.0))
+
+def measure_in_child(function, args):
+    """ Runs a function in a child process, so the peak of memory is that of
+        the function, and returns its result, the time elapsed and the 
+        increase of the peak of resident memory in MB.
+        
+        function - Function to run, it must be defined at module level.
+        args - Tuple with the arguments of the function.
+    
+    """
+    
+    queue = multiprocessing.Queue()
+    
+    process = multiprocessing.Process(target=run_measured, 
+                                      args=(queue, function, args))
+    process.start()
+    
+    result = queue.get()
+    
+    process.join()
+    
+    return result
+
+def periodgrams_with_budget(curves, n_freqs, memory_budget, precision):
+    """ Calculates the periodgrams of the curves in a batch with the memory 
+        budget and precision received, and returns them in double precision.
+        
+        curves - List of (mags, unix_times) pairs.
+        n_freqs - Number of frequencies of the periodgrams.
+        memory_budget - Maximum number of bytes of the temporary arrays.
+        precision - Precision of the calculation.
+    
+    """
+    
+    lsprop = lombscargle.LSProperties(freq_to_calculate_ = n_freqs,
+                                      max_freq_to_seek_ = 0.01 + n_freqs * 5e-6,
+                                      memory_budget_ = memory_budget,
+                                      precision_ = precision)
+    ls = lombscargle.LombScargle(lsprop)
+    
+    prepared_curves = [lightcurve.prepare_curve(mags, unix_times)
+                       for mags, unix_times in curves]
+    
+    return np.asarray(ls.calculate_periodgrams(prepared_curves)[0], dtype=float)
+
+def benchmark_memory(number_of_curves = 32, number_of_obs = 500, 
+                     freqs_to_calculate = (2000, 20000),
+                     budgets_mb = (16, 256)):
+    """ Measures the time and the peak of memory used to calculate a batch 
+        of periodgrams with several memory budgets, in double and single 
+        precision. For single precision it also prints the maximum error 
+        relative to the maximum of the periodgram in double precision.
+        
+        number_of_curves - Number of synthetic curves to use.
+        number_of_obs - Number of observations of each curve.
+        freqs_to_calculate - Sizes of the frequency grids to check.
+        budgets_mb - Memory budgets to check, in MB.
+    
+    """
+    
+    curves = synthetic_curves(number_of_curves, number_of_obs)
+    
+    precisions = [lombscargle.LSProperties.DOUBLE_PRECISION,
+                  lombscargle.LSProperties.SINGLE_PRECISION]
+    
+    for n_freqs in freqs_to_calculate:
+        for budget in budgets_mb:
+            reference = None
+            
+            for precision in precisions:
+                pgrams, elapsed, peak_mb = measure_in_child(
+                    periodgrams_with_budget, 
+                    (curves, n_freqs, budget * 2 ** 20, precision))
+                
+                if reference is None:
+                    reference = pgrams
+                    error = 0.0
+                else:
+                    error = np.max(np.abs(pgrams - reference) /
+                                   np.max(reference, axis=1)[:, np.newaxis])
+                
+                print("Frequencies: %6d  budget: %5d MB  precision: %-6s  time: %7.2f s  peak memory: %7.1f MB  max. relative error: %.1e" %
+                      (n_freqs, budget, precision, elapsed, peak_mb, error))
+
+def benchmark_engines(number_of_curves = 100, number_of_obs = 400,
+                      tolerance = 0.01):
+    """ Compares the engines to search periods on synthetic sinusoidal and 
+        eclipsing curves. Prints the number of curves per second processed
+        by each engine and the percentage of curves whose highest peak is at 
+        the true frequency, and at the true frequency or one of its 
+        nearest harmonics (half and double).
+
+        number_of_curves - Number of synthetic curves of each kind.
+        number_of_obs - Number of observations of each curve.
+        tolerance - Relative distance to the true frequency of a peak 
+            recovered.
+
+    """
+
+    sinusoids = synthetic_curves(number_of_curves, number_of_obs)
+    
+    # The frequencies of the sinusoids are generated again with the same 
+    # random numbers.
+    rng = np.random.RandomState(0)
+    sinusoid_freqs = np.zeros(number_of_curves)
+    
+    for i in range(number_of_curves):
+        rng.uniform(0, 30 * 86400, number_of_obs)
+        sinusoid_freqs[i] = 2 * np.pi / rng.uniform(3600, 5 * 86400)
+        rng.uniform(0.05, 0.5)
+        rng.randn(number_of_obs)
+    
+    eclipsing, eclipsing_freqs = synthetic_eclipsing_curves(number_of_curves,
+                                                            number_of_obs)
+    
+    # Grid of frequencies for periods from one hour to ten days, with a step
+    # of a fifth of the width of the peaks for a baseline of thirty days.
+    step = 2 * np.pi / (5 * 30 * 86400)
+    freqs = np.arange(2 * np.pi / (10 * 86400), 2 * np.pi / 3600, step)
+    
+    engines = [(lombscargle.LSProperties.LOMB_SCARGLE_ENGINE, 
+                lombscargle.LombScargle(lombscargle.LSProperties()))] + \
+        [(name, periodfinder.create_engine(name)) 
+         for name in sorted(periodfinder.ENGINES.keys())]
+    
+    for kind, curves, true_freqs in [('sinusoid', sinusoids, sinusoid_freqs),
+                                     ('eclipsing', eclipsing, eclipsing_freqs)]:
+        padded_mags, padded_times, mask = pad_curves_from_unix(curves)
+        
+        for name, engine in engines:
+            start = time.time()
+            
+            pgrams = engine.power(padded_times, padded_mags, freqs, mask)
+            
+            elapsed = time.time() - start
+            
+            best = freqs[np.argmax(pgrams, axis=1)]
+            
+            ratio = best / true_freqs
+            
+            exact = np.abs(ratio - 1) < tolerance
+            harmonic = exact | (np.abs(2 * ratio - 1) < tolerance) | \
+                (np.abs(ratio / 2 - 1) < tolerance)
+            
+            print("Curves: %-9s  engine: %-11s  curves/s: %7.1f  recovered: %5.1f%%  with harmonics: %5.1f%%" %
+                  (kind, name, len(curves) / elapsed, 100.0 * np.mean(exact),
+                   100.0 * np.mean(harmonic)))
+
+def pad_curves_from_unix(curves):
+    """ Prepares a list of (mags, unix_times) curves and returns them padded,
+        with their magnitudes centered, as the magnitudes, times and mask 
+        matrices of lombscargle.pad_curves.
+        
+        curves - List of (mags, unix_times) pairs.
+    
+    """
+    
+    prepared_curves = [lightcurve.prepare_curve(mags, unix_times)
+                       for mags, unix_times in curves]
+    
+    # The magnitudes are centered, as the Lomb Scargle periodgram doesn't
+    # subtract the mean and the other engines don't depend on it.
+    return lombscargle.pad_curves([(curve.mags - np.mean(curve.mags), curve.times) 
+                                   for curve in prepared_curves])
+
+# Benchmarks available from the command line.
+BENCHMARKS = { 'fast-accuracy' : check_fast_accuracy,
+               'fap' : check_fap,
+               'fast-speed' : benchmark_fast,
+               'memory' : benchmark_memory,
+               'engines' : benchmark_engines }
+
+def benchmark():
+
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("A benchmark must be indicated -> %s %s" %
+              (sys.argv[0], '|'.join(sorted(BENCHMARKS.keys()))))
+    else:
+        BENCHMARKS[sys.argv[1]]()
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,196 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module keeps in a file the features of the groups of stars already
+calculated, so a calculation interrupted can be resumed calculating only
+the remaining stars. Each group is appended to the file in a line, written
+at once and flushed to disk, so an interruption can only leave incomplete
+the last line, that is discarded when the file is read. The features read
+are indexed by star, as the groups depend on the number of processes and
+a calculation can be resumed with a different number.
+
+"""
+
+import os
+import json
+import logging
+
+class FeaturesCheckpoint(object):
+    """ File with the features of the groups of stars calculated, with a
+        first line with the settings of the calculation, so the features
+        are only reused by a calculation with the same settings.
+
+    """
+
+    # Extension added to the name of the features file.
+    FILE_EXT = '.ckpt'
+
+    def __init__(self, filename_, resume_ = False):
+        """ Instantiation method for the FeaturesCheckpoint class.
+
+            filename_ - Name of the file.
+            resume_ - Read the groups of the file to reuse them, otherwise
+                the file is started again.
+
+        """
+
+        self.__filename = filename_
+        self.__resume = resume_
+        self.__file = None
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    @staticmethod
+    def star_key(filter_index, star_id):
+        """ Returns the key of a star in a filter.
+
+            filter_index - Index of the filter.
+            star_id - Identifier of the star.
+
+        """
+
+        return (filter_index, int(star_id))
+
+    def __read(self, settings):
+        """ Returns a dictionary with the features and the fingerprint of
+            the curve of each star of the file and the length of the valid
+            part of the file, or None if the file can't be used with these
+            settings.
+
+            settings - String with the settings of the calculation.
+
+        """
+
+        stars = {}
+        valid_length = 0
+
+        with open(self.__filename, 'rb') as checkpoint_file:
+            for line in checkpoint_file:
+                # An incomplete last line is discarded.
+                if not line.endswith(b'\n'):
+                    break
+
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    break
+
+                if valid_length == 0:
+                    if record.get('settings') != settings:
+                        return None
+                else:
+                    fingerprints = record.get('fingerprints')
+
+                    if fingerprints is None:
+                        fingerprints = [None] * len(record['stars'])
+
+                    for star_id, features, fingerprint in \
+                        zip(record['stars'], record['features'], fingerprints):
+                        stars[FeaturesCheckpoint.star_key(record['filter'],
+                                                          star_id)] = \
+                            (features, fingerprint)
+
+                valid_length += len(line)
+
+        return stars, valid_length
+
+    def open(self, settings):
+        """ Opens the file to add groups and returns a dictionary with the
+            features and the fingerprint of the curve of each star 
+            calculated, indexed by star_key.
+
+            settings - String with the settings of the calculation, the
+                groups of a file with other settings are discarded.
+
+        """
+
+        stars = {}
+        contents = None
+
+        if self.__resume and os.path.isfile(self.__filename):
+            contents = self.__read(settings)
+
+            if contents is None:
+                logging.warning('The checkpoint %s was written with other settings, it is discarded.' %
+                                self.__filename)
+
+        if contents is None:
+            # The file is started with the settings.
+            self.__file = open(self.__filename, 'wb')
+
+            self.__write_line({'settings': settings})
+        else:
+            stars, valid_length = contents
+
+            # An incomplete last line is removed before adding more groups.
+            self.__file = open(self.__filename, 'r+b')
+            self.__file.truncate(valid_length)
+            self.__file.seek(valid_length)
+
+            logging.info('Resuming from checkpoint %s with %d stars calculated.' %
+                         (self.__filename, len(stars)))
+
+        return stars
+
+    def __write_line(self, record):
+        """ Writes a record in a line of the file and flushes it to disk.
+
+            record - Dictionary to write.
+
+        """
+
+        self.__file.write((json.dumps(record) + '\n').encode('utf-8'))
+        self.__file.flush()
+        os.fsync(self.__file.fileno())
+
+    def append(self, filter_index, stars_ids, features, fingerprints = None):
+        """ Adds to the file the features of a group of stars.
+
+            filter_index - Index of the filter.
+            stars_ids - Identifiers of the stars of the group.
+            features - Features of each star, None for the stars without
+                features.
+            fingerprints - Fingerprints of the light curves of the stars,
+                None if they aren't kept.
+
+        """
+
+        self.__write_line({'filter': filter_index,
+                           'stars': [int(star_id) for star_id in stars_ids],
+                           'features': features,
+                           'fingerprints': fingerprints})
+
+    def close(self):
+        """ Closes the file. """
+
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    def remove(self):
+        """ Closes and removes the file, when the features have been
+            written.
+
+        """
+
+        self.close()
+
+        if os.path.isfile(self.__filename):
+            os.remove(self.__filename)
@@ -24,6 +24,8 @@ these arguments to other modules.
 
 import argparse
 import logging
+import shards
+import featureregistry
 
 class ClassifierArguments(object):
     """ Encapsulates the definition, processing and of program arguments.
@@ -106,6 +108,78 @@ class ClassifierArguments(object):
         self.__parser.add_argument('-l', metavar='log file name', dest='l', 
                                    help='File to save the log messages')        
         
+        self.__parser.add_argument('--ls-method', metavar='method', dest='ls_method',
+                                   choices=['direct', 'fast'], default='direct',
+                                   help="Method to calculate the periodgrams: 'direct' or 'fast' (FFT based)")
+        
+        self.__parser.add_argument('--ls-freqs', metavar='number', type=int, dest='ls_freqs',
+                                   help='Number of frequencies of the periodgrams')
+        
+        self.__parser.add_argument('--ls-search', metavar='mode', dest='ls_search',
+                                   choices=['uniform', 'zoom'], default='uniform',
+                                   help="Mode to search the maximums of the periodgrams: 'uniform' or 'zoom' (refined around the local maxima)")
+        
+        self.__parser.add_argument('--ls-grid', metavar='grid', dest='ls_grid',
+                                   choices=['fixed', 'baseline'], default='fixed',
+                                   help="Grid of frequencies of the periodgrams: 'fixed' or 'baseline' (derived from the time baseline and cadence of each curve)")
+        
+        self.__parser.add_argument('--engine', metavar='engine', dest='engine',
+                                   choices=['lombscargle', 'pdm', 'ce', 'bls'], default='lombscargle',
+                                   help="Engine to search the periods: 'lombscargle', 'pdm' (phase dispersion minimization), 'ce' (conditional entropy) or 'bls' (box least squares)")
+        
+        self.__parser.add_argument('--fap', metavar='method', dest='fap_method',
+                                   choices=['baluev', 'bootstrap'],
+                                   help="Add the false alarm probabilities of the maximums of the periodgrams to the features: 'baluev' (analytic) or 'bootstrap' (shuffled curves)")
+        
+        self.__parser.add_argument('--fap-shuffles', metavar='number', type=int, dest='fap_shuffles',
+                                   help='Number of shuffles of each curve for the bootstrap false alarm probabilities')
+        
+        self.__parser.add_argument('--harmonic-fit', dest='harmonic_fit', action='store_true',
+                                   help='Add to the features the amplitudes and phases of the harmonics of the frequencies found, fitted to the light curves')
+        
+        self.__parser.add_argument('--shared-basis', dest='shared_basis', action='store_true',
+                                   help='Share the calculation of sines and cosines among the stars of a filter observed at the same epochs')
+        
+        self.__parser.add_argument('--ls-precision', metavar='precision', dest='ls_precision',
+                                   choices=['double', 'single'], default='double',
+                                   help="Precision to calculate the periodgrams: 'double' or 'single' (faster, for triage runs)")
+        
+        self.__parser.add_argument('--memory-budget', metavar='MB', type=int, dest='memory_budget',
+                                   help='Maximum size in MB of the temporary arrays used to calculate the periodgrams')
+        
+        self.__parser.add_argument('--features', metavar='names', dest='features',
+                                   help='Names of the features to calculate separated by commas, all the features if not indicated')
+        
+        self.__parser.add_argument('-j', metavar='N', type=int, dest='jobs', default=1,
+                                   help='Number of processes used to calculate the features of the stars')
+        
+        self.__parser.add_argument('--pipeline', metavar='threads', type=int, dest='pipeline',
+                                   help='Read the light curves in a thread while this number of threads calculate the features')
+        
+        self.__parser.add_argument('--resume', dest='resume', action='store_true',
+                                   help='Reuse the features of the stars saved in the checkpoint of the features file by an interrupted calculation')
+        
+        self.__parser.add_argument('--stream', metavar='stars', type=int, dest='stream',
+                                   help='Predict the stars in chunks of this number of stars as their features are calculated from the LEMON database, without keeping the features of all the stars')
+        
+        self.__parser.add_argument('--shard', metavar='i/N', type=shards.parse_shard, dest='shard',
+                                   help='Calculate only the features of the shard i, from 0 to N - 1, of the stars divided in N shards, and write them to the features files of the shard')
+        
+        self.__parser.add_argument('--merge-shards', metavar='N', type=int, dest='merge_shards',
+                                   help='Merge the features files of the N shards in the features files of all the stars')
+        
+        self.__parser.add_argument('--pgram-cache', metavar='directory', dest='pgram_cache_dir',
+                                   help='Directory to store the periodgrams calculated and reuse them in later executions')
+        
+        self.__parser.add_argument('--pgram-cache-size', metavar='MB', type=int, dest='pgram_cache_size',
+                                   default=1024, help='Maximum size in MB of the periodgrams cache')
+        
+        self.__parser.add_argument('--incremental', metavar='directory', dest='incremental_dir',
+                                   help='Directory to store the sums of the periodgrams of each star, to update them only with the new measures in later executions')
+        
+        self.__parser.add_argument('--online-features', metavar='directory', dest='online_features_dir',
+                                   help='Directory to store the states of the non periodic features of each star, to update them only with the new measures in later executions. The features based on percentiles are estimated for the curves of more than 5000 measures')
+        
         self.__args = None    
         
     @property    
@@ -170,6 +244,94 @@ class ClassifierArguments(object):
     def log_file_name(self):
         return self.__args.l           
     
+    @property
+    def ls_method(self):
+        return self.__args.ls_method
+    
+    @property
+    def ls_freqs(self):
+        return self.__args.ls_freqs
+    
+    @property
+    def ls_search(self):
+        return self.__args.ls_search
+    
+    @property
+    def ls_grid(self):
+        return self.__args.ls_grid
+    
+    @property
+    def engine(self):
+        return self.__args.engine
+    
+    @property
+    def fap_method(self):
+        return self.__args.fap_method
+    
+    @property
+    def fap_shuffles(self):
+        return self.__args.fap_shuffles
+    
+    @property
+    def harmonic_fit(self):
+        return self.__args.harmonic_fit
+    
+    @property
+    def shared_basis(self):
+        return self.__args.shared_basis
+    
+    @property
+    def ls_precision(self):
+        return self.__args.ls_precision
+    
+    @property
+    def memory_budget(self):
+        return self.__args.memory_budget
+    
+    @property
+    def features(self):
+        return self.__args.features
+    
+    @property
+    def jobs(self):
+        return self.__args.jobs
+    
+    @property
+    def pipeline(self):
+        return self.__args.pipeline
+    
+    @property
+    def resume(self):
+        return self.__args.resume
+    
+    @property
+    def stream(self):
+        return self.__args.stream
+    
+    @property
+    def shard(self):
+        return self.__args.shard
+    
+    @property
+    def merge_shards(self):
+        return self.__args.merge_shards
+    
+    @property
+    def pgram_cache_dir(self):
+        return self.__args.pgram_cache_dir
+    
+    @property
+    def pgram_cache_size(self):
+        return self.__args.pgram_cache_size
+    
+    @property
+    def incremental_dir(self):
+        return self.__args.incremental_dir
+    
+    @property
+    def online_features_dir(self):
+        return self.__args.online_features_dir
+    
     @property
     def stars_id_file_provided(self): 
         return self.__args.s <> None     
@@ -210,6 +372,52 @@ class ClassifierArguments(object):
             logging.error("Only one function mode is allowed, training or prediction or evaluation.")
             arguments_ok = False
           
+        # The analytic false alarm probabilities are those of the Lomb 
+        # Scargle periodgram.
+        if self.fap_method == 'baluev' and self.engine != 'lombscargle':
+            logging.error("The false alarm probabilities of Baluev are only valid for the engine lombscargle, use --fap bootstrap with the engine %s." %
+                          self.engine)
+            arguments_ok = False
+          
+        # The sums of the periodgrams updated with the new measures are 
+        # calculated directly with the Lomb Scargle method.
+        if self.incremental_dir is not None and \
+            ( self.engine != 'lombscargle' or self.ls_method != 'direct' or \
+              self.ls_precision != 'double' ):
+            logging.error("The periodgrams updated with --incremental are only calculated with --engine lombscargle, --ls-method direct and --ls-precision double.")
+            arguments_ok = False
+          
+        # Check the names of the features selected.
+        if self.features is not None:
+            try:
+                featureregistry.registry_from_names(self.features)
+            except ValueError as ve:
+                logging.error("The features indicated aren't valid. %s" % ve)
+                arguments_ok = False
+          
+        # The features of a shard are only calculated and written, and the
+        # shards are merged in a separate execution.
+        if ( self.shard is not None or self.merge_shards is not None ) and \
+            ( self.is_training or self.is_prediction or self.is_evaluation or \
+              ( self.shard is not None and self.merge_shards is not None ) ):
+            logging.error("The calculation of the features of a shard and the merge of the shards can't be done with other function modes.")
+            arguments_ok = False
+            
+        if self.shard is not None:
+            if not self.datafile_and_stars_file_provided or \
+                not self.features_file_provided:
+                logging.error("To calculate the features of a shard the files for database, stars identifiers and features must be provided.")
+                arguments_ok = False
+                
+        if self.merge_shards is not None:
+            if not self.stars_id_file_provided or not self.features_file_provided:
+                logging.error("To merge the shards the files for stars identifiers and features must be provided.")
+                arguments_ok = False
+                
+            elif self.merge_shards < 1:
+                logging.error("The number of shards to merge must be positive.")
+                arguments_ok = False
+          
         # Check arguments for training mode.
         if self.is_training:
             if ( not self.datafile_and_stars_file_provided ) and \
@@ -224,6 +432,15 @@ class ClassifierArguments(object):
                 logging.error("In predicting mode a pair of files for database and stars identifiers must be provided.")
                 arguments_ok = False  
                 
+            if self.stream is not None:
+                if not self.database_file_provided:
+                    logging.error("The streaming prediction calculates the features from a LEMON database, it must be provided.")
+                    arguments_ok = False
+                    
+                if self.stream < 1:
+                    logging.error("The number of stars of each chunk of the streaming prediction must be positive.")
+                    arguments_ok = False
+                
         # Check arguments for evaluation mode.
         if self.is_evaluation:
             if ( not self.datafile_and_stars_file_provided ) and \
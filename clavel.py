@@ -34,6 +34,8 @@ import classifargs
 import modelserial
 import starclasses
 import starfeatures
+import shards
+import featureregistry
 import trainevalsets
 import evaluation
 from sklearn.ensemble import RandomForestClassifier
@@ -146,20 +148,17 @@ def predict_for_evaluation(clf, evaluation_indexes, features):
         
     return predicted_classes
         
-def retrieve_stars_features(classifarg):
-    """ Read the stars information and loads it in the structures used.
-        The information is read from the source indicated by the program
-        arguments.
-        Returns StarClasses object containing all the information read
-        for the stars.
+def retrieve_stars_identifiers(classifarg):
+    """ Read the identifiers and classes of the stars from the source
+        indicated by the program arguments.
+        Returns StarClasses object containing the identifiers and classes
+        of the stars, without their features.
         
         classifarg - ClassifierArguments object, it contains the
             information of all program arguments received.        
     
     """
     
-    logging.info('Getting stars features.')
-    
     # Get an object to store the stars information.
     star_classes = starclasses.StarClasses()  
     
@@ -176,6 +175,24 @@ def retrieve_stars_features(classifarg):
     if star_classes.stars_identifiers == 0:
         error_exit('Not found any features file.')
         
+    return star_classes
+
+def retrieve_stars_features(classifarg):
+    """ Read the stars information and loads it in the structures used.
+        The information is read from the source indicated by the program
+        arguments.
+        Returns StarClasses object containing all the information read
+        for the stars.
+        
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.        
+    
+    """
+    
+    logging.info('Getting stars features.')
+    
+    star_classes = retrieve_stars_identifiers(classifarg)
+        
     # Calculate the features of the stars whose identifiers are
     # indicated and return all the features in a data structure.
     # It is done at this point to detect any problem with data reading or
@@ -252,6 +269,17 @@ def only_training(classifarg):
     else:
         error_exit('For training a file name to save the model must be provided.')
                 
+def prediction_file_name(afilter, classifarg):
+    """ Returns the name of the csv file of the prediction of a filter. 
+    
+        afilter - Name of the filter.
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.
+    
+    """
+    
+    return classifarg.prediction_file + '_' + afilter + csvdata.CsvUtil.FILE_EXT
+
 def write_prediction_to_file(afilter, star_classes, predicted_classes, predicted_classes_proba, classifarg):
     """ Writes to a csv file the prediction of a given filter.
     
@@ -266,14 +294,14 @@ def write_prediction_to_file(afilter, star_classes, predicted_classes, predicted
     """        
     
     # Compose the name of the prediction file.
-    prediction_file_name = classifarg.prediction_file + '_' + afilter + csvdata.CsvUtil.FILE_EXT   
+    file_name = prediction_file_name(afilter, classifarg)
     
     # Get the list of star classes.
     unique_classes_names = star_classes.unique_classes_names
     
     # Write the file.
-    with open(prediction_file_name, 'wb') as csvfile:
-        logging.info("Writing prediction for filter %s to file: %s" % (afilter, prediction_file_name))
+    with open(file_name, 'wb') as csvfile:
+        logging.info("Writing prediction for filter %s to file: %s" % (afilter, file_name))
                 
         csv_file = csv.writer(csvfile, delimiter=',', quotechar='"')  
         
@@ -281,15 +309,24 @@ def write_prediction_to_file(afilter, star_classes, predicted_classes, predicted
         row = [csvdata.CsvUtil.ID, csvdata.CsvUtil.PREDICTION, csvdata.CsvUtil.PRED_PROBA]
         csv_file.writerow(row)
         
-        # Get the identifiers for all the stars.
-        stars_identifiers = star_classes.stars_identifiers
+        # The predictions are only of the stars enabled, in order.
+        predictions = iter(zip(predicted_classes, predicted_classes_proba))
                 
         # Write csv rows. Each row contains a star identifier and 
-        # the class predicted.
-        for star_id, predict, proba in zip(stars_identifiers, predicted_classes, predicted_classes_proba):
-            # Get the row, formatting the probability value.
-            prob = float(proba) * 100
-            row = [star_id, unique_classes_names[(int(predict))], "%2.f%%" % prob] 
+        # the class predicted, the stars disabled are marked as not
+        # predicted.
+        for i in range(star_classes.number_of_stars):
+            star_id = star_classes.star_identifier(i)
+            
+            if star_classes.is_enabled(i):
+                predict, proba = next(predictions)
+                
+                # Get the row, formatting the probability value.
+                prob = float(proba) * 100
+                row = [star_id, unique_classes_names[(int(predict))], "%2.f%%" % prob] 
+            else:
+                row = [star_id, csvdata.CsvUtil.NOT_PREDICTED, '']
+                
             csv_file.writerow(row)      
      
 def predict_stars_classes(clf, filters_names, star_classes, classifarg):
@@ -342,6 +379,118 @@ def predict_stars_classes(clf, filters_names, star_classes, classifarg):
         # Generates the confusion matrix corresponding to the current filter.
         evaluat.generate_confusion_matrix()
         
+def predict_chunk(classifier, afilter, stars_ids, features, star_classes,
+                  classifarg, predicted_classes):
+    """ Predicts the classes of a chunk of stars of a filter and appends 
+        them to the prediction file of the filter, that is started with the
+        first chunk.
+    
+        classifier - Classifier of the filter.
+        afilter - Name of the filter.
+        stars_ids - Identifiers of the stars of the chunk.
+        features - Features of the stars of the chunk in the filter.
+        star_classes - StarClasses object, it contains the information
+            related to the stars.
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.
+        predicted_classes - Classes predicted in the previous chunks of
+            the filter, the classes of this chunk are added.
+            
+    """
+    
+    file_name = prediction_file_name(afilter, classifarg)
+    
+    unique_classes_names = star_classes.unique_classes_names
+    
+    chunk_classes = classifier.predict(features)
+    chunk_classes_proba = classifier.predict_proba(features)
+    
+    # The file is started with the first chunk of the filter.
+    with open(file_name, 'ab' if len(predicted_classes) > 0 else 'wb') as csvfile:
+        csv_file = csv.writer(csvfile, delimiter=',', quotechar='"')  
+        
+        if len(predicted_classes) == 0:
+            logging.info("Writing prediction for filter %s to file: %s" % (afilter, file_name))
+            
+            csv_file.writerow([csvdata.CsvUtil.ID, csvdata.CsvUtil.PREDICTION, 
+                               csvdata.CsvUtil.PRED_PROBA])
+        
+        for star_id, predict, proba in zip(stars_ids, chunk_classes, chunk_classes_proba):
+            prob = float(proba[0]) * 100
+            row = [star_id, unique_classes_names[(int(predict))], "%2.f%%" % prob] 
+            csv_file.writerow(row)
+            
+    predicted_classes.extend(chunk_classes)
+    
+def stream_prediction(clf, filters_names, classifarg):
+    """ Predicts the classes of the stars in chunks as their features are
+        calculated from the LEMON database, so only the features of a chunk
+        of stars are kept.
+    
+        clf - List of classifiers.
+        filters_names - List of filter names corresponding to the classifiers.
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.
+            
+    """
+    
+    star_classes = retrieve_stars_identifiers(classifarg)
+    
+    stars_features = starfeatures.StarsFeatures(star_classes)
+    
+    classifiers = dict(zip(filters_names, clf))
+    
+    # Classes predicted in each filter.
+    predicted_classes = dict([(afilter, []) for afilter in filters_names])
+    
+    # Stars of the current chunk, all of the same filter.
+    chunk_filter = None
+    chunk_ids = []
+    chunk_features = []
+    
+    logging.info('Predicting class for stars in chunks of %d stars.' % classifarg.stream)
+    
+    features_iter = stars_features.iter_features(
+        classifarg.database_file_name,
+        starfeatures.StarsFeatures.get_lsproperties(classifarg),
+        starfeatures.StarsFeatures.get_pgram_cache(classifarg),
+        starfeatures.StarsFeatures.get_accumulator_store(classifarg),
+        featureregistry.registry_from_names(classifarg.features),
+        classifarg.jobs,
+        starfeatures.StarsFeatures.get_online_store(classifarg))
+    
+    for star_id, afilter, star_features in features_iter:
+        if afilter != chunk_filter or len(chunk_ids) == classifarg.stream:
+            if len(chunk_ids) > 0:
+                predict_chunk(classifiers[chunk_filter], chunk_filter, chunk_ids,
+                              chunk_features, star_classes, classifarg,
+                              predicted_classes[chunk_filter])
+                
+            chunk_filter = afilter
+            chunk_ids = []
+            chunk_features = []
+            
+            if afilter not in classifiers:
+                logging.warning('There is no classifier for filter %s.' % afilter)
+            
+        if afilter in classifiers:
+            chunk_ids.append(star_id)
+            chunk_features.append(star_features)
+        
+    if len(chunk_ids) > 0:
+        predict_chunk(classifiers[chunk_filter], chunk_filter, chunk_ids,
+                      chunk_features, star_classes, classifarg,
+                      predicted_classes[chunk_filter])
+        
+    # Write confusion matrix of each filter.
+    for afilter in filters_names:
+        evaluat = evaluation.Evaluation(predicted_classes[afilter],
+                                        range(len(star_classes.unique_classes_names)), 
+                                        star_classes.unique_classes_names,
+                                        afilter)
+        
+        evaluat.generate_confusion_matrix()
+        
 def only_prediction(classifarg):
     """ Performs only the prediction of the class for a set of stars.
         To accomplish this task the stars and the classifier model must be read.
@@ -358,7 +507,10 @@ def only_prediction(classifarg):
         
         clf, filters_names = cm.read_model(classifarg.model_file_name)  
         
-        if clf <> None:
+        if clf <> None and classifarg.stream is not None:
+            # The features are calculated and predicted in chunks.
+            stream_prediction(clf, filters_names, classifarg)
+        elif clf <> None:
             # Retrieve the information of stars to predict.
             star_classes = retrieve_stars_features(classifarg)
             
@@ -368,6 +520,39 @@ def only_prediction(classifarg):
     else:
         error_exit("A file with a classification model hasn't been provided, prediction cann't be done.")
 
+def shard_features(classifarg):
+    """ Calculates the features of the stars of a shard and writes them to
+        the features files of the shard.
+        
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.        
+        
+    """
+    
+    star_classes = retrieve_stars_identifiers(classifarg)
+    
+    shards.select_shard(star_classes, classifarg.shard)
+    
+    stars_features = starfeatures.StarsFeatures(star_classes)
+    stars_features.retrieve_features(classifarg)
+    
+def merge_shards(classifarg):
+    """ Merges the features files of the shards in the features files of
+        all the stars, in the order of the stars identifiers file.
+        
+        classifarg - ClassifierArguments object, it contains the
+            information of all program arguments received.        
+        
+    """
+    
+    star_classes = retrieve_stars_identifiers(classifarg)
+    
+    try:
+        shards.merge_shards(classifarg.features_file_name, 
+                            classifarg.merge_shards, star_classes)
+    except ValueError as e:
+        error_exit("The shards can't be merged: %s" % e)
+    
 def main(): 
     """ Main function used to perform training, prediction or evaluation 
     depending on the arguments received. Process program arguments and 
@@ -401,6 +586,14 @@ def main():
         elif ca.is_evaluation:
             logging.info("Let's go evaluation!")        
             evaluate_classifier(ca)   
+            
+        elif ca.shard is not None:
+            logging.info("Let's go calculation of the features of shard %d of %d!" % ca.shard)
+            shard_features(ca)
+            
+        elif ca.merge_shards is not None:
+            logging.info("Let's go merge of %d shards!" % ca.merge_shards)
+            merge_shards(ca)
 
         logging.info('Clavel finished.')      
         
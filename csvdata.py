@@ -31,6 +31,8 @@ class CsvUtil(object):
     ID = 'ID'
     PREDICTION = 'PREDICTION'
     PRED_PROBA = 'PROBABILITY'         
+    # Prediction of the stars disabled, whose features couldn't be calculated.
+    NOT_PREDICTED = 'DISABLED'
     FILE_EXT = '.csv'
 
 class ColumnDef(object):
@@ -0,0 +1,264 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module calculates the false alarm probability of the maximums of the
+periodgrams, the probability that a maximum as high appears in the
+periodgram of a curve without any periodic signal. It is calculated with
+the analytic approximation of Baluev (2008) or with a bootstrap of the
+periodgrams of the curves with their magnitudes shuffled.
+
+"""
+
+import math
+import multiprocessing
+import numpy as np
+
+def gammaln(x):
+    """ Returns the logarithm of the gamma function of each element.
+
+        x - Array of positive values.
+
+    """
+
+    return np.vectorize(math.lgamma, otypes=[float])(x)
+
+def centered_mags(mags, mask = None):
+    """ Returns the magnitudes of each curve minus their mean, the invalid
+        values are set to 0. The Lomb Scargle periodgram doesn't subtract
+        the mean, so the power of the mean of magnitudes far from 0 would
+        dominate the maximums of the periodgram.
+
+        mags - Matrix with the magnitudes of a curve in each row.
+        mask - Boolean matrix that indicates the valid values of mags, used
+            when the curves are padded to the same length.
+
+    """
+
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+
+    if mask is None:
+        weights = np.ones(mags.shape)
+    else:
+        weights = np.atleast_2d(mask).astype(float)
+
+    count = np.maximum(weights.sum(axis=1), 1)[:, np.newaxis]
+
+    mean_mags = (mags * weights).sum(axis=1)[:, np.newaxis] / count
+
+    return (mags - mean_mags) * weights
+
+def curves_statistics(times, mags, mask = None):
+    """ Returns the number of measures, the variance of the times and the
+        sum of the squared deviations of the magnitudes from their mean of
+        each curve, as vectors.
+
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        mask - Boolean matrix that indicates the valid values of times and
+            mags, used when the curves are padded to the same length.
+
+    """
+
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+
+    if mask is None:
+        weights = np.ones(times.shape)
+    else:
+        weights = np.atleast_2d(mask).astype(float)
+
+    n_obs = weights.sum(axis=1)
+    count = np.maximum(n_obs, 1)[:, np.newaxis]
+
+    mean_times = (times * weights).sum(axis=1)[:, np.newaxis] / count
+    var_times = (((times - mean_times) * weights) ** 2).sum(axis=1) / count[:, 0]
+
+    mean_mags = (mags * weights).sum(axis=1)[:, np.newaxis] / count
+    squares_mags = (((mags - mean_mags) * weights) ** 2).sum(axis=1)
+
+    return n_obs, var_times, squares_mags
+
+def baluev_fap(peak_values, times, mags, max_freqs, mask = None):
+    """ Returns the false alarm probabilities of the maximums of several
+        Lomb Scargle periodgrams, using the approximation of Baluev (2008)
+        for the standard normalization of the periodgram. The values of
+        the periodgram are normalized by the half of the sum of the squared
+        deviations of the magnitudes from their mean, so they must be the
+        values of the periodgram of the magnitudes centered.
+
+        peak_values - Matrix with the values of the maximums of each
+            periodgram of the magnitudes centered in a row.
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        max_freqs - Maximum angular frequency of the periodgram of each curve.
+        mask - Boolean matrix that indicates the valid values of times and
+            mags, used when the curves are padded to the same length.
+
+    """
+
+    peak_values = np.atleast_2d(np.asarray(peak_values, dtype=float))
+
+    n_obs, var_times, squares_mags = curves_statistics(times, mags, mask)
+
+    # Degrees of freedom of the hypothesis without and with a periodic signal.
+    nh = np.maximum(n_obs - 1, 1)[:, np.newaxis]
+    nk = np.maximum(n_obs - 3, 1)[:, np.newaxis]
+
+    z = 2 * peak_values / np.where(squares_mags > 0, squares_mags, 1)[:, np.newaxis]
+    z = np.clip(z, 0, 1 - 1e-12)
+
+    # Probability of a value lower than z for a single frequency.
+    cdf_single = 1 - (1 - z) ** (0.5 * nk)
+
+    # Number of independent frequencies from the effective baseline.
+    effective_baseline = np.sqrt(4 * np.pi * var_times)[:, np.newaxis]
+    w = np.asarray(max_freqs, dtype=float).reshape((-1, 1)) / (2 * np.pi) * \
+        effective_baseline
+
+    gamma = np.sqrt(2 / nh) * np.exp(gammaln(nh / 2) - gammaln((nh - 1) / 2))
+
+    tau = gamma * w * (1 - z) ** (0.5 * (nk - 1)) * np.sqrt(0.5 * nh * z)
+
+    return np.clip(1 - cdf_single * np.exp(-tau), 0, 1)
+
+def shuffled_mags(mags, mask, number_of_shuffles, rng):
+    """ Returns a matrix with the magnitudes of each curve shuffled several
+        times, the shuffles of each curve are consecutive rows. Only the
+        valid magnitudes of each curve are shuffled, the valid values of
+        each row must be the first ones.
+
+        mags - Matrix with the magnitudes of a curve in each row.
+        mask - Boolean matrix that indicates the valid values of mags.
+        number_of_shuffles - Number of shuffles of each curve.
+        rng - Random number generator.
+
+    """
+
+    rows_mask = np.repeat(mask, number_of_shuffles, axis=0)
+
+    # The invalid values get keys greater than all the valid ones, so each
+    # permutation only moves the valid values.
+    keys = rng.random_sample(rows_mask.shape)
+    keys[~rows_mask] = 2
+
+    order = np.argsort(keys, axis=1)
+
+    rows = np.repeat(np.arange(len(mags)), number_of_shuffles)[:, np.newaxis]
+
+    return mags[rows, order]
+
+def bootstrap_maxima(engine, times, mags, freqs, mask, number_of_shuffles,
+                     seed):
+    """ Returns a matrix with the maximum of the periodgram of each curve
+        with its magnitudes shuffled, for several shuffles in a row. The
+        periodgrams of all the shuffles are calculated at once.
+
+        engine - PeriodEngine used to calculate the periodgrams.
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        freqs - Angular frequencies, a vector or a matrix with the
+            frequencies of each curve in a row.
+        mask - Boolean matrix that indicates the valid values of times and
+            mags, the valid values of each row must be the first ones.
+        number_of_shuffles - Number of shuffles of each curve.
+        seed - Seed for the random numbers.
+
+    """
+
+    rng = np.random.RandomState(seed)
+
+    n_curves = len(mags)
+
+    freqs = np.atleast_2d(freqs)
+
+    if len(freqs) > 1:
+        freqs = np.repeat(freqs, number_of_shuffles, axis=0)
+
+    pgrams = engine.power(np.repeat(times, number_of_shuffles, axis=0),
+                          shuffled_mags(mags, mask, number_of_shuffles, rng),
+                          freqs, np.repeat(mask, number_of_shuffles, axis=0))
+
+    return pgrams.max(axis=1).reshape((n_curves, number_of_shuffles))
+
+def bootstrap_maxima_task(args):
+    """ Calls bootstrap_maxima with a tuple of arguments, to be used by a
+        pool of processes.
+
+        args - Tuple with the arguments of bootstrap_maxima.
+
+    """
+
+    return bootstrap_maxima(*args)
+
+def bootstrap_fap(engine, peak_values, times, mags, freqs, mask,
+                  number_of_shuffles = 1000, processes = None, seed = 0,
+                  shuffles_per_task = 50):
+    """ Returns the false alarm probabilities of the maximums of several
+        periodgrams, as the fraction of the periodgrams of the curves with
+        their magnitudes shuffled whose maximum is not lower. The shuffles
+        are divided in tasks calculated by a pool of processes.
+
+        engine - PeriodEngine used to calculate the periodgrams, it must be
+            possible to pickle it.
+        peak_values - Matrix with the values of the maximums of each
+            periodgram of the magnitudes centered in a row.
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        freqs - Angular frequencies, a vector or a matrix with the
+            frequencies of each curve in a row.
+        mask - Boolean matrix that indicates the valid values of times and
+            mags, the valid values of each row must be the first ones.
+        number_of_shuffles - Number of shuffles of each curve.
+        processes - Number of processes, 1 to calculate the shuffles in this
+            process, None to use the number of processors.
+        seed - Seed for the random numbers.
+        shuffles_per_task - Maximum number of shuffles of each task.
+
+    """
+
+    peak_values = np.atleast_2d(np.asarray(peak_values, dtype=float))
+
+    times = np.atleast_2d(times)
+
+    if mask is None:
+        mask = np.ones(times.shape, dtype=bool)
+
+    # The curves shuffled are centered as the periodgrams of the peaks.
+    mags = centered_mags(mags, mask)
+
+    tasks = []
+
+    for first in range(0, number_of_shuffles, shuffles_per_task):
+        tasks.append((engine, times, mags, freqs, mask,
+                      min(shuffles_per_task, number_of_shuffles - first),
+                      seed + len(tasks)))
+
+    if processes == 1 or len(tasks) == 1:
+        maxima = [bootstrap_maxima_task(task) for task in tasks]
+    else:
+        pool = multiprocessing.Pool(processes)
+
+        try:
+            maxima = pool.map(bootstrap_maxima_task, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    maxima = np.concatenate(maxima, axis=1)
+
+    return (maxima[:, np.newaxis, :] >= peak_values[:, :, np.newaxis]).mean(axis=2)
@@ -0,0 +1,347 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module declares the features that can be calculated for a light curve,
+in the order they are written. Each feature declares the intermediate value
+it is taken from, several features can share the same intermediate, and the
+intermediates are only calculated for the features selected, once per
+curve. The intermediates common to several non periodic features, as the
+sorted magnitudes or the differences of consecutive measures, are kept by
+the NonPeriodicFeature object of the curve.
+
+"""
+
+import harmonicfit
+import periodicfeature
+import nonperiodicfeature
+
+# Sources of the features, in the order their features are written.
+PERIODIC = 'periodic'
+NON_PERIODIC = 'non_periodic'
+FAP = 'fap'
+HARMONIC = 'harmonic'
+SOURCES = [PERIODIC, NON_PERIODIC, FAP, HARMONIC]
+
+# Number of maximum frequencies used by the features.
+NUMBER_OF_FREQ = 3
+
+class FeatureDefinition(object):
+    """ Declaration of a feature, its name, the source of the feature and
+        the intermediate value it is taken from.
+
+    """
+
+    def __init__(self, name_, source_, intermediate_, position_ = None):
+        """ Instantiation method for the FeatureDefinition class.
+
+            name_ - Name of the feature.
+            source_ - Source of the feature, one of SOURCES.
+            intermediate_ - Name of the intermediate value of the feature.
+            position_ - Position of the feature in the intermediate value,
+                None if the intermediate is the value of the feature.
+
+        """
+
+        self.__name = name_
+        self.__source = source_
+        self.__intermediate = intermediate_
+        self.__position = position_
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def source(self):
+        return self.__source
+
+    @property
+    def intermediate(self):
+        return self.__intermediate
+
+    def value(self, intermediate_value):
+        """ Returns the value of the feature from its intermediate value.
+
+            intermediate_value - Value of the intermediate of the feature.
+
+        """
+
+        if self.__position is None:
+            return intermediate_value
+        else:
+            return intermediate_value[self.__position]
+
+def method_value(source, method, *args):
+    """ Returns a function that calculates an intermediate value calling a
+        method of the PeriodicFeature or NonPeriodicFeature object of a
+        curve, that returns the value and its name.
+
+        source - PERIODIC or NON_PERIODIC, the object whose method is called.
+        method - Name of the method.
+        args - Arguments of the method.
+
+    """
+
+    def value(perfeat, noperfeat):
+        feature_object = perfeat if source == PERIODIC else noperfeat
+
+        return getattr(feature_object, method)(*args)[0]
+
+    return value
+
+def harmonic_fit_value(perfeat, noperfeat):
+    """ Returns the features of the fit of the harmonics of the frequencies
+        of the maximums to a curve.
+
+        perfeat - PeriodicFeature of the curve.
+        noperfeat - NonPeriodicFeature of the curve.
+
+    """
+
+    features, names = harmonicfit.fit_features(
+        [(noperfeat.nmags, noperfeat.ntimes)],
+        [perfeat.lsprop.peak_freqs[:NUMBER_OF_FREQ]],
+        memory_budget = perfeat.lsprop.memory_budget)
+
+    return features[0]
+
+# Methods of NonPeriodicFeature for each non periodic feature, in order.
+NON_PERIODIC_METHODS = ['amplitude_dif', 'beyond1st', 'linear_trend',
+                        'max_slope', 'median_absolute_deviation',
+                        'median_buffer_range_percentage', 'pair_slope_trend',
+                        'percent_amplitude',
+                        'percent_difference_flux_percentile', 'skew',
+                        'kurtosis', 'std', 'flux_percentile_ratio_mid20',
+                        'flux_percentile_ratio_mid35',
+                        'flux_percentile_ratio_mid50',
+                        'flux_percentile_ratio_mid65',
+                        'flux_percentile_ratio_mid80']
+
+def default_definitions():
+    """ Returns the definitions of all the features, in the order they are
+        written, and a dictionary with the functions that calculate each
+        intermediate value from the PeriodicFeature and NonPeriodicFeature
+        objects of a curve.
+
+    """
+
+    definitions = []
+    intermediates = {}
+
+    # Periodic features, with the names given by PeriodicFeature.
+    periodic_names = iter(periodicfeature.PeriodicFeature.features_names(NUMBER_OF_FREQ))
+
+    for n in range(NUMBER_OF_FREQ):
+        intermediates['fund_freq_%d' % n] = method_value(PERIODIC, 'get_fund_freq', n)
+        definitions.append(FeatureDefinition(next(periodic_names), PERIODIC,
+                                             'fund_freq_%d' % n))
+
+        intermediates['amplitude_%d' % n] = method_value(PERIODIC, 'get_amplitude', n)
+        definitions.append(FeatureDefinition(next(periodic_names), PERIODIC,
+                                             'amplitude_%d' % n))
+
+        # The amplitudes of the harmonics are calculated together.
+        intermediates['harmonics_%d' % n] = \
+            method_value(PERIODIC, 'get_amplitude_firsts_harm', n)
+
+        for h in range(4):
+            definitions.append(FeatureDefinition(next(periodic_names), PERIODIC,
+                                                 'harmonics_%d' % n, h))
+
+    intermediates['freq_offset'] = method_value(PERIODIC, 'freq_y_offset')
+    definitions.append(FeatureDefinition(next(periodic_names), PERIODIC,
+                                         'freq_offset'))
+
+    # Non periodic features.
+    for method, name in zip(NON_PERIODIC_METHODS,
+                            nonperiodicfeature.NonPeriodicFeature.features_names()):
+        intermediates[method] = method_value(NON_PERIODIC, method)
+        definitions.append(FeatureDefinition(name, NON_PERIODIC, method))
+
+    # False alarm probabilities of the maximums.
+    for n, name in enumerate(periodicfeature.PeriodicFeature.faps_names(NUMBER_OF_FREQ)):
+        intermediates['fap_%d' % n] = method_value(PERIODIC, 'get_fap', n)
+        definitions.append(FeatureDefinition(name, FAP, 'fap_%d' % n))
+
+    # Fit of the harmonics, all the features come from the same fit.
+    intermediates['harmonic_fit'] = harmonic_fit_value
+
+    for position, name in enumerate(harmonicfit.features_names(NUMBER_OF_FREQ)):
+        definitions.append(FeatureDefinition(name, HARMONIC, 'harmonic_fit',
+                                             position))
+
+    return definitions, intermediates
+
+DEFINITIONS, INTERMEDIATES = default_definitions()
+
+class FeatureRegistry(object):
+    """ Selection of the features to calculate, in the order of
+        DEFINITIONS. The false alarm probabilities and the fit of the
+        harmonics are also enabled by the properties of the periodgram, so
+        they are only calculated if selected and enabled.
+
+    """
+
+    def __init__(self, names_ = None):
+        """ Instantiation method for the FeatureRegistry class.
+
+            names_ - Names of the features to calculate, None for all the
+                features. A name shared by several features, as those of
+                the amplitudes of the harmonics of each frequency, selects
+                all of them.
+
+        """
+
+        all_names = [definition.name for definition in DEFINITIONS]
+
+        if names_ is not None:
+            unknown = [name for name in names_ if name not in all_names]
+
+            if len(unknown) > 0:
+                raise ValueError("Features not valid: %s" % ', '.join(unknown))
+
+        self.__selected = [names_ is None or definition.name in names_
+                           for definition in DEFINITIONS]
+
+    @staticmethod
+    def is_enabled(source, lsprop):
+        """ Returns if the features of a source are calculated with some
+            properties of the periodgram.
+
+            source - Source of the features.
+            lsprop - Properties used to calculate the periodgrams.
+
+        """
+
+        if source == FAP:
+            return lsprop.fap_method is not None
+        elif source == HARMONIC:
+            return lsprop.harmonic_fit
+        else:
+            return True
+
+    def definitions(self, lsprop = None, sources = SOURCES):
+        """ Returns the definitions of the features selected.
+
+            lsprop - Properties used to calculate the periodgrams, to
+                discard the sources not enabled. None to return the
+                definitions of all the sources.
+            sources - Sources of the definitions returned.
+
+        """
+
+        return [definition for definition, selected in
+                zip(DEFINITIONS, self.__selected)
+                if selected and definition.source in sources and
+                (lsprop is None or FeatureRegistry.is_enabled(definition.source, lsprop))]
+
+    def names(self, lsprop = None, sources = SOURCES):
+        """ Returns the names of the features selected.
+
+            lsprop - Properties used to calculate the periodgrams, to
+                discard the sources not enabled.
+            sources - Sources of the names returned.
+
+        """
+
+        return [definition.name for definition in self.definitions(lsprop, sources)]
+
+    def uses(self, source, lsprop = None):
+        """ Returns if any feature of a source is selected and enabled.
+
+            source - Source of the features.
+            lsprop - Properties used to calculate the periodgrams.
+
+        """
+
+        return len(self.definitions(lsprop, [source])) > 0
+
+    def intermediates(self, lsprop = None):
+        """ Returns the names of the intermediate values needed by the
+            features selected, in the order they are calculated.
+
+            lsprop - Properties used to calculate the periodgrams.
+
+        """
+
+        names = []
+
+        for definition in self.definitions(lsprop):
+            if definition.intermediate not in names:
+                names.append(definition.intermediate)
+
+        return names
+
+    def columns(self, source):
+        """ Returns the positions of the features selected among all the
+            features of a source, to select the columns of the matrices of
+            features calculated at once for several curves.
+
+            source - Source of the features.
+
+        """
+
+        source_selected = [selected for definition, selected in
+                           zip(DEFINITIONS, self.__selected)
+                           if definition.source == source]
+
+        return [i for i, selected in enumerate(source_selected) if selected]
+
+    def evaluate(self, perfeat, noperfeat, sources = SOURCES):
+        """ Calculates the features selected of a curve and returns a
+            vector with the features and another with their names. Each
+            intermediate value is calculated once.
+
+            perfeat - PeriodicFeature of the curve, it may be None if no
+                periodic feature is calculated.
+            noperfeat - NonPeriodicFeature of the curve.
+            sources - Sources of the features calculated.
+
+        """
+
+        lsprop = perfeat.lsprop if perfeat is not None else None
+
+        values = {}
+
+        features = []
+        features_names = []
+
+        for definition in self.definitions(lsprop, sources):
+            intermediate = definition.intermediate
+
+            if intermediate not in values:
+                values[intermediate] = INTERMEDIATES[intermediate](perfeat, noperfeat)
+
+            features.append(definition.value(values[intermediate]))
+            features_names.append(definition.name)
+
+        return features, features_names
+
+def registry_from_names(names):
+    """ Returns the registry of the features whose names are received
+        separated by commas, or of all the features if names is None.
+
+        names - Names of the features separated by commas, or None.
+
+    """
+
+    if names is None:
+        return FeatureRegistry()
+    else:
+        return FeatureRegistry([name.strip() for name in names.split(',')
+                                if len(name.strip()) > 0])
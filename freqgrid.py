@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module plans the grids of frequencies used to calculate the
+periodgrams. The grids are kept in a cache, so the curves that need the
+same grid share the same array.
+
+"""
+
+import math
+import threading
+import collections
+import numpy as np
+
+class GridCache(object):
+    """ Cache of the grids of frequencies, indexed by the values that
+        determine each grid. When the cache is full, the grid used least
+        recently is discarded. The cache can be shared by several threads,
+        the grids are searched and stored holding a lock.
+
+    """
+
+    def __init__(self, max_grids_ = 64):
+        """ Instantiation method for the GridCache class.
+
+            max_grids_ - Maximum number of grids kept in the cache.
+
+        """
+
+        self.__max_grids = max_grids_
+        self.__grids = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        """ Return the number of grids in the cache. """
+
+        return len(self.__grids)
+
+    def get(self, key, create):
+        """ Returns the grid for the key received, creating it with the
+            function received if it is not in the cache.
+
+            key - Values that determine the grid.
+            create - Function without arguments that returns the grid.
+
+        """
+
+        with self.__lock:
+            try:
+                grid = self.__grids.pop(key)
+            except KeyError:
+                grid = create()
+                # The grid is shared, so it can't be modified.
+                grid.flags.writeable = False
+
+                if len(self.__grids) >= self.__max_grids:
+                    self.__grids.popitem(last = False)
+
+            # The grid is stored again as the most recently used.
+            self.__grids[key] = grid
+
+            return grid
+
+    def clear(self):
+        """ Removes all the grids. """
+
+        with self.__lock:
+            self.__grids.clear()
+
+# Cache shared by all the periodgrams calculated.
+GRID_CACHE = GridCache()
+
+def fixed_grid(min_freq, max_freq, number_of_freqs):
+    """ Returns a grid of a fixed number of frequencies between the limits
+        received.
+
+        min_freq - First frequency.
+        max_freq - Last frequency.
+        number_of_freqs - Number of frequencies.
+
+    """
+
+    key = ('fixed', min_freq, max_freq, number_of_freqs)
+
+    return GRID_CACHE.get(key,
+        lambda: np.linspace(min_freq, max_freq, number_of_freqs))
+
+def baseline_bucket(baseline, bucket_ratio):
+    """ Returns the upper limit of the bucket that contains the baseline
+        received. The limits of the buckets grow geometrically with the
+        ratio received, so the baselines that differ in less than this
+        ratio share the same bucket. Raises ValueError if the baseline
+        isn't positive.
+
+        baseline - Time between the first and last measures of a curve.
+        bucket_ratio - Relative size of the buckets.
+
+    """
+
+    if not baseline > 0:
+        raise ValueError('The baseline %s of a grid must be positive.' % baseline)
+
+    step = math.log(1 + bucket_ratio)
+
+    return math.exp((math.floor(math.log(baseline) / step) + 1) * step)
+
+def baseline_grid(baseline, number_of_obs, oversampling = 5,
+                  nyquist_factor = 1, bucket_ratio = 0.05,
+                  max_number_of_freqs = 1000000):
+    """ Returns a grid of angular frequencies derived from the baseline and
+        the number of observations of a curve. The step is the width of the
+        peaks of the periodgram, 2 * pi / baseline, divided by the
+        oversampling factor, and the maximum frequency is the average
+        Nyquist frequency of the observations times the nyquist factor.
+        The baseline and the number of observations are rounded up to the
+        limits of their buckets, so that curves with similar baselines and
+        numbers of observations share the grid and their periodgrams are
+        calculated at once. Raises ValueError if the baseline isn't positive.
+
+        baseline - Time between the first and last measures of a curve.
+        number_of_obs - Number of observations of the curve.
+        oversampling - Number of frequencies in the width of a peak.
+        nyquist_factor - Ratio between the maximum frequency and the
+            average Nyquist frequency.
+        bucket_ratio - Relative size of the buckets of baselines and numbers
+            of observations.
+        max_number_of_freqs - Maximum size of the grid.
+
+    """
+
+    bucket = baseline_bucket(baseline, bucket_ratio)
+
+    # The maximum frequency is never lower than that of the curve. Wider
+    # buckets would share more grids, but the time of the periodgrams grows
+    # with the number of frequencies more than it is saved calculating
+    # them at once.
+    number_of_obs = int(math.ceil(baseline_bucket(max(number_of_obs, 1),
+                                                  bucket_ratio)))
+
+    key = ('baseline', bucket, number_of_obs, oversampling, nyquist_factor,
+           max_number_of_freqs)
+
+    def create():
+        step = 2 * math.pi / (oversampling * bucket)
+        max_freq = nyquist_factor * math.pi * number_of_obs / bucket
+
+        number_of_freqs = int(min(max(max_freq / step, 2), max_number_of_freqs))
+
+        return step * np.arange(1, number_of_freqs + 1)
+
+    return GRID_CACHE.get(key, create)
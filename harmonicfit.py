@@ -0,0 +1,307 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module fits to the light curves a sum of harmonics of the frequencies
+found in their periodgrams, plus a constant and a linear trend, as done by
+Debosscher et al. (2007). The amplitudes and phases of the harmonics are
+used as features with the names of the columns of the Debosscher dataset.
+The curves are fitted in batches, the curves observed at the same times
+with the same frequencies share the calculation of the least squares
+solution.
+
+"""
+
+import numpy as np
+import lombscargle
+
+# Number of harmonics fitted for each frequency.
+NUMBER_OF_HARMONICS = 4
+
+# Singular values of the design matrices lower than this fraction of the
+# highest one are ignored, the columns of harmonics that coincide with
+# other harmonics share their amplitude instead of getting huge opposite
+# amplitudes.
+RCOND = 1e-8
+
+# Names of the features calculated.
+AMP_FEAT_NAME = "amp"
+PHI_FEAT_NAME = "phi"
+TREND_FEAT_NAME = "trend"
+VARRAT_FEAT_NAME = "varrat"
+VARRED_FEAT_NAME = "varred"
+
+def features_names(number_of_freq = 3, number_of_harmonics = NUMBER_OF_HARMONICS):
+    """ Returns the names of the features calculated by fit_features.
+
+        number_of_freq - Number of frequencies fitted.
+        number_of_harmonics - Number of harmonics of each frequency.
+
+    """
+
+    amps = ["%s%d%d" % (AMP_FEAT_NAME, i + 1, j + 1)
+            for i in range(number_of_freq) for j in range(number_of_harmonics)]
+
+    # The phase of the first harmonic of the first frequency is the origin
+    # of the phases, so it is not a feature.
+    phis = ["%s%d%d" % (PHI_FEAT_NAME, i + 1, j + 1)
+            for i in range(number_of_freq) for j in range(number_of_harmonics)
+            if i > 0 or j > 0]
+
+    return amps + phis + [TREND_FEAT_NAME, VARRAT_FEAT_NAME, VARRED_FEAT_NAME]
+
+def design_matrices(times, freqs, number_of_harmonics = NUMBER_OF_HARMONICS):
+    """ Returns the design matrices of the fits of several curves, with the
+        values of a constant, a linear trend and the sine and cosine of each
+        harmonic of each frequency, in this order, at the times of a curve.
+        The times are scaled to the interval [-1, 1] for the trend, and the
+        scale is also returned to obtain the trend in the units of the times.
+
+        times - Matrix with the times of a curve in each row.
+        freqs - Matrix with the angular frequencies of each curve in a row.
+        number_of_harmonics - Number of harmonics of each frequency.
+
+    """
+
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+
+    n_curves, n_times = times.shape
+
+    first = times.min(axis=1)[:, np.newaxis]
+    scale = (times.max(axis=1)[:, np.newaxis] - first) / 2
+    scale[scale == 0] = 1
+
+    # Angular frequencies of the harmonics, in the order of the columns.
+    harm_freqs = (freqs[:, :, np.newaxis] *
+                  np.arange(1, number_of_harmonics + 1)).reshape((n_curves, -1))
+
+    arg = harm_freqs[:, np.newaxis, :] * times[:, :, np.newaxis]
+
+    design = np.empty((n_curves, n_times, 2 + 2 * harm_freqs.shape[1]))
+
+    design[:, :, 0] = 1
+    design[:, :, 1] = (times - first) / scale - 1
+    design[:, :, 2::2] = np.sin(arg)
+    design[:, :, 3::2] = np.cos(arg)
+
+    return design, scale[:, 0]
+
+def least_squares(design, mags, mask = None):
+    """ Returns the coefficients of the least squares fits of several curves
+        and the variances of their residuals. The pseudoinverses of the
+        design matrices of all the curves are calculated at once, so the
+        frequencies repeated or too close don't make the fit fail.
+
+        design - Design matrices of the curves, as returned by
+            design_matrices.
+        mags - Matrix with the magnitudes of a curve in each row.
+        mask - Boolean matrix that indicates the valid values of mags, used
+            when the curves are padded to the same length.
+
+    """
+
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+
+    if mask is None:
+        weights = np.ones(mags.shape)
+    else:
+        weights = np.asarray(mask, dtype=float)
+
+    weighted = design * weights[:, :, np.newaxis]
+
+    coefs = np.einsum('cpn,cn->cp', np.linalg.pinv(weighted, RCOND), mags * weights)
+
+    residuals = (mags - np.einsum('cnp,cp->cn', design, coefs)) * weights
+
+    return coefs, residuals_variance(residuals, weights)
+
+def shared_least_squares(design, mags):
+    """ Returns the coefficients of the least squares fits of several curves
+        with the same design matrix and the variances of their residuals.
+        The pseudoinverse of the design matrix is calculated once for all
+        the curves.
+
+        design - Design matrix shared by the curves.
+        mags - Matrix with the magnitudes of a curve in each row.
+
+    """
+
+    coefs = np.dot(mags, np.linalg.pinv(design, RCOND).T)
+
+    residuals = mags - np.dot(coefs, design.T)
+
+    return coefs, residuals_variance(residuals, np.ones(mags.shape))
+
+def residuals_variance(residuals, weights):
+    """ Returns the variance of the residuals of each curve.
+
+        residuals - Matrix with the residuals of a curve in each row, 0 for
+            the invalid values.
+        weights - Matrix with 1 for the valid values and 0 for the others.
+
+    """
+
+    count = np.maximum(weights.sum(axis=1), 1)
+
+    mean = residuals.sum(axis=1) / count
+
+    return (((residuals - mean[:, np.newaxis]) * weights) ** 2).sum(axis=1) / count
+
+def fit_curves(times, mags, freqs, mask = None,
+               number_of_harmonics = NUMBER_OF_HARMONICS,
+               memory_budget = lombscargle.MEMORY_BUDGET):
+    """ Fits the harmonics of the frequencies of several curves and returns
+        the coefficients of the fits, the variances of their residuals and
+        the scales of the times used for the trend. When all the curves
+        have the same times the curves with the same frequencies share the
+        solution of the least squares problem.
+
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        freqs - Matrix with the angular frequencies of each curve in a row.
+        mask - Boolean matrix that indicates the valid values of times and
+            mags, used when the curves are padded to the same length.
+        number_of_harmonics - Number of harmonics of each frequency.
+        memory_budget - Maximum number of bytes of the design matrices, the
+            curves are fitted in blocks that fit in it.
+
+    """
+
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+    freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+
+    same_times = (mask is None or np.all(mask)) and np.all(times == times[0])
+
+    n_curves = len(mags)
+    n_coefs = 2 + 2 * freqs.shape[1] * number_of_harmonics
+
+    coefs = np.empty((n_curves, n_coefs))
+    variances = np.empty(n_curves)
+
+    if not same_times:
+        scale = np.empty(n_curves)
+
+        # The design matrices and their products with the weights are
+        # calculated for blocks of curves that fit in the memory budget.
+        step = max(1, min(n_curves, lombscargle.block_length(
+            memory_budget, times.shape[1] * n_coefs, 16)))
+
+        for first in range(0, n_curves, step):
+            rows = slice(first, first + step)
+
+            design, scale[rows] = design_matrices(times[rows], freqs[rows],
+                                                  number_of_harmonics)
+
+            coefs[rows], variances[rows] = least_squares(
+                design, mags[rows], None if mask is None else mask[rows])
+
+        return coefs, variances, scale
+
+    # The curves are grouped by their frequencies.
+    unique_freqs, groups = np.unique(freqs, axis=0, return_inverse=True)
+    groups = np.asarray(groups).reshape(-1)
+
+    for group in range(len(unique_freqs)):
+        rows = groups == group
+
+        design, scale = design_matrices(times[:1], unique_freqs[group:group + 1],
+                                        number_of_harmonics)
+
+        coefs[rows], variances[rows] = shared_least_squares(design[0], mags[rows])
+
+    return coefs, variances, np.repeat(scale, n_curves)
+
+def fit_features(curves, freqs, number_of_harmonics = NUMBER_OF_HARMONICS,
+                 memory_budget = lombscargle.MEMORY_BUDGET):
+    """ Fits the harmonics of the frequencies of several curves. Returns a
+        matrix with the features of each curve in a row, the amplitudes of
+        the harmonics, their phases regarding the first harmonic of the
+        first frequency, the linear trend and the ratios of the variance of
+        the residuals of the fits with the first frequency and with all the
+        frequencies to the variance of the magnitudes. It also returns the
+        names of the features.
+
+        curves - List of (mags, times) pairs.
+        freqs - Matrix with the angular frequencies of each curve in a row,
+            the first one is the main frequency.
+        number_of_harmonics - Number of harmonics of each frequency.
+        memory_budget - Maximum number of bytes of the design matrices.
+
+    """
+
+    freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+
+    n_curves, number_of_freq = freqs.shape
+
+    mags, times, mask = pad_or_stack(curves)
+
+    coefs, variances, scale = fit_curves(times, mags, freqs, mask,
+                                         number_of_harmonics, memory_budget)
+
+    first_coefs, first_variances, first_scale = \
+        fit_curves(times, mags, freqs[:, :1], mask, number_of_harmonics,
+                   memory_budget)
+
+    # Coefficients of the sines and cosines of each harmonic.
+    sin_coefs = coefs[:, 2::2].reshape((n_curves, number_of_freq,
+                                        number_of_harmonics))
+    cos_coefs = coefs[:, 3::2].reshape((n_curves, number_of_freq,
+                                        number_of_harmonics))
+
+    amps = np.sqrt(sin_coefs ** 2 + cos_coefs ** 2)
+    phases = np.arctan2(cos_coefs, sin_coefs)
+
+    # The phases are referred to the first harmonic of the first frequency,
+    # scaled by the ratio of the frequencies of each harmonic.
+    main_freqs = freqs[:, :1, np.newaxis]
+    ratios = np.where(main_freqs != 0,
+                      freqs[:, :, np.newaxis] *
+                      np.arange(1, number_of_harmonics + 1) /
+                      np.where(main_freqs != 0, main_freqs, 1), 0)
+
+    phis = phases - ratios * phases[:, :1, :1]
+    phis = np.arctan2(np.sin(phis), np.cos(phis)).reshape((n_curves, -1))[:, 1:]
+
+    # Variance of the magnitudes of each curve.
+    weights = np.ones(mags.shape) if mask is None else mask.astype(float)
+    mags_variances = residuals_variance(mags * weights, weights)
+    mags_variances[mags_variances == 0] = 1
+
+    features = np.hstack((amps.reshape((n_curves, -1)), phis,
+                          (coefs[:, 1] / scale)[:, np.newaxis],
+                          (first_variances / mags_variances)[:, np.newaxis],
+                          (variances / mags_variances)[:, np.newaxis]))
+
+    return features, features_names(number_of_freq, number_of_harmonics)
+
+def pad_or_stack(curves):
+    """ Returns the magnitudes and times of several curves in two matrices
+        with a curve in each row. If the curves have different lengths they
+        are padded, and a boolean matrix that indicates the valid values of
+        each row is also returned, otherwise it is None.
+
+        curves - List of (mags, times) pairs.
+
+    """
+
+    if len(set([len(mags) for mags, times in curves])) == 1:
+        return np.array([mags for mags, times in curves], dtype=float), \
+            np.array([times for mags, times in curves], dtype=float), None
+
+    return lombscargle.pad_curves(curves)
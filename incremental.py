@@ -0,0 +1,381 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module updates the periodgrams of the stars when new measures are
+added to their light curves. The sums over the measures used by the
+Lomb Scargle method are stored for each star and filter, so only the sums
+of the new measures are calculated.
+
+"""
+
+import os
+import hashlib
+import logging
+import numpy as np
+import lombscargle
+
+def lombscargle_sums(times, mags, freqs, memory_budget = lombscargle.MEMORY_BUDGET):
+    """ Returns the sums over the measures of a curve of y * c, y * s, c * c,
+        s * s and c * s, for the magnitudes y, c = cos(w * t) and
+        s = sin(w * t) for each frequency w.
+
+        times - Times of the measures.
+        mags - Magnitudes of the measures.
+        freqs - Angular frequencies.
+        memory_budget - Maximum number of bytes of the temporary arrays,
+            the frequencies are calculated in blocks that fit in it.
+
+    """
+
+    times = np.asarray(times, dtype=float)
+    mags = np.asarray(mags, dtype=float)
+    freqs = np.asarray(freqs, dtype=float)
+
+    n_freqs = len(freqs)
+
+    sums = np.zeros((5, n_freqs))
+
+    if len(times) == 0:
+        return sums
+
+    # A buffer more is used for the products of sines and cosines.
+    step = min(n_freqs, lombscargle.block_length(
+        memory_budget, len(times),
+        lombscargle.trig_bytes_per_element(np.float64) + 8))
+
+    arg_buffer, cos_buffer, sin_buffer = \
+        lombscargle.trig_buffers((step, len(times)), np.float64)
+    product_buffer = np.empty((step, len(times)))
+
+    for first in range(0, n_freqs, step):
+        last = min(first + step, n_freqs)
+
+        arg = arg_buffer[:last - first]
+        c = cos_buffer[:last - first]
+        s = sin_buffer[:last - first]
+        product = product_buffer[:last - first]
+
+        np.multiply(freqs[first:last, np.newaxis], times[np.newaxis, :],
+                    out=arg)
+        lombscargle.fill_trig(arg, c, s)
+
+        sums[0, first:last] = np.dot(c, mags)
+        sums[1, first:last] = np.dot(s, mags)
+        sums[2, first:last] = np.multiply(c, c, out=product).sum(axis=1)
+        sums[3, first:last] = np.multiply(s, s, out=product).sum(axis=1)
+        sums[4, first:last] = np.multiply(c, s, out=product).sum(axis=1)
+
+    return sums
+
+def array_digest(*arrays):
+    """ Returns a hash of the values of the arrays received.
+
+        arrays - Arrays to hash.
+
+    """
+
+    digest = hashlib.sha1()
+
+    for array in arrays:
+        digest.update(np.ascontiguousarray(array, dtype=float).tobytes())
+
+    return digest.hexdigest()
+
+class PeriodgramAccumulator(object):
+    """ Sums over the measures of a curve needed to calculate its Lomb
+        Scargle periodgram. It keeps the origin of times and the grid of
+        frequencies of the sums, and a hash of the measures summed, to check
+        that the sums can be updated with the new measures of a curve.
+
+    """
+
+    def __init__(self, origin_, number_of_obs_, grid_digest_,
+                 measures_digest_, sums_):
+        """ Instantiation method for the PeriodgramAccumulator class.
+
+            origin_ - Unix time used as origin of the times.
+            number_of_obs_ - Number of measures summed.
+            grid_digest_ - Hash of the frequencies.
+            measures_digest_ - Hash of the times and magnitudes summed.
+            sums_ - Matrix with the sums xc, xs, cc, ss and cs in each row.
+
+        """
+
+        self.__origin = origin_
+        self.__number_of_obs = number_of_obs_
+        self.__grid_digest = grid_digest_
+        self.__measures_digest = measures_digest_
+        self.__sums = sums_
+
+    @property
+    def origin(self):
+        return self.__origin
+
+    @property
+    def number_of_obs(self):
+        return self.__number_of_obs
+
+    @property
+    def grid_digest(self):
+        return self.__grid_digest
+
+    @property
+    def measures_digest(self):
+        return self.__measures_digest
+
+    @property
+    def sums(self):
+        return self.__sums
+
+    @staticmethod
+    def from_curve(curve, freqs, memory_budget = lombscargle.MEMORY_BUDGET):
+        """ Returns the accumulator with the sums of all the measures of a
+            curve.
+
+            curve - PreparedCurve to sum.
+            freqs - Angular frequencies of the periodgram.
+            memory_budget - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        return PeriodgramAccumulator(curve.first_time, len(curve),
+                                     array_digest(freqs),
+                                     array_digest(curve.times, curve.mags),
+                                     lombscargle_sums(curve.times, curve.mags,
+                                                      freqs, memory_budget))
+
+    def can_update(self, curve, freqs):
+        """ Checks if the sums can be updated with the measures of a curve.
+            It is possible if the curve uses the same origin of times and
+            frequencies and its first measures are those already summed.
+
+            curve - PreparedCurve with new measures.
+            freqs - Angular frequencies of the periodgram of the curve.
+
+        """
+
+        n = self.__number_of_obs
+
+        return curve.first_time == self.__origin and len(curve) >= n and \
+            array_digest(freqs) == self.__grid_digest and \
+            array_digest(curve.times[:n], curve.mags[:n]) == self.__measures_digest
+
+    def update(self, curve, freqs, memory_budget = lombscargle.MEMORY_BUDGET):
+        """ Adds to the sums the measures of a curve not summed yet. The curve
+            must be accepted by can_update.
+
+            curve - PreparedCurve with new measures.
+            freqs - Angular frequencies of the periodgram of the curve.
+            memory_budget - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        n = self.__number_of_obs
+
+        if len(curve) > n:
+            self.__sums += lombscargle_sums(curve.times[n:], curve.mags[n:],
+                                            freqs, memory_budget)
+
+            self.__number_of_obs = len(curve)
+            self.__measures_digest = array_digest(curve.times, curve.mags)
+
+    def periodgram(self):
+        """ Returns the periodgram calculated from the sums. """
+
+        return lombscargle.pgram_from_sums(*self.__sums)
+
+class AccumulatorStore(object):
+    """ Stores in a directory the accumulators of the stars, a file for each
+        star and filter.
+
+    """
+
+    FILE_EXT = '.npz'
+
+    def __init__(self, directory_):
+        """ Instantiation method for the AccumulatorStore class.
+
+            directory_ - Directory to store the accumulators, it is created
+                if it doesn't exist.
+
+        """
+
+        self.__directory = directory_
+
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    def __path(self, star_id, pfilter):
+
+        return os.path.join(self.__directory, '%s_%s%s' %
+                            (star_id, pfilter, AccumulatorStore.FILE_EXT))
+
+    def load(self, star_id, pfilter):
+        """ Returns the accumulator stored for a star and filter, or None if
+            it doesn't exist.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+
+        """
+
+        try:
+            data = np.load(self.__path(star_id, pfilter))
+
+            try:
+                return PeriodgramAccumulator(float(data['origin']),
+                                             int(data['number_of_obs']),
+                                             str(data['grid_digest']),
+                                             str(data['measures_digest']),
+                                             np.array(data['sums']))
+            finally:
+                data.close()
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def save(self, star_id, pfilter, accumulator):
+        """ Stores the accumulator of a star and filter.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+            accumulator - PeriodgramAccumulator to store.
+
+        """
+
+        path = self.__path(star_id, pfilter)
+
+        # The file is written with another name and renamed, so a partial
+        # file is never read.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+
+        with open(temp_path, 'wb') as temp_file:
+            np.savez(temp_file, origin = accumulator.origin,
+                     number_of_obs = accumulator.number_of_obs,
+                     grid_digest = accumulator.grid_digest,
+                     measures_digest = accumulator.measures_digest,
+                     sums = accumulator.sums)
+
+        os.rename(temp_path, path)
+
+class IncrementalLombScargle(lombscargle.LombScargle):
+    """ Calculates the Lomb Scargle periodgrams of the stars updating the
+        sums stored for each star with its new measures. When the origin of
+        times, the grid of frequencies or the measures already summed have
+        changed, all the sums are calculated again. The sums are always
+        calculated directly in double precision, so the properties must
+        indicate the Lomb Scargle engine, DIRECT_METHOD and 
+        DOUBLE_PRECISION.
+
+    """
+
+    def __init__(self, lsprop_, store_):
+        """ Instantiation method for the IncrementalLombScargle class.
+
+            lsprop_ - Parameters to use to calculate the Lomb Scargle periodgram.
+            store_ - AccumulatorStore with the sums of the stars.
+            Raises ValueError if the properties indicate an engine, a 
+            method or a precision different from those of the sums.
+
+        """
+
+        # The periodgrams and the false alarm probabilities of all the 
+        # stars must be calculated with the same engine and method.
+        if lsprop_.engine != lombscargle.LSProperties.LOMB_SCARGLE_ENGINE or \
+            lsprop_.method != lombscargle.LSProperties.DIRECT_METHOD or \
+            lsprop_.precision != lombscargle.LSProperties.DOUBLE_PRECISION:
+            raise ValueError("The periodgrams updated with the new measures are only calculated with the engine %s, the method %s and the precision %s." %
+                             (lombscargle.LSProperties.LOMB_SCARGLE_ENGINE,
+                              lombscargle.LSProperties.DIRECT_METHOD,
+                              lombscargle.LSProperties.DOUBLE_PRECISION))
+
+        lombscargle.LombScargle.__init__(self, lsprop_)
+
+        self.store = store_
+        self.updates = 0
+        self.recomputes = 0
+
+    def accumulate(self, star_id, pfilter, curve, freqs):
+        """ Returns the accumulator of a star updated with the measures of
+            its curve, and stores it.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+            curve - PreparedCurve of the star.
+            freqs - Angular frequencies of the periodgram.
+
+        """
+
+        accumulator = self.store.load(star_id, pfilter)
+
+        if accumulator is not None and accumulator.can_update(curve, freqs):
+            accumulator.update(curve, freqs, self.lsprop.memory_budget)
+            self.updates += 1
+        else:
+            accumulator = PeriodgramAccumulator.from_curve(
+                curve, freqs, self.lsprop.memory_budget)
+            self.recomputes += 1
+
+        self.store.save(star_id, pfilter, accumulator)
+
+        return accumulator
+
+    def calculate_periodgrams_of_stars(self, curves, stars_ids, pfilter):
+        """ Calculates the periodgrams of the curves of several stars in a
+            filter, with the same results that calculate_periodgrams.
+
+            curves - List of PreparedCurve objects.
+            stars_ids - Identifiers of the stars of the curves.
+            pfilter - Filter of the curves.
+
+        """
+
+        freqs = [self.get_freqs(curve) for curve in curves]
+
+        pgrams = [self.accumulate(star_id, pfilter, curve, curve_freqs).periodgram()
+                  for star_id, curve, curve_freqs in zip(stars_ids, curves, freqs)]
+
+        number_of_freq = self.lsprop.number_of_freq
+
+        index_max_values = np.zeros((len(curves), number_of_freq), dtype=int)
+        peak_freqs = np.zeros((len(curves), number_of_freq))
+        peak_values = np.zeros((len(curves), number_of_freq))
+
+        for i in range(len(curves)):
+            index_max_values[i], peak_freqs[i], peak_values[i] = \
+                [values[0] for values in
+                 self.search_peaks(pgrams[i], freqs[i], curves[i].times,
+                                   curves[i].mags)]
+
+        if len(set([len(f) for f in freqs])) == 1:
+            pgrams = np.array(pgrams)
+            freqs = np.array(freqs)
+
+        return pgrams, freqs, index_max_values, peak_freqs, peak_values
+
+    def log_stats(self):
+        """ Writes to the log the number of periodgrams updated and
+            calculated again.
+
+        """
+
+        logging.info('Incremental periodgrams in %s: %d updated, %d calculated again.' %
+                     (self.store.directory, self.updates, self.recomputes))
@@ -0,0 +1,280 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module reads the light curves of many stars from a LEMON database with
+one ordered query for a filter, instead of a query for each star. The rows
+are read in blocks into numpy arrays and grouped by star, so each curve is
+a set of arrays instead of a list of tuples.
+
+"""
+
+import os
+import logging
+import itertools
+import sqlite3
+import numpy as np
+
+# Tables of the LEMON database read by the loader, the subset of the LEMON
+# schema used to create stand-in databases.
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS images (
+        id INTEGER PRIMARY KEY,
+        filter TEXT NOT NULL,
+        unix_time REAL NOT NULL);
+    CREATE TABLE IF NOT EXISTS light_curves (
+        id INTEGER PRIMARY KEY,
+        image_id INTEGER NOT NULL,
+        star_id INTEGER NOT NULL,
+        magnitude REAL NOT NULL,
+        snr REAL,
+        FOREIGN KEY (image_id) REFERENCES images(id));
+    """
+
+class LoadedCurve(object):
+    """ Light curve of a star read by a LightCurveLoader, the times,
+        magnitudes and signal to noise ratios of its measures in arrays.
+        Iterating it returns the measures as the curves of LEMONdB.
+
+    """
+
+    def __init__(self, unix_times_, mags_, snrs_):
+        """ Instantiation method for the LoadedCurve class.
+
+            unix_times_ - Times of the measures, in unix time.
+            mags_ - Magnitudes of the measures.
+            snrs_ - Signal to noise ratios of the measures.
+
+        """
+
+        self.__unix_times = unix_times_
+        self.__mags = mags_
+        self.__snrs = snrs_
+
+    @property
+    def unix_times(self):
+        return self.__unix_times
+
+    @property
+    def mags(self):
+        return self.__mags
+
+    @property
+    def snrs(self):
+        return self.__snrs
+
+    def __len__(self):
+        return len(self.__mags)
+
+    def __iter__(self):
+        return iter(zip(self.__unix_times, self.__mags, self.__snrs))
+
+def curve_columns(curve):
+    """ Returns the times, magnitudes and signal to noise ratios of a curve,
+        read by a LightCurveLoader or by LEMONdB. Raises TypeError if the
+        curve is None, as unpacking a curve of LEMONdB.
+
+        curve - The light curve.
+
+    """
+
+    if isinstance(curve, LoadedCurve):
+        return curve.unix_times, curve.mags, curve.snrs
+    else:
+        return zip(*curve)
+
+class LightCurveLoader(object):
+    """ Reads the light curves of the stars of a LEMON database, all those
+        of a filter or of a list of stars with one query, and returns them
+        grouped by star and ordered by time.
+
+    """
+
+    # Number of rows read at once from the database.
+    FETCH_SIZE = 65536
+
+    # Maximum number of identifiers of stars in a query, below the limit
+    # of parameters of SQLite.
+    MAX_STARS_BY_QUERY = 900
+
+    # The rows are sorted by star and time after reading them, sorting them
+    # with numpy is faster than with SQLite.
+    QUERY = """
+        SELECT c.star_id, i.unix_time, c.magnitude, c.snr
+        FROM light_curves AS c INNER JOIN images AS i ON c.image_id = i.id
+        WHERE i.filter = ? %s
+        """
+
+    def __init__(self, filename_):
+        """ Instantiation method for the LightCurveLoader class.
+
+            filename_ - Name of the LEMON database file.
+
+        """
+
+        self.__filename = filename_
+        self.__connection = sqlite3.connect(filename_)
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    def close(self):
+        """ Closes the connection to the database. """
+
+        self.__connection.close()
+
+    def __read_rows(self, query, parameters):
+        """ Returns a matrix with the rows of a query, read in blocks.
+
+            query - SQL query.
+            parameters - Parameters of the query.
+
+        """
+
+        cursor = self.__connection.cursor()
+
+        try:
+            cursor.execute(query, parameters)
+
+            blocks = []
+
+            rows = cursor.fetchmany(LightCurveLoader.FETCH_SIZE)
+
+            while len(rows) > 0:
+                # The values are read directly from the rows, a missing 
+                # signal to noise ratio is read as nan.
+                blocks.append(np.fromiter(itertools.chain.from_iterable(rows),
+                                          dtype=float, 
+                                          count=4 * len(rows)).reshape((-1, 4)))
+
+                rows = cursor.fetchmany(LightCurveLoader.FETCH_SIZE)
+        finally:
+            cursor.close()
+
+        if len(blocks) == 0:
+            return np.zeros((0, 4))
+        else:
+            return np.concatenate(blocks)
+
+    @staticmethod
+    def __group_by_star(rows):
+        """ Returns a dictionary with the curve of each star of some rows,
+            with the measures sorted by time.
+
+            rows - Matrix with the identifier of the star, the time, the
+                magnitude and the signal to noise ratio of each measure.
+
+        """
+
+        curves = {}
+
+        rows = rows[np.lexsort((rows[:, 1], rows[:, 0]))]
+
+        stars_ids = rows[:, 0]
+
+        starts = np.concatenate(([0], np.flatnonzero(np.diff(stars_ids)) + 1))
+        ends = np.concatenate((starts[1:], [len(rows)]))
+
+        # The columns are copied so each one is contiguous.
+        unix_times = rows[:, 1].copy()
+        mags = rows[:, 2].copy()
+        snrs = rows[:, 3].copy()
+
+        for start, end in zip(starts, ends):
+            if end > start:
+                curves[int(stars_ids[start])] = LoadedCurve(unix_times[start:end],
+                                                            mags[start:end],
+                                                            snrs[start:end])
+
+        return curves
+
+    def load(self, pfilter, stars_ids = None):
+        """ Returns a dictionary with the light curve of each star in a
+            filter, the stars without measures in the filter are not
+            included.
+
+            pfilter - Filter of the light curves.
+            stars_ids - Identifiers of the stars to read, None to read all
+                the stars with measures in the filter.
+
+        """
+
+        if stars_ids is None:
+            return LightCurveLoader.__group_by_star(
+                self.__read_rows(LightCurveLoader.QUERY % '', (str(pfilter),)))
+
+        stars_ids = [int(star_id) for star_id in stars_ids]
+
+        curves = {}
+
+        for first in range(0, len(stars_ids), LightCurveLoader.MAX_STARS_BY_QUERY):
+            query_ids = stars_ids[first:first + LightCurveLoader.MAX_STARS_BY_QUERY]
+
+            condition = 'AND c.star_id IN (%s)' % ', '.join(['?'] * len(query_ids))
+
+            curves.update(LightCurveLoader.__group_by_star(
+                self.__read_rows(LightCurveLoader.QUERY % condition,
+                                 [str(pfilter)] + query_ids)))
+
+        return curves
+
+def open_loader(filename):
+    """ Returns a LightCurveLoader for a database, or None if the file
+        doesn't contain the tables of the light curves of LEMON.
+
+        filename - Name of the LEMON database file.
+
+    """
+
+    if not os.path.isfile(filename):
+        return None
+
+    loader = LightCurveLoader(filename)
+
+    try:
+        # Check that the tables read exist.
+        loader.load('', [-1])
+    except sqlite3.Error as e:
+        logging.warning("The light curves of %s can't be read at once, they are read star by star: %s" %
+                        (filename, e))
+
+        loader.close()
+
+        return None
+
+    return loader
+
+def curves_of_stars(db, loader, pfilter, stars_ids):
+    """ Returns a list with the light curve of each star in a filter, None
+        for the stars without curve. The curves are read at once if a
+        loader is received, otherwise they are read from the database one
+        by one.
+
+        db - LEMONdB of the light curves.
+        loader - LightCurveLoader of the same database or None.
+        pfilter - Filter of the light curves.
+        stars_ids - Identifiers of the stars.
+
+    """
+
+    if loader is None:
+        return [db.get_light_curve(star_id, pfilter) for star_id in stars_ids]
+
+    curves = loader.load(pfilter, stars_ids)
+
+    return [curves.get(int(star_id)) for star_id in stars_ids]
@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module prepares the light curves read from a LEMON database to
+calculate their features. The preparation sorts the measures, discards the
+first measures too far in time and expresses the times as increments
+regarding the first time used.
+
+"""
+
+import numpy as np
+
+def first_measure_index(unix_times):
+    """ Returns the index of the first measure to use in a curve,
+        discarding the first measures that are too far in time from the
+        rest of measures.
+        A measure is discarded while the mean of the intervals of time from
+        that measure differs too much from the mean of the intervals from
+        the next measure. The means of all the intervals from each measure
+        are calculated at once with a cumulative sum.
+
+        unix_times - Times (in unix times) when the magnitudes have been measured.
+
+    """
+
+    intervals = np.diff(np.asarray(unix_times, dtype=float))
+
+    number_of_intervals = len(intervals)
+
+    if number_of_intervals < 2:
+        return 0
+
+    # Mean of the intervals from each position to the end.
+    suffix_means = np.cumsum(intervals[::-1])[::-1] / \
+        np.arange(number_of_intervals, 0, -1)
+
+    previous_means = suffix_means[:-1]
+    new_means = suffix_means[1:]
+
+    dev = new_means + 0.1 * new_means
+
+    found = (previous_means < new_means + dev) & \
+        (previous_means > new_means - dev)
+
+    if np.any(found):
+        return int(np.argmax(found))
+    else:
+        return 0
+
+class PreparedCurve(object):
+    """ Light curve ready to calculate its features. It contains the
+        magnitudes and times of the measures used, with times as increments
+        regarding the first time used.
+        The values of a prepared curve can't be modified, so the same object
+        is used to calculate the periodgram and the non periodic features
+        without copying it.
+
+    """
+
+    def __init__(self, mags_, times_, first_time_):
+        """ Instantiation method for the PreparedCurve class.
+
+            mags_ - Magnitudes of the measures.
+            times_ - Times of the measures, beginning at time 0.
+            first_time_ - Unix time of the first measure.
+
+        """
+
+        self.__mags = mags_
+        self.__times = times_
+        self.__first_time = first_time_
+
+        self.__mags.flags.writeable = False
+        self.__times.flags.writeable = False
+
+    def __len__(self):
+        """ Return the number of measures of the curve. """
+
+        return len(self.__mags)
+
+    @property
+    def mags(self):
+        return self.__mags
+
+    @property
+    def times(self):
+        return self.__times
+
+    @property
+    def first_time(self):
+        return self.__first_time
+
+    @property
+    def baseline(self):
+        """ Time between the first and the last measure. """
+
+        return self.__times[-1] - self.__times[0] if len(self.__times) > 0 else 0.0
+
+    @property
+    def sample_freq(self):
+        """ Number of measures per unit of time. """
+
+        return (len(self.__times) - 1) / self.baseline
+
+def prepare_curve(mags, unix_times, sort = True, remove_duplicates = False,
+                  sigma_clip = None):
+    """ Prepares a light curve to calculate its features and returns it
+        as a PreparedCurve. Raises ValueError if the curve hasn't at least
+        two measures at different times, or has values that aren't finite.
+
+        mags - Magnitudes measured for the star.
+        unix_times - Times (in unix times) when the magnitudes have been measured.
+        sort - Sort the measures by time if they are not sorted. The
+            features of a curve not sorted by time change, as the first
+            measures discarded and the slopes depend on their order.
+        remove_duplicates - Keep only the first measure of each time.
+        sigma_clip - If not None, discard the measures whose distance to the
+            median is greater than this number of standard deviations.
+
+    """
+
+    mags = np.asarray(mags, dtype=float)
+    unix_times = np.asarray(unix_times, dtype=float)
+
+    if len(mags) != len(unix_times):
+        raise ValueError('The curve has %d magnitudes and %d times.' %
+                         (len(mags), len(unix_times)))
+
+    if not (np.all(np.isfinite(mags)) and np.all(np.isfinite(unix_times))):
+        raise ValueError('The curve has magnitudes or times that are not finite.')
+
+    intervals = np.diff(unix_times)
+
+    if sort and np.any(intervals < 0):
+        order = np.argsort(unix_times, kind='mergesort')
+        mags = mags[order]
+        unix_times = unix_times[order]
+        intervals = np.diff(unix_times)
+
+    if remove_duplicates and np.any(intervals == 0):
+        keep = np.concatenate(([True], intervals != 0))
+        mags = mags[keep]
+        unix_times = unix_times[keep]
+
+    first_measure = first_measure_index(unix_times)
+
+    first_time = unix_times[first_measure]
+
+    # Times as increments regarding the first time used.
+    times = unix_times[first_measure:] - first_time
+    mags = mags[first_measure:]
+
+    if sigma_clip is not None and len(mags) > 0:
+        keep = np.abs(mags - np.median(mags)) <= sigma_clip * np.std(mags)
+
+        if not np.all(keep):
+            mags = mags[keep]
+            times = times[keep]
+
+    if len(times) < 2:
+        raise ValueError('The curve has %d measures, at least 2 are needed.' %
+                         len(times))
+
+    if times[-1] == times[0]:
+        raise ValueError('All the measures of the curve have the same time.')
+
+    return PreparedCurve(mags, times, first_time)
+
+def concatenate_curves(curves):
+    """ Returns the magnitudes and the times of several prepared curves
+        concatenated in two vectors, and a vector with the offsets of the
+        first measure of each curve plus the total number of measures, so
+        the measures of the curve i are those from offsets[i] to
+        offsets[i + 1].
+
+        curves - List of PreparedCurve objects.
+
+    """
+
+    lengths = np.array([len(curve) for curve in curves], dtype=int)
+
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    if len(curves) > 0:
+        mags = np.concatenate([curve.mags for curve in curves])
+        times = np.concatenate([curve.times for curve in curves])
+    else:
+        mags = np.zeros(0)
+        times = np.zeros(0)
+
+    return mags, times, offsets
@@ -20,9 +20,586 @@ This module calculates the Lomb Scargle periodgram of a light curve.
 
 """
 
+import collections
 import numpy as np
 import scipy.signal
 import pylab
+import lcloader
+import lightcurve
+import freqgrid
+import periodfinder
+import falsealarm
+
+# Maximum number of bytes of the temporary arrays used to calculate at once
+# the periodgrams of several curves. 
+MEMORY_BUDGET = 2 ** 27
+
+def block_length(memory_budget, elements_per_item, bytes_per_element):
+    """ Returns the number of items (frequencies or curves) that can be 
+        calculated at once without exceeding the memory budget, at least one.
+        
+        memory_budget - Maximum number of bytes of the temporary arrays.
+        elements_per_item - Number of elements of the temporary arrays 
+            needed for each item.
+        bytes_per_element - Number of bytes of all the temporary arrays
+            for each element.
+        
+    """
+    
+    return max(1, int(memory_budget // max(1, elements_per_item * bytes_per_element)))
+
+def trig_buffers(shape, dtype):
+    """ Returns three arrays to calculate the sines and cosines of a block of
+        frequencies x times, for the arguments, the cosines and the sines.
+        The arguments are always calculated in double precision, as the 
+        products of frequencies and times can be large. In double precision
+        the cosines overwrite the arguments.
+        
+        shape - Shape of the arrays.
+        dtype - Type of the sines and cosines.
+        
+    """
+    
+    arg = np.empty(shape)
+    
+    if dtype == np.float64:
+        cos = arg
+    else:
+        cos = np.empty(shape, dtype=dtype)
+        
+    return arg, cos, np.empty(shape, dtype=dtype)
+
+def fill_trig(arg, cos, sin):
+    """ Calculates the cosines and sines of the arguments in the buffers 
+        returned by trig_buffers. In single precision the arguments are 
+        reduced to one period in double precision before calculating the
+        sines and cosines, that are faster in single precision.
+        
+        arg - Arguments, they are modified.
+        cos - Array to store the cosines.
+        sin - Array to store the sines.
+        
+    """
+    
+    if cos is arg:
+        np.sin(arg, out=sin)
+        np.cos(arg, out=cos)
+    else:
+        np.remainder(arg, 2 * np.pi, out=arg)
+        cos[...] = arg
+        np.sin(cos, out=sin)
+        np.cos(cos, out=cos)
+
+def trig_bytes_per_element(dtype):
+    """ Returns the number of bytes per element of the buffers returned by
+        trig_buffers.
+        
+        dtype - Type of the sines and cosines.
+    
+    """
+    
+    dtype = np.dtype(dtype)
+    
+    if dtype == np.float64:
+        return 2 * dtype.itemsize
+    else:
+        return np.dtype(np.float64).itemsize + 2 * dtype.itemsize
+
+def pad_curves(curves):
+    """ Stores a list of curves of different lengths in two matrices, one 
+        for magnitudes and one for times, with a curve in each row padded 
+        with zeros. It also returns a boolean matrix that indicates which 
+        values of each row are valid. 
+        
+        curves - List of (mags, times) pairs.
+    
+    """
+    
+    lengths = np.array([len(mags) for mags, times in curves], dtype=int)
+    
+    max_length = lengths.max() if len(lengths) > 0 else 0
+    
+    # The valid values of each row are the first ones, so the mask is filled
+    # in the same order that the curves are concatenated.
+    mask = np.arange(max_length)[np.newaxis, :] < lengths[:, np.newaxis]
+    
+    padded_mags = np.zeros(mask.shape)
+    padded_times = np.zeros(mask.shape)
+    
+    if len(curves) > 0:
+        padded_mags[mask] = np.concatenate([np.asarray(mags, dtype=float) 
+                                            for mags, times in curves])
+        padded_times[mask] = np.concatenate([np.asarray(times, dtype=float)
+                                             for mags, times in curves])
+    
+    return padded_mags, padded_times, mask
+
+def pgram_from_sums(xc, xs, cc, ss, cs):
+    """ Calculates the Lomb Scargle periodgram from the sums over the 
+        observations of the products of magnitudes (y), cos(w*t) (c) and
+        sin(w*t) (s) for each frequency w. The expression is the same one 
+        used by scipy.signal.lombscargle.
+        
+        xc - Sum of y * c.
+        xs - Sum of y * s.
+        cc - Sum of c * c.
+        ss - Sum of s * s.
+        cs - Sum of c * s.
+        
+    """
+    
+    # Time offset tau that makes the periodgram independent of a time 
+    # shift, expressed directly as the angle w * tau.
+    wtau = 0.5 * np.arctan2(2 * cs, cc - ss)
+    
+    c_tau = np.cos(wtau)
+    s_tau = np.sin(wtau)
+    c_tau2 = c_tau * c_tau
+    s_tau2 = s_tau * s_tau
+    cs_tau = 2 * c_tau * s_tau
+    
+    return 0.5 * ((((c_tau * xc + s_tau * xs) ** 2) / 
+                   (c_tau2 * cc + cs_tau * cs + s_tau2 * ss)) +
+                  (((c_tau * xs - s_tau * xc) ** 2) / 
+                   (c_tau2 * ss - cs_tau * cs + s_tau2 * cc)))
+
+def lombscargle_batch(times, mags, freqs, mask = None, 
+                      memory_budget = MEMORY_BUDGET, dtype = np.float64):
+    """ Calculates at once the Lomb Scargle periodgrams of several curves.
+        The periodgram of each curve has the same values that 
+        scipy.signal.lombscargle returns for that curve. Returns a matrix 
+        with the periodgram of each curve in a row.
+        
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        freqs - Angular frequencies to calculate, a vector when all the
+            curves use the same frequencies or a matrix with the 
+            frequencies of each curve in a row.
+        mask - Boolean matrix that indicates the valid values of times and 
+            mags, used when the curves are padded to the same length. 
+        memory_budget - Maximum number of bytes of the temporary arrays,
+            the frequencies are calculated in blocks that fit in it.
+        dtype - Type used to calculate the sums and the periodgrams, 
+            np.float32 reduces the precision to gain speed.
+    
+    """
+    
+    dtype = np.dtype(dtype)
+    
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+    freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+    
+    # The padded values don't contribute to the sums.
+    if mask is None:
+        weights = np.ones(times.shape, dtype=dtype)
+    else:
+        weights = np.atleast_2d(mask).astype(dtype)
+        
+    wmags = (mags * weights).astype(dtype)
+    
+    n_curves, n_obs = times.shape
+    n_freqs = freqs.shape[1]
+    
+    pgrams = np.empty((n_curves, n_freqs), dtype=dtype)
+    
+    # The frequencies are calculated in blocks to limit the size of the 
+    # temporary arrays (curves x frequencies x observations).
+    step = min(n_freqs, block_length(memory_budget, n_curves * n_obs, 
+                                     trig_bytes_per_element(dtype)))
+    
+    arg_buffer, cos_buffer, sin_buffer = \
+        trig_buffers((n_curves, step, n_obs), dtype)
+    
+    for first in range(0, n_freqs, step):
+        last = min(first + step, n_freqs)
+        
+        arg = arg_buffer[:, :last - first]
+        c = cos_buffer[:, :last - first]
+        s = sin_buffer[:, :last - first]
+        
+        np.multiply(freqs[:, first:last, np.newaxis], times[:, np.newaxis, :],
+                    out=arg)
+        fill_trig(arg, c, s)
+        
+        xc = np.einsum('ckn,cn->ck', c, wmags)
+        xs = np.einsum('ckn,cn->ck', s, wmags)
+        cc = np.einsum('ckn,ckn,cn->ck', c, c, weights)
+        ss = np.einsum('ckn,ckn,cn->ck', s, s, weights)
+        cs = np.einsum('ckn,ckn,cn->ck', c, s, weights)
+        
+        pgrams[:, first:last] = pgram_from_sums(xc, xs, cc, ss, cs)
+        
+    return pgrams
+
+def shared_sampling(curves, min_density = 0.8):
+    """ Checks if several prepared curves have been observed at the same
+        epochs. If the measures of the curves fill at least the fraction
+        'min_density' of the matrix of curves x union of epochs, returns the 
+        union of epochs, as times regarding the first one, and two matrices
+        with the magnitudes of each curve at those epochs and a mask of the
+        epochs observed by each curve. Otherwise returns None.
+        
+        curves - List of PreparedCurve objects.
+        min_density - Minimum fraction of the epochs observed by the curves.
+    
+    """
+    
+    # The epochs are compared as unix times, the subtraction of the first
+    # time done to prepare the curve is exact so it is undone exactly.
+    epochs = [curve.times + curve.first_time for curve in curves]
+    
+    all_epochs = np.concatenate(epochs)
+    
+    union = np.unique(all_epochs)
+    
+    if len(all_epochs) < min_density * len(curves) * len(union):
+        return None
+    
+    mags = np.zeros((len(curves), len(union)))
+    mask = np.zeros((len(curves), len(union)), dtype=bool)
+    
+    for i in range(len(curves)):
+        positions = np.searchsorted(union, epochs[i])
+        
+        mags[i, positions] = curves[i].mags
+        mask[i, positions] = True
+        
+    return union - union[0], mags, mask
+
+def lombscargle_shared(times, mags, freqs, mask = None, 
+                       memory_budget = MEMORY_BUDGET, dtype = np.float64):
+    """ Calculates at once the Lomb Scargle periodgrams of several curves
+        observed at the same times. The sines and cosines of the 
+        frequencies at those times are calculated once for all the curves, 
+        and the sums for each curve are obtained as matrix products. When 
+        all the curves have all the observations, the time offsets tau are 
+        also shared. Returns a matrix with the periodgram of each curve in
+        a row.
+        
+        times - Times shared by the curves.
+        mags - Matrix with the magnitudes of a curve in each row, zero
+            for the times not observed.
+        freqs - Angular frequencies to calculate.
+        mask - Boolean matrix that indicates the times observed by each
+            curve, None if all the curves have been observed at all the times.
+        memory_budget - Maximum number of bytes of the temporary arrays,
+            the frequencies are calculated in blocks that fit in it.
+        dtype - Type used to calculate the sums and the periodgrams, 
+            np.float32 reduces the precision to gain speed.
+    
+    """
+    
+    dtype = np.dtype(dtype)
+    
+    times = np.asarray(times, dtype=float)
+    mags = np.atleast_2d(np.asarray(mags, dtype=dtype))
+    freqs = np.asarray(freqs, dtype=float).ravel()
+    
+    if mask is not None and np.all(mask):
+        mask = None
+    
+    if mask is not None:
+        weights = np.atleast_2d(mask).astype(dtype)
+    
+    n_curves = mags.shape[0]
+    n_freqs = len(freqs)
+    
+    pgrams = np.empty((n_curves, n_freqs), dtype=dtype)
+    
+    # The frequencies are calculated in blocks to limit the size of the 
+    # basis (frequencies x times), a buffer more is used for the products
+    # of sines and cosines.
+    step = min(n_freqs, block_length(memory_budget, len(times), 
+                                     trig_bytes_per_element(dtype) + 
+                                     dtype.itemsize))
+    
+    arg_buffer, cos_buffer, sin_buffer = trig_buffers((step, len(times)), dtype)
+    product_buffer = np.empty((step, len(times)), dtype=dtype)
+    
+    for first in range(0, n_freqs, step):
+        last = min(first + step, n_freqs)
+        
+        arg = arg_buffer[:last - first]
+        c = cos_buffer[:last - first]
+        s = sin_buffer[:last - first]
+        product = product_buffer[:last - first]
+        
+        np.multiply(freqs[first:last, np.newaxis], times[np.newaxis, :], 
+                    out=arg)
+        fill_trig(arg, c, s)
+        
+        xc = np.dot(mags, c.T)
+        xs = np.dot(mags, s.T)
+        
+        if mask is None:
+            # The sums that only depend on times are the same for all curves.
+            cc = np.multiply(c, c, out=product).sum(axis=1)[np.newaxis, :]
+            ss = np.multiply(s, s, out=product).sum(axis=1)[np.newaxis, :]
+            cs = np.multiply(c, s, out=product).sum(axis=1)[np.newaxis, :]
+        else:
+            cc = np.dot(weights, np.multiply(c, c, out=product).T)
+            ss = np.dot(weights, np.multiply(s, s, out=product).T)
+            cs = np.dot(weights, np.multiply(c, s, out=product).T)
+        
+        pgrams[:, first:last] = pgram_from_sums(xc, xs, cc, ss, cs)
+        
+    return pgrams
+
+def extirpolate(x, y, grid_size, order = 6):
+    """ Extirpolates the values y located at the positions x onto a regular
+        periodic grid of integer positions 0 .. grid_size - 1, as described in 
+        Press & Rybicki (1989). Each value is spread over the 'order' 
+        nearest points of the grid using Lagrange weights, so that a sum of
+        a smooth function over the original positions can be approximated
+        by a sum over the grid. Returns a matrix with a grid per row.
+        
+        x - Matrix with the positions of the values, in the range 
+            [0, grid_size).
+        y - Matrix with the values to extirpolate, real or complex.
+        grid_size - Number of points of the grid.
+        order - Number of points of the grid used for each value.
+    
+    """
+    
+    x = np.atleast_2d(x)
+    y = np.atleast_2d(y)
+    
+    n_rows = x.shape[0]
+    
+    # First point of the grid used for each value, chosen to keep the value
+    # in the middle of the points used. The grid is periodic, so the points
+    # beyond its limits are wrapped around.
+    first_point = np.floor(x - (order - 1) / 2.0).astype(int)
+    
+    # Each row is accumulated in its own range of the flattened result.
+    row_offset = (np.arange(n_rows) * grid_size)[:, np.newaxis]
+    
+    offsets = x - first_point
+    
+    # The contributions to all the points are accumulated at once, as 
+    # each accumulation goes through the whole grid.
+    index = np.empty((order,) + x.shape, dtype=int)
+    value = np.empty((order,) + x.shape, dtype=np.result_type(y, float))
+    
+    for j in range(order):
+        # Lagrange weight of the point j of the interpolation range.
+        weight = np.ones(x.shape)
+        for k in range(order):
+            if k != j:
+                weight *= (offsets - k) / float(j - k)
+                
+        index[j] = row_offset + (first_point + j) % grid_size
+        value[j] = weight * y
+        
+    index = index.ravel()
+    value = value.ravel()
+    
+    real_part = np.bincount(index, weights = np.real(value), 
+                            minlength = n_rows * grid_size)
+        
+    if np.iscomplexobj(value):
+        result = real_part + 1j * np.bincount(index, weights = np.imag(value), 
+                                              minlength = n_rows * grid_size)
+    else:
+        result = real_part
+    
+    return result.reshape((n_rows, grid_size))
+
+def fft_length(n_freqs, oversampling, order):
+    """ Returns the size of the FFT used to calculate a number of 
+        frequencies, the smallest product of powers of 2, 3 and 5 above the
+        oversampled number of frequencies, as the FFT of these sizes is
+        as fast as that of the powers of 2.
+        
+        n_freqs - Number of frequencies.
+        oversampling - Ratio between the size of the FFT and n_freqs.
+        order - Number of points of the grid used to extirpolate each value.
+        
+    """
+    
+    target = max(n_freqs * oversampling, order)
+    
+    length = None
+    power_5 = 1
+    
+    while power_5 < 5 * target:
+        power_35 = power_5
+        
+        while power_35 < 3 * target:
+            # Smallest multiple of power_35 by a power of 2 above the target.
+            exponent = max(0, int(np.ceil(np.log2(float(target) / power_35))))
+            
+            size = power_35 * 2 ** exponent
+            
+            if length is None or size < length:
+                length = size
+                
+            power_35 *= 3
+            
+        power_5 *= 5
+        
+    return length
+
+def trig_sums(times, values, first_freq, freq_step, n_freqs, 
+              oversampling = 8, order = 6):
+    """ Calculates, using the FFT, the sums over the observations of 
+        values * cos(w * t) and values * sin(w * t) for the regular grid of 
+        angular frequencies w = first_freq + k * freq_step, k = 0 .. n_freqs - 1.
+        Returns two matrices with the sums of cosines and sines of each row. 
+        
+        times - Matrix with the times of a curve in each row.
+        values - Matrix with the values to sum for each time, zero for the
+            padded values.
+        first_freq - First angular frequency of each row.
+        freq_step - Step of the angular frequencies of each row.
+        n_freqs - Number of frequencies.
+        oversampling - Ratio between the size of the FFT and n_freqs.
+        order - Number of points of the grid used to extirpolate each value.
+    
+    """
+    
+    first_freq = np.asarray(first_freq, dtype=float).reshape((-1, 1))
+    freq_step = np.asarray(freq_step, dtype=float).reshape((-1, 1))
+    
+    fft_size = fft_length(n_freqs, oversampling, order)
+    
+    # The first frequency is applied to the values, so the grid begins at 0.
+    shifted_values = values * np.exp(1j * first_freq * times)
+    
+    # Positions of the times in the grid, as the fraction of the period
+    # of the frequency step times the size of the grid. The fraction is 
+    # calculated first to keep the precision for large times.
+    cycles = times * freq_step / (2 * np.pi)
+    positions = (cycles - np.floor(cycles)) * fft_size
+    
+    grid = extirpolate(positions, shifted_values, fft_size, order)
+    
+    sums = fft_size * np.fft.ifft(grid, axis=1)[:, :n_freqs]
+    
+    return sums.real, sums.imag
+
+def fast_lombscargle_batch(times, mags, freqs, mask = None, 
+                           oversampling = 8, order = 6, 
+                           memory_budget = MEMORY_BUDGET):
+    """ Calculates at once the Lomb Scargle periodgrams of several curves 
+        in O(N log N) using the method of Press & Rybicki (1989). The sums
+        of the Lomb Scargle method are approximated by the FFT of the 
+        values extirpolated to a regular grid. The frequencies of each 
+        curve must be a regular grid.
+        
+        times - Matrix with the times of a curve in each row.
+        mags - Matrix with the magnitudes of a curve in each row.
+        freqs - Angular frequencies to calculate, a vector when all the
+            curves use the same frequencies or a matrix with the 
+            frequencies of each curve in a row.
+        mask - Boolean matrix that indicates the valid values of times and 
+            mags, used when the curves are padded to the same length. 
+        oversampling - Ratio between the size of the FFT and the number of
+            frequencies.
+        order - Number of points of the grid used to extirpolate each value.
+        memory_budget - Maximum number of bytes of the temporary arrays,
+            the curves are calculated in blocks that fit in it.
+    
+    """
+    
+    times = np.atleast_2d(np.asarray(times, dtype=float))
+    mags = np.atleast_2d(np.asarray(mags, dtype=float))
+    freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+    
+    if mask is None:
+        weights = np.ones(times.shape)
+    else:
+        weights = np.atleast_2d(mask).astype(float)
+        
+    n_curves = times.shape[0]
+    
+    # Each curve needs a complex grid and its transform for the size of 
+    # the FFT, and the sums for the double of the frequencies are 
+    # calculated after the first ones.
+    fft_size = fft_length(freqs.shape[1], oversampling, order)
+    
+    rows = block_length(memory_budget, fft_size, 4 * np.dtype(complex).itemsize)
+    
+    if n_curves > rows:
+        pgrams = np.empty((n_curves, freqs.shape[1]))
+        
+        for first in range(0, n_curves, rows):
+            last = min(first + rows, n_curves)
+            
+            pgrams[first:last] = fast_lombscargle_batch(
+                times[first:last], mags[first:last], 
+                freqs[first:last] if len(freqs) > 1 else freqs, 
+                weights[first:last] > 0, oversampling, order, memory_budget)
+            
+        return pgrams
+        
+    # The periodgram doesn't depend on the origin of times, so the first 
+    # time of each curve is used as origin to keep the phases small.
+    times = (times - times[:, :1]) * weights
+    
+    n_freqs = freqs.shape[1]
+    first_freq = freqs[:, 0]
+    freq_step = freqs[:, 1] - freqs[:, 0] if n_freqs > 1 else np.ones(len(freqs))
+    
+    xc, xs = trig_sums(times, mags * weights, first_freq, freq_step, n_freqs,
+                       oversampling, order)
+    
+    # Sums of the double of the frequencies, used to get the sums of the
+    # squares of sines and cosines.
+    c2, s2 = trig_sums(times, weights, 2 * first_freq, 2 * freq_step, 
+                       n_freqs, oversampling, order)
+    
+    n_obs = weights.sum(axis=1)[:, np.newaxis]
+    
+    cc = 0.5 * (n_obs + c2)
+    ss = 0.5 * (n_obs - c2)
+    cs = 0.5 * s2
+    
+    return pgram_from_sums(xc, xs, cc, ss, cs)
+
+def local_maxima_indexes(pgrams, number_of_max):
+    """ Returns a matrix with the indexes of the highest local maxima of
+        each periodgram, ordered by decreasing value. Contiguous values of
+        the same peak aren't returned as different maximums. When a 
+        periodgram has less local maxima than requested, the rest of indexes
+        are those of the highest values that aren't local maxima.
+        
+        pgrams - Matrix with a periodgram in each row.
+        number_of_max - Number of maximums to search.
+        
+    """
+    
+    pgrams = np.atleast_2d(pgrams)
+    
+    n_rows, n_freqs = pgrams.shape
+    
+    number_of_max = min(number_of_max, n_freqs)
+    
+    # A value is a local maximum if it is greater than the previous value
+    # and not lower than the next one, the limits are compared only with
+    # their neighbour.
+    is_max = np.ones(pgrams.shape, dtype=bool)
+    is_max[:, 1:] &= pgrams[:, 1:] > pgrams[:, :-1]
+    is_max[:, :-1] &= pgrams[:, :-1] >= pgrams[:, 1:]
+    
+    # The values that aren't local maxima are shifted below the lowest
+    # value so the local maxima are always chosen first.
+    shift = (pgrams.max(axis=1) - pgrams.min(axis=1) + 1)[:, np.newaxis]
+    keys = np.where(is_max, pgrams, pgrams - shift)
+    
+    # Only the highest values are selected and then sorted.
+    if number_of_max < n_freqs:
+        candidates = np.argpartition(-keys, number_of_max - 1, 
+                                     axis=1)[:, :number_of_max]
+    else:
+        candidates = np.tile(np.arange(n_freqs), (n_rows, 1))
+    
+    rows = np.arange(n_rows)[:, np.newaxis]
+    
+    order = np.argsort(-keys[rows, candidates], axis=1, kind='mergesort')
+    
+    return candidates[rows, order]
 
 class LSProperties(object):
     """ This class is used as a container for the parameters used to calculate
@@ -30,8 +607,47 @@ class LSProperties(object):
 
 """
 
+    # Methods available to calculate the periodgram.
+    DIRECT_METHOD = 'direct'
+    FAST_METHOD = 'fast'
+    METHODS = [DIRECT_METHOD, FAST_METHOD]
+    
+    # Modes to search the maximums of the periodgram. 
+    UNIFORM_SEARCH = 'uniform'
+    ZOOM_SEARCH = 'zoom'
+    SEARCH_MODES = [UNIFORM_SEARCH, ZOOM_SEARCH]
+    
+    # Grids of frequencies.
+    FIXED_GRID = 'fixed'
+    BASELINE_GRID = 'baseline'
+    GRID_MODES = [FIXED_GRID, BASELINE_GRID]
+    
+    # Engines to search the periods, the Lomb Scargle method or one of the
+    # engines of the periodfinder module.
+    LOMB_SCARGLE_ENGINE = 'lombscargle'
+    ENGINES = [LOMB_SCARGLE_ENGINE] + sorted(periodfinder.ENGINES.keys())
+    
+    # Methods to calculate the false alarm probabilities of the maximums.
+    BALUEV_FAP = 'baluev'
+    BOOTSTRAP_FAP = 'bootstrap'
+    FAP_METHODS = [None, BALUEV_FAP, BOOTSTRAP_FAP]
+    
+    # Precisions to calculate the periodgram.
+    DOUBLE_PRECISION = 'double'
+    SINGLE_PRECISION = 'single'
+    PRECISIONS = [DOUBLE_PRECISION, SINGLE_PRECISION]
+
     def __init__(self, first_freq_ = 1, max_freq_to_seek_ = 10000, 
-                 freq_to_calculate_ = 200, number_of_freq_ = 3):
+                 freq_to_calculate_ = 200, number_of_freq_ = 3,
+                 method_ = DIRECT_METHOD, oversampling_ = 8,
+                 remove_duplicates_ = False, sigma_clip_ = None,
+                 search_mode_ = UNIFORM_SEARCH, zoom_points_ = 32,
+                 grid_mode_ = FIXED_GRID, grid_oversampling_ = 5, 
+                 nyquist_factor_ = 1, shared_basis_ = False,
+                 memory_budget_ = MEMORY_BUDGET, precision_ = DOUBLE_PRECISION,
+                 engine_ = LOMB_SCARGLE_ENGINE, fap_method_ = None,
+                 bootstrap_shuffles_ = 1000, fap_processes_ = None,
+                 harmonic_fit_ = False):
         """ Instantiation method for the CurvePeriods class.
 
             Arguments:
@@ -43,15 +659,167 @@ class LSProperties(object):
             index_max_value - indexes of the maximum values of the periodgram, these
             values are frequencies in the range of frequencies used to calculate the 
             periodgram.
+            method - Method used to calculate the periodgram, DIRECT_METHOD 
+            evaluates the sums for each frequency and FAST_METHOD approximates
+            them using the FFT, two FFTs of oversampling times the number 
+            of frequencies for each curve, that take most of its time.
+            oversampling - Ratio between the size of the FFT and the number of
+            frequencies for FAST_METHOD.
+            remove_duplicates - Keep only the first measure of each time 
+            when preparing the curves.
+            sigma_clip - If not None, discard the measures of the curves
+            farther from the median than this number of standard deviations.
+            search_mode - Mode to search the maximums, UNIFORM_SEARCH takes 
+            the highest values of the periodgram and ZOOM_SEARCH takes its
+            highest local maxima and refines them calculating the periodgram
+            with a higher resolution around each one.
+            zoom_points - Number of frequencies calculated around each 
+            maximum in ZOOM_SEARCH mode.
+            grid_mode - Grid of frequencies, FIXED_GRID uses freq_to_calculate
+            frequencies up to the maximum frequency and BASELINE_GRID derives 
+            the step from the time baseline of the curve and the maximum 
+            frequency from its cadence.
+            grid_oversampling - Number of frequencies in the width of a peak
+            for BASELINE_GRID.
+            nyquist_factor - Ratio between the maximum frequency and the
+            average Nyquist frequency of the curve for BASELINE_GRID.
+            shared_basis - Calculate at once the sines and cosines for all
+            the curves observed at the same epochs, when the periodgrams of
+            several curves are calculated with DIRECT_METHOD.
+            memory_budget - Maximum number of bytes of the temporary arrays
+            used to calculate the periodgrams, the frequencies are 
+            calculated in blocks that fit in it.
+            precision - Precision of the calculation of the periodgrams, 
+            SINGLE_PRECISION is faster and uses less memory but it is less 
+            accurate. The products of frequencies and times are always 
+            calculated in double precision.
+            engine - Engine used to calculate the periodgrams, 
+            LOMB_SCARGLE_ENGINE or the name of one of the engines of the
+            periodfinder module. The other engines return a power whose 
+            highest values are the most probable frequencies.
+            fap_method - Method to calculate the false alarm probabilities
+            of the maximums, None to not calculate them, BALUEV_FAP for the
+            analytic approximation of Baluev (only for LOMB_SCARGLE_ENGINE) 
+            or BOOTSTRAP_FAP for the periodgrams of the curves shuffled.
+            bootstrap_shuffles - Number of shuffles of each curve for 
+            BOOTSTRAP_FAP.
+            fap_processes - Number of processes to calculate the shuffles
+            for BOOTSTRAP_FAP, None to use the number of processors.
+            harmonic_fit - Fit the harmonics of the frequencies of the 
+            maximums to the curves and add their amplitudes and phases to 
+            the features.
+            freqs - Frequencies of the periodgram.
+            peak_freqs - Frequencies of the maximums of the periodgram.
+            peak_values - Values of the maximums of the periodgram.
             
         """
 
+        if method_ not in LSProperties.METHODS:
+            raise ValueError("Method '%s' to calculate the periodgram is not valid" % 
+                             method_)
+            
+        if search_mode_ not in LSProperties.SEARCH_MODES:
+            raise ValueError("Mode '%s' to search the maximums is not valid" % 
+                             search_mode_)
+            
+        if grid_mode_ not in LSProperties.GRID_MODES:
+            raise ValueError("Grid of frequencies '%s' is not valid" % 
+                             grid_mode_)
+            
+        if precision_ not in LSProperties.PRECISIONS:
+            raise ValueError("Precision '%s' is not valid" % precision_)
+            
+        if engine_ not in LSProperties.ENGINES:
+            raise ValueError("Engine '%s' to search periods is not valid" % 
+                             engine_)
+            
+        if fap_method_ not in LSProperties.FAP_METHODS:
+            raise ValueError("Method '%s' to calculate the false alarm probabilities is not valid" % 
+                             fap_method_)
+            
+        if fap_method_ == LSProperties.BALUEV_FAP and \
+            engine_ != LSProperties.LOMB_SCARGLE_ENGINE:
+            raise ValueError("False alarm probabilities of Baluev are only valid for the Lomb Scargle periodgram")
+
         self.first_freq = first_freq_  
         self.max_freq_to_seek = max_freq_to_seek_         
         self.freq_to_calculate = freq_to_calculate_
         self.number_of_freq = number_of_freq_
+        self.method = method_
+        self.oversampling = oversampling_
+        self.remove_duplicates = remove_duplicates_
+        self.sigma_clip = sigma_clip_
+        self.search_mode = search_mode_
+        self.zoom_points = zoom_points_
+        self.grid_mode = grid_mode_
+        self.grid_oversampling = grid_oversampling_
+        self.nyquist_factor = nyquist_factor_
+        self.shared_basis = shared_basis_
+        self.memory_budget = memory_budget_
+        self.precision = precision_
+        self.engine = engine_
+        self.fap_method = fap_method_
+        self.bootstrap_shuffles = bootstrap_shuffles_
+        self.fap_processes = fap_processes_
+        self.harmonic_fit = harmonic_fit_
         self.max_freq = 0.0
+        self.freqs = []
         self.index_max_values = []      
+        self.peak_freqs = []
+        self.peak_values = []
+        self.faps = []
+        
+    def set_periodgram(self, pgram, freqs, index_max_values, peak_freqs, 
+                       peak_values, faps = None):
+        """ Stores the periodgram of a curve and its maximums.
+        
+            pgram - Periodgram of the curve.
+            freqs - Frequencies of the periodgram.
+            index_max_values - Indexes of the maximums of the periodgram.
+            peak_freqs - Frequencies of the maximums.
+            peak_values - Values of the maximums.
+            faps - False alarm probabilities of the maximums, None if they
+                haven't been calculated.
+            
+        """
+        
+        self.pgram = pgram
+        self.freqs = freqs
+        self.index_max_values = list(index_max_values)
+        self.peak_freqs = list(peak_freqs)
+        self.peak_values = list(peak_values)
+        self.faps = list(faps) if faps is not None else []
+        
+    @property
+    def dtype(self):
+        """ Type used to calculate the periodgrams. """
+        
+        if self.precision == LSProperties.SINGLE_PRECISION:
+            return np.float32
+        else:
+            return np.float64
+        
+    def periodgram_settings(self):
+        """ Returns a tuple with the properties that determine the values
+            of the periodgram calculated for a curve.
+            
+        """
+        
+        return (self.method, self.oversampling, self.grid_mode, 
+                self.freq_to_calculate, self.max_freq_to_seek, 
+                self.grid_oversampling, self.nyquist_factor, self.precision,
+                self.engine)
+        
+    def features_settings(self):
+        """ Returns a tuple with the properties that determine the values
+            of the features calculated for a curve.
+            
+        """
+        
+        return self.periodgram_settings() + \
+            (self.number_of_freq, self.remove_duplicates, self.sigma_clip,
+             self.search_mode, self.zoom_points, self.shared_basis,
+             self.fap_method, self.bootstrap_shuffles, self.harmonic_fit)
         
     def __str__(self):
         """ The 'informal' string representation """
@@ -59,22 +827,34 @@ class LSProperties(object):
         return "LSProperties: %s(First freq = %.2f freq to calculate = %d)" % \
                (self.__class__.__name__, self.first_freq, self.freq_to_calculate)
 
-class LombScargle(object):
+class LombScargle(periodfinder.PeriodEngine):
     """ Encapsulates the calculation of parameters from a light curve.
         This class is used as a container to calculate the periodgram 
-        of a light curve using the Lomb Scargle method.
+        of a light curve using the Lomb Scargle method, or the engine
+        indicated by the properties.
 
     """
 
-    def __init__(self, lsprop_):
+    def __init__(self, lsprop_, cache_ = None):
         """ Instantiation method for the LombScargle class. 
         
             lsprop_ - Parameters to use to calculate the Lomb Scargle periodgram.
+            cache_ - PeriodgramCache to store the periodgrams calculated and
+                retrieve those already calculated, None to always calculate
+                the periodgrams.
         
         """     
 
         self.lsprop = lsprop_
+        self.cache = cache_
         self.max_freq_calculated = 0.0  
+        
+        if self.lsprop.engine == LSProperties.LOMB_SCARGLE_ENGINE:
+            self.engine = self
+        else:
+            self.engine = periodfinder.create_engine(self.lsprop.engine, 
+                                                     self.lsprop.memory_budget)
+        
         self.nmags = []
         self.ntimes = []
 
@@ -83,26 +863,173 @@ class LombScargle(object):
         
         return len(self.curve) # number of values in the curve
 
-    def get_index_max_values(self):
-        """ Calculate the maximums of the periodgram. """
+    def power(self, times, mags, freqs, mask = None):
+        """ Returns a matrix with the Lomb Scargle periodgram of each curve 
+            in a row, calculated with the method of the properties.
+            
+            times - Matrix with the times of a curve in each row.
+            mags - Matrix with the magnitudes of a curve in each row.
+            freqs - Angular frequencies to calculate, a vector when all the
+                curves use the same frequencies or a matrix with the 
+                frequencies of each curve in a row.
+            mask - Boolean matrix that indicates the valid values of times 
+                and mags, used when the curves are padded to the same length. 
+            
+        """
+        
+        if self.lsprop.method == LSProperties.FAST_METHOD:
+            return fast_lombscargle_batch(times, mags, freqs, mask, 
+                                          self.lsprop.oversampling,
+                                          memory_budget = self.lsprop.memory_budget)
+        else:
+            return lombscargle_batch(times, mags, freqs, mask,
+                                     self.lsprop.memory_budget, 
+                                     self.lsprop.dtype)
 
+    @staticmethod
+    def index_max_values_batch(pgrams, number_of_freq):
+        """ Calculate the indexes of the maximums of several periodgrams,
+            returning a matrix with the indexes of each periodgram in a row.
+            
+            pgrams - Matrix with a periodgram in each row.
+            number_of_freq - Number of maximums to search.
+            
+        """
+        
         # During calculations the series are modified, so a numpy array copy
-        # is created, as numpy functions are used in calculations.
-        series_copy = np.copy(self.lsprop.pgram)
-
-        # Search for 'number_of_freq' maximums.
-        self.lsprop.index_max_values = []
-        # Get the first maximum.
-        self.lsprop.index_max_values.append(np.argmax(series_copy))
-
-        # Search the next n - 1 maximums.
-        for n in range(self.lsprop.number_of_freq - 1):
+        # is created.
+        series_copy = np.array(pgrams, dtype=float, ndmin=2)
+        
+        rows = np.arange(series_copy.shape[0])
+        
+        indexes = np.zeros((series_copy.shape[0], number_of_freq), dtype=int)
+        
+        for n in range(number_of_freq):
+            # Get next maximum of each periodgram.
+            indexes[:, n] = np.argmax(series_copy, axis=1)
+            
+            # Set to 0 current maximum.
+            series_copy[rows, indexes[:, n]] = 0
+            
+        return indexes
 
-            # Set to 0 previous maximum.
-            series_copy[self.lsprop.index_max_values[n]] = 0
+    def get_index_max_values(self):
+        """ Calculate the maximums of the periodgram. """
 
-            # Get next maximum
-            self.lsprop.index_max_values.append(np.argmax(series_copy))
+        self.lsprop.index_max_values = list(LombScargle.index_max_values_batch(
+            self.lsprop.pgram, self.lsprop.number_of_freq)[0])
+        
+    def __zoom_peaks(self, pgrams, freqs, times, mags, mask):
+        """ Search the maximums of several periodgrams calculating the 
+            periodgrams with a higher resolution around their highest local
+            maxima. The position of each maximum is refined fitting a 
+            parabola to the values around the highest value calculated.
+            Returns the indexes of the maximums in the periodgrams received,
+            ordered by the refined values, and the refined frequencies and
+            values.
+            
+            pgrams - Matrix with a periodgram in each row.
+            freqs - Matrix with the frequencies of each periodgram.
+            times - Matrix with the times of each curve.
+            mags - Matrix with the magnitudes of each curve.
+            mask - Boolean matrix that indicates the valid values of times 
+                and mags.
+            
+        """
+        
+        number_of_freq = self.lsprop.number_of_freq
+        zoom_points = self.lsprop.zoom_points
+        
+        n_rows, n_freqs = pgrams.shape
+        rows = np.arange(n_rows)[:, np.newaxis]
+        
+        # Some more candidates than maximums are refined, as the order of
+        # the maximums could change with the refinement.
+        candidates = local_maxima_indexes(pgrams, 2 * number_of_freq)
+        n_candidates = candidates.shape[1]
+        
+        # The zoomed window of each candidate covers the interval between
+        # its neighbours.
+        low = freqs[rows, np.maximum(candidates - 1, 0)]
+        high = freqs[rows, np.minimum(candidates + 1, n_freqs - 1)]
+        
+        steps = np.linspace(0, 1, zoom_points)
+        zoom_freqs = low[:, :, np.newaxis] + \
+            (high - low)[:, :, np.newaxis] * steps
+        
+        # The frequencies zoomed aren't a regular grid, so the Lomb Scargle
+        # periodgram is calculated directly.
+        if self.engine is self:
+            zoom_pgrams = lombscargle_batch(
+                times, mags, zoom_freqs.reshape((n_rows, -1)), mask, 
+                self.lsprop.memory_budget, self.lsprop.dtype)
+        else:
+            zoom_pgrams = self.engine.power(
+                times, mags, zoom_freqs.reshape((n_rows, -1)), mask)
+            
+        zoom_pgrams = zoom_pgrams.reshape((n_rows, n_candidates, zoom_points))
+        
+        best = np.argmax(zoom_pgrams, axis=2)
+        
+        # Fit a parabola to the highest value and its neighbours, the limits
+        # of the window keep the value calculated.
+        inner = np.clip(best, 1, zoom_points - 2)
+        cand_rows = rows[:, :, np.newaxis]
+        cand_cols = np.arange(n_candidates)[np.newaxis, :, np.newaxis]
+        around = zoom_pgrams[cand_rows, cand_cols, 
+                             inner[:, :, np.newaxis] + np.arange(-1, 2)]
+        
+        curvature = around[:, :, 0] - 2 * around[:, :, 1] + around[:, :, 2]
+        
+        offset = np.zeros(best.shape)
+        valid = (best == inner) & (curvature < 0)
+        offset[valid] = 0.5 * (around[:, :, 0] - around[:, :, 2])[valid] / \
+            curvature[valid]
+        
+        step = (high - low) / (zoom_points - 1)
+        
+        peak_freqs = low + (best + offset) * step
+        peak_values = zoom_pgrams[rows, np.arange(n_candidates), best] - \
+            0.25 * (around[:, :, 0] - around[:, :, 2]) * offset
+        
+        # Keep the highest maximums once refined.
+        order = np.argsort(-peak_values, axis=1, kind='mergesort')[:, :number_of_freq]
+        
+        return candidates[rows, order], peak_freqs[rows, order], \
+            peak_values[rows, order]
+    
+    def search_peaks(self, pgrams, freqs, times, mags, mask = None):
+        """ Search the maximums of several periodgrams according to the
+            search mode of the properties. Returns three matrices with the 
+            indexes, frequencies and values of the maximums of each periodgram.
+            
+            pgrams - Matrix with a periodgram in each row.
+            freqs - Matrix with the frequencies of each periodgram.
+            times - Matrix with the times of each curve.
+            mags - Matrix with the magnitudes of each curve.
+            mask - Boolean matrix that indicates the valid values of times 
+                and mags.
+            
+        """
+        
+        pgrams = np.atleast_2d(pgrams)
+        freqs = np.atleast_2d(freqs)
+        
+        # All the periodgrams could use the same frequencies.
+        if freqs.shape[0] < pgrams.shape[0]:
+            freqs = np.tile(freqs, (pgrams.shape[0], 1))
+        
+        if self.lsprop.search_mode == LSProperties.ZOOM_SEARCH:
+            return self.__zoom_peaks(pgrams, freqs, np.atleast_2d(times), 
+                                     np.atleast_2d(mags), mask)
+        else:
+            index_max_values = LombScargle.index_max_values_batch(
+                pgrams, self.lsprop.number_of_freq)
+            
+            rows = np.arange(pgrams.shape[0])[:, np.newaxis]
+            
+            return index_max_values, freqs[rows, index_max_values], \
+                pgrams[rows, index_max_values]
 
     def __plot_periodgram(self, nmags, ntimes, freqs):
         """ Plot the periodgram. 
@@ -160,92 +1087,339 @@ class LombScargle(object):
         
         """
         
-        first_measure = 0
-        
-        intervals = []
-
-        for i in range(1, len(unix_times)):
-            intervals.append(unix_times[i] - unix_times[i - 1])
-        
-        intervals_a = np.array(intervals)
-         
-        m = np.mean(intervals_a)
+        return lightcurve.first_measure_index(unix_times)
         
-        i = 1
-        found = False
-        
-        while not found and i < len(intervals):
-            new_m = np.mean(intervals_a[i:])
-            dev = new_m + 0.1 * new_m 
-            
-            if m < new_m + dev and m > new_m - dev:
-                found = True
-                first_measure = i - 1
-            else:
-                m = new_m
-                
-            i += 1
-            
-        return first_measure
-        
-    def calculate_periodgram_from_curve(self, mags, unix_times):
-        """ Calculates the periogram for one curve.
+    def prepare_curve(self, mags, unix_times):
+        """ Prepares a curve to calculate its periodgram, returning a
+            PreparedCurve.
         
             mags - Serie of magnitudes measured for the star.
             unix_times - Times (in unix times) when the magnitudes have been measured.
         
         """
         
-        first_measure = self.discard_first_measures_far_in_time(unix_times)    
+        return lightcurve.prepare_curve(mags, unix_times, 
+                                        remove_duplicates = self.lsprop.remove_duplicates,
+                                        sigma_clip = self.lsprop.sigma_clip)
+    
+    def get_max_freq(self, curve):
+        """ Returns the maximum frequency to calculate for a curve.
         
-        # Calculates the time of each measurement as increments of time
-        # regarding the time of the first measurement. First time value is 0.
-        first_time = unix_times[first_measure]
-        times = [0]  
-
-        # Rest of times are increments regarding the first time.
-        for i in range(first_measure + 1, len(unix_times)):
-            times.append(unix_times[i] - first_time)
+            curve - PreparedCurve whose periodgram is calculated.
+            
+        """
 
-        self.nmags = np.asarray(mags[first_measure:len(unix_times)])
-        self.ntimes = np.asarray(times)
+        # A curve whose measures have the same time has no sample frequency.
+        if not curve.baseline > 0:
+            return self.lsprop.max_freq_to_seek
 
         # The periodgram is calculated searching for frecuencia only in the 
         # follwing range of frecuencies. A sample frecuency is calculated
         # using the Nyquist Theorem.
-        sample_freq = (len(unix_times) - 1 - first_measure) / \
-            ( unix_times[-1] - unix_times[first_measure] )
-
+        max_freq_seek = curve.sample_freq / 2
+        
         # The maximum frequency to search is chosen as the maximum between 
         # the calculated one and the maximum frequency received as argument.
-        max_freq_seek = sample_freq / 2
-        
-        self.lsprop.max_freq_calculated = \
-            max_freq_seek if max_freq_seek > self.lsprop.max_freq_to_seek \
+        return max_freq_seek if max_freq_seek > self.lsprop.max_freq_to_seek \
             else self.lsprop.max_freq_to_seek
+        
+    def get_freqs(self, curve):
+        """ Returns the frequencies of the periodgram of a curve. The same
+            grid is returned for all the curves that need the same 
+            frequencies.
+        
+            curve - PreparedCurve whose periodgram is calculated.
+        
+        """
+        
+        # The grid of a curve whose measures have the same time can't be
+        # derived from its baseline, it gets the fixed grid.
+        if self.lsprop.grid_mode == LSProperties.BASELINE_GRID and \
+            curve.baseline > 0:
+            return freqgrid.baseline_grid(curve.baseline, len(curve), 
+                                          self.lsprop.grid_oversampling,
+                                          self.lsprop.nyquist_factor)
+        else:
+            return freqgrid.fixed_grid(0.01, self.get_max_freq(curve), 
+                                       self.lsprop.freq_to_calculate)
+    
+    def calculate_periodgram_from_prepared(self, curve):
+        """ Calculates the periogram for one prepared curve.
+        
+            curve - PreparedCurve whose periodgram is calculated.
+        
+        """
+        
+        self.nmags = curve.mags
+        self.ntimes = curve.times
 
-        freqs = np.linspace(0.01, self.lsprop.max_freq_calculated, 
-                            self.lsprop.freq_to_calculate)
+        freqs = self.get_freqs(curve)
+        
+        self.lsprop.max_freq_calculated = freqs[-1]
+        
+        pgram = None
+        
+        if self.cache is not None:
+            key = self.cache.key(curve, self.lsprop.periodgram_settings())
+            pgram = self.cache.get(key)
 
-        # Calculte the periodgram using the Lomb Scargle method 
-        # implemented in scipy.
-        self.lsprop.pgram = scipy.signal.lombscargle(self.ntimes, self.nmags, freqs)
+        if pgram is not None:
+            self.lsprop.pgram = np.array(pgram, dtype=float)
+        elif self.engine is not self:
+            self.lsprop.pgram = self.engine.power(self.ntimes, self.nmags, freqs)[0]
+        elif self.lsprop.method == LSProperties.FAST_METHOD:
+            self.lsprop.pgram = fast_lombscargle_batch(
+                self.ntimes, self.nmags, freqs, 
+                oversampling = self.lsprop.oversampling,
+                memory_budget = self.lsprop.memory_budget)[0]
+        elif self.lsprop.precision == LSProperties.SINGLE_PRECISION:
+            self.lsprop.pgram = lombscargle_batch(
+                self.ntimes, self.nmags, freqs, 
+                memory_budget = self.lsprop.memory_budget, 
+                dtype = self.lsprop.dtype)[0]
+        else:
+            # Calculte the periodgram using the Lomb Scargle method 
+            # implemented in scipy.
+            self.lsprop.pgram = scipy.signal.lombscargle(self.ntimes, self.nmags, freqs)
+            
+        if self.cache is not None and pgram is None:
+            self.cache.put(key, self.lsprop.pgram)
 
-        # Get the indexes of the maximums in periodgram.
-        self.get_index_max_values()     
+        # Get the maximums in periodgram.
+        index_max_values, peak_freqs, peak_values = \
+            self.search_peaks(self.lsprop.pgram, freqs, self.ntimes, self.nmags)
+            
+        faps = self.calculate_faps([curve], freqs, peak_freqs)
+            
+        self.lsprop.set_periodgram(self.lsprop.pgram, freqs, index_max_values[0], 
+                                   peak_freqs[0], peak_values[0],
+                                   faps[0] if faps is not None else None)
 
         return freqs            
+        
+    def calculate_periodgram_from_curve(self, mags, unix_times):
+        """ Calculates the periogram for one curve.
+        
+            mags - Serie of magnitudes measured for the star.
+            unix_times - Times (in unix times) when the magnitudes have been measured.
+        
+        """
+        
+        return self.calculate_periodgram_from_prepared(
+            self.prepare_curve(mags, unix_times))
+    
+    def __calculate_periodgrams_same_grid(self, curves, freqs):
+        """ Calculates at once the periodgrams of several prepared curves 
+            that use the same frequencies. Returns a matrix with the 
+            periodgram of each curve in a row and three matrices with the 
+            indexes, frequencies and values of the maximums of each periodgram.
+            Only the periodgrams not found in the cache are calculated.
+            
+            curves - List of PreparedCurve objects.
+            freqs - Frequencies of the periodgrams.
+            
+        """
+        
+        if self.cache is None:
+            return self.__compute_periodgrams_same_grid(curves, freqs)
+        
+        settings = self.lsprop.periodgram_settings()
+        
+        keys = [self.cache.key(curve, settings) for curve in curves]
+        
+        pgrams = np.empty((len(curves), len(freqs)), dtype=self.lsprop.dtype)
+        
+        missing = []
+        
+        for i in range(len(curves)):
+            pgram = self.cache.get(keys[i])
+            
+            if pgram is None:
+                missing.append(i)
+            else:
+                pgrams[i] = pgram
+                
+        if len(missing) == len(curves):
+            results = self.__compute_periodgrams_same_grid(curves, freqs)
+            
+            for i in missing:
+                self.cache.put(keys[i], results[0][i])
+            
+            return results
+        
+        if len(missing) > 0:
+            pgrams[missing] = self.__compute_periodgrams_same_grid(
+                [curves[i] for i in missing], freqs)[0]
+            
+            for i in missing:
+                self.cache.put(keys[i], pgrams[i])
+        
+        # The maximums are searched again for all the curves, the zoom
+        # search needs the values of the curves.
+        padded_mags, padded_times, mask = \
+            pad_curves([(curve.mags, curve.times) for curve in curves])
+        
+        index_max_values, peak_freqs, peak_values = \
+            self.search_peaks(pgrams, freqs, padded_times, padded_mags, mask)
+        
+        return pgrams, index_max_values, peak_freqs, peak_values
+    
+    def __compute_periodgrams_same_grid(self, curves, freqs):
+        """ Calculates at once the periodgrams of several prepared curves 
+            that use the same frequencies. Returns a matrix with the 
+            periodgram of each curve in a row and three matrices with the 
+            indexes, frequencies and values of the maximums of each periodgram.
+            
+            curves - List of PreparedCurve objects.
+            freqs - Frequencies of the periodgrams.
+            
+        """
+        
+        shared = None
+        
+        if self.lsprop.shared_basis and self.engine is self and \
+            self.lsprop.method == LSProperties.DIRECT_METHOD and len(curves) > 1:
+            shared = shared_sampling(curves)
+        
+        if shared is not None:
+            times, padded_mags, mask = shared
+            
+            pgrams = lombscargle_shared(times, padded_mags, freqs, mask,
+                                        self.lsprop.memory_budget, 
+                                        self.lsprop.dtype)
+            
+            padded_times = np.tile(times, (len(curves), 1))
+        else:
+            padded_mags, padded_times, mask = \
+                pad_curves([(curve.mags, curve.times) for curve in curves])
+        
+            pgrams = self.engine.power(padded_times, padded_mags, freqs, mask)
+        
+        index_max_values, peak_freqs, peak_values = \
+            self.search_peaks(pgrams, freqs, padded_times, padded_mags, mask)
+        
+        return pgrams, index_max_values, peak_freqs, peak_values
+    
+    def calculate_periodgrams(self, curves):
+        """ Calculates at once the periodgrams of several prepared curves. 
+            Returns the periodgrams and frequencies of the curves, as 
+            matrices with a curve in each row when all the curves use the 
+            same number of frequencies or otherwise as lists of vectors, and 
+            three matrices with the indexes, frequencies and values of the 
+            maximums of each periodgram.
+            
+            curves - List of PreparedCurve objects.
+            
+        """
+        
+        freqs = [self.get_freqs(curve) for curve in curves]
+        
+        # The curves are grouped by their grid of frequencies, the grids of
+        # the baseline mode are shared by the curves with similar baselines
+        # and numbers of observations. The grids are compared by their 
+        # values, as a grid discarded by the cache is created again.
+        groups = collections.OrderedDict()
+        
+        for i in range(len(curves)):
+            groups.setdefault((len(freqs[i]), freqs[i][0], freqs[i][-1]), 
+                              []).append(i)
+        
+        pgrams = [None] * len(curves)
+        
+        number_of_freq = self.lsprop.number_of_freq
+        
+        index_max_values = np.zeros((len(curves), number_of_freq), dtype=int)
+        peak_freqs = np.zeros((len(curves), number_of_freq))
+        peak_values = np.zeros((len(curves), number_of_freq))
+        
+        for members in groups.values():
+            group_pgrams, index_max_values[members], peak_freqs[members], \
+                peak_values[members] = self.__calculate_periodgrams_same_grid(
+                    [curves[i] for i in members], freqs[members[0]])
+            
+            for i, pgram in zip(members, group_pgrams):
+                pgrams[i] = pgram
+        
+        if len(set([len(f) for f in freqs])) == 1:
+            pgrams = np.array(pgrams)
+            freqs = np.array(freqs)
+        
+        return pgrams, freqs, index_max_values, peak_freqs, peak_values
+
+    def calculate_faps(self, curves, freqs, peak_freqs):
+        """ Calculates the false alarm probabilities of the maximums found
+            in the periodgrams of several curves, with the method of the 
+            properties. Returns a matrix with the probabilities of the 
+            maximums of each curve in a row, or None if the properties don't
+            indicate a method.
+            
+            curves - List of PreparedCurve objects.
+            freqs - Frequencies of the periodgrams, a vector for all the 
+                curves or a matrix or list with the frequencies of each curve.
+            peak_freqs - Matrix with the frequencies of the maximums of each
+                periodgram in a row.
+            
+        """
+        
+        if self.lsprop.fap_method is None:
+            return None
+        
+        padded_mags, padded_times, mask = \
+            pad_curves([(curve.mags, curve.times) for curve in curves])
+        
+        # The periodgram doesn't subtract the mean of the magnitudes, so the
+        # values of the maximums are calculated again only at their 
+        # frequencies with the magnitudes centered.
+        centered_mags = falsealarm.centered_mags(padded_mags, mask)
+        
+        peak_freqs = np.atleast_2d(np.asarray(peak_freqs, dtype=float))
+        
+        # The refined frequencies aren't in the grid, so the Lomb Scargle
+        # periodgram is calculated directly.
+        if self.engine is self:
+            peak_values = lombscargle_batch(padded_times, centered_mags, 
+                                            peak_freqs, mask, 
+                                            self.lsprop.memory_budget)
+        else:
+            peak_values = self.engine.power(padded_times, centered_mags, 
+                                            peak_freqs, mask)
+        
+        if isinstance(freqs, np.ndarray) and freqs.ndim == 1:
+            freqs = [freqs] * len(curves)
+            
+        if self.lsprop.fap_method == LSProperties.BALUEV_FAP:
+            return falsealarm.baluev_fap(peak_values, padded_times, 
+                                         centered_mags, 
+                                         [f[-1] for f in freqs], mask)
+        
+        faps = np.zeros(peak_values.shape)
+        
+        # The periodgrams of the shuffles of the curves that use the same
+        # grid are calculated at once.
+        groups = collections.OrderedDict()
+        
+        for i in range(len(curves)):
+            groups.setdefault((len(freqs[i]), freqs[i][0], freqs[i][-1]), 
+                              []).append(i)
+            
+        for members in groups.values():
+            faps[members] = falsealarm.bootstrap_fap(
+                self.engine, peak_values[members], padded_times[members], 
+                centered_mags[members], freqs[members[0]], mask[members], 
+                self.lsprop.bootstrap_shuffles, self.lsprop.fap_processes)
+            
+        return faps
 
     def calculate_periodgram(self, pfilter, curve, plot = False):
         """ Calculates the periodgram using the Lomb Scargle method.
         
             pfilter - Filter used for these measures.
-            curve - Values of the curve.
+            curve - Values of the curve, from LEMONdB or LightCurveLoader.
             plot - It asks to plot a graph for the curve received.
         
         """
         
-        unix_times, mags, snrs = zip(*curve)
+        unix_times, mags, snrs = lcloader.curve_columns(curve)
 
         # Calculate periodgram using times and magnitudes of the curve.
         freqs = self.calculate_periodgram_from_curve(mags, unix_times)
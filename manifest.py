@@ -0,0 +1,221 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module keeps next to the features files a manifest with a fingerprint
+of the light curve of each star in each filter: the number of measures, the
+last epoch and a hash of the times and magnitudes. When the features are
+calculated again, the features of the stars whose curve has the same
+fingerprint are copied from the previous features files instead of
+calculating them.
+
+"""
+
+import os
+import csv
+import json
+import logging
+import numpy as np
+import csvdata
+import lcloader
+import incremental
+
+def curve_fingerprint(curve):
+    """ Returns the fingerprint of a light curve read from the database, a
+        list with the number of measures, the last epoch and a hash of the
+        times and magnitudes, or None if the curve is None.
+
+        curve - The light curve.
+
+    """
+
+    try:
+        unix_times, mags, snrs = lcloader.curve_columns(curve)
+    except TypeError:
+        return None
+
+    unix_times = np.asarray(unix_times, dtype=float)
+
+    if len(unix_times) == 0:
+        return None
+
+    return [len(unix_times), float(unix_times.max()),
+            incremental.array_digest(unix_times, mags)]
+
+class FeaturesManifest(object):
+    """ Fingerprints of the light curves of the stars whose features are
+        in a features file, and the features of the previous calculation
+        of the stars.
+
+    """
+
+    # Extension added to the name of the features file.
+    FILE_EXT = '.manifest'
+
+    def __init__(self, features_filename_):
+        """ Instantiation method for the FeaturesManifest class.
+
+            features_filename_ - Name of the features file, the features
+                of each filter are in its own file.
+
+        """
+
+        self.__features_filename = features_filename_
+        self.__filename = features_filename_ + FeaturesManifest.FILE_EXT
+        self.__settings = None
+
+        # Fingerprints and features of the previous calculation, and new
+        # fingerprints, by filter name and star identifier.
+        self.__fingerprints = {}
+        self.__features = {}
+        self.__new_fingerprints = {}
+
+    @property
+    def filename(self):
+        return self.__filename
+
+    def __read_features(self, filter_name):
+        """ Returns a dictionary with the features of each star in the
+            features file of a filter, or an empty dictionary if it can't
+            be read.
+
+            filter_name - Name of the filter.
+
+        """
+
+        features = {}
+
+        features_filename = csvdata.FeaturesFile().get_file_name(
+            filter_name, self.__features_filename)
+
+        try:
+            with open(features_filename, 'rb') as csvfile:
+                reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+
+                header = next(reader)
+
+                id_col = header.index(csvdata.CsvUtil.ID)
+
+                # The features are the columns after the class.
+                first_feature = header.index(csvdata.CsvUtil.CLASS) + 1
+
+                for row in reader:
+                    features[row[id_col]] = [float(value) for value
+                                             in row[first_feature:]]
+        except (IOError, ValueError, StopIteration, csv.Error) as e:
+            logging.warning("The features of the file %s can't be reused: %s" %
+                            (features_filename, e))
+
+            return {}
+
+        return features
+
+    def open(self, settings):
+        """ Reads the manifest and the previous features if they were
+            calculated with the same settings. Returns the number of stars
+            and filters whose features can be reused.
+
+            settings - String with the settings of the calculation.
+
+        """
+
+        self.__settings = settings
+
+        self.__fingerprints = {}
+        self.__features = {}
+        self.__new_fingerprints = {}
+
+        if not os.path.isfile(self.__filename):
+            return 0
+
+        try:
+            with open(self.__filename, 'rb') as manifest_file:
+                contents = json.loads(manifest_file.read().decode('utf-8'))
+        except ValueError:
+            logging.warning("The manifest %s can't be read." % self.__filename)
+
+            return 0
+
+        if contents.get('settings') != settings:
+            logging.info('The manifest %s was written with other settings, all the features are calculated.' %
+                         self.__filename)
+
+            return 0
+
+        self.__fingerprints = contents['fingerprints']
+
+        for filter_name in self.__fingerprints:
+            self.__features[filter_name] = self.__read_features(filter_name)
+
+        reusable = sum([len([star_id for star_id in fingerprints
+                             if star_id in self.__features[filter_name]])
+                        for filter_name, fingerprints in self.__fingerprints.items()])
+
+        logging.info('The features of %d stars and filters can be reused from %s.' %
+                     (reusable, self.__features_filename))
+
+        return reusable
+
+    def unchanged_features(self, filter_name, star_id, fingerprint):
+        """ Returns the previous features of a star in a filter if its
+            light curve has the same fingerprint, or None.
+
+            filter_name - Name of the filter.
+            star_id - Identifier of the star.
+            fingerprint - Fingerprint of the current light curve.
+
+        """
+
+        star_key = str(star_id)
+
+        if fingerprint is None or \
+            self.__fingerprints.get(filter_name, {}).get(star_key) != fingerprint:
+            return None
+
+        return self.__features.get(filter_name, {}).get(star_key)
+
+    def update(self, filter_name, stars_ids, fingerprints):
+        """ Sets the new fingerprints of some stars in a filter.
+
+            filter_name - Name of the filter.
+            stars_ids - Identifiers of the stars.
+            fingerprints - Fingerprints of their light curves, None for the
+                stars without features.
+
+        """
+
+        filter_fingerprints = self.__new_fingerprints.setdefault(filter_name, {})
+
+        for star_id, fingerprint in zip(stars_ids, fingerprints):
+            if fingerprint is not None:
+                filter_fingerprints[str(star_id)] = fingerprint
+
+    def write(self):
+        """ Writes the new fingerprints to the manifest, once the features
+            have been written.
+
+        """
+
+        # The file is written with another name and renamed, so a partial
+        # file is never read.
+        temp_filename = '%s.%d.tmp' % (self.__filename, os.getpid())
+
+        with open(temp_filename, 'wb') as manifest_file:
+            manifest_file.write(json.dumps({'settings': self.__settings,
+                                            'fingerprints': self.__new_fingerprints}).encode('utf-8'))
+
+        os.rename(temp_filename, self.__filename)
@@ -23,7 +23,6 @@ according to their periodic light variations.
 
 """
 
-import math
 import numpy as np
 import scipy.stats
 
@@ -67,6 +66,21 @@ class NonPeriodicFeature(object):
         self.nmags = nmags_
         self.ntimes = ntimes_
         
+        # Magnitudes sorted, calculated the first time they are needed to
+        # get the order statistics of the curve.
+        self.__sorted_mags = None
+        
+        # Differences between consecutive times and magnitudes, and the
+        # average and standard deviation of the intervals of time, 
+        # calculated the first time they are needed.
+        self.__time_diffs = None
+        self.__mag_diffs = None
+        self.__interval_stats = None
+        
+        # Standard deviation of the magnitudes, calculated the first time
+        # it is needed.
+        self.__std_mags = None
+        
     def __str__(self):
         """ The 'informal' string representation """
         
@@ -78,6 +92,55 @@ class NonPeriodicFeature(object):
         
         return len(self.pgram)   
     
+    def __sorted(self):
+        """ Returns the magnitudes sorted, they are sorted only once. """
+        
+        if self.__sorted_mags is None:
+            self.__sorted_mags = np.sort(np.asarray(self.nmags, dtype=float))
+            
+        return self.__sorted_mags
+    
+    def __percentile(self, per):
+        """ Returns the percentile of the magnitudes interpolated from the 
+            sorted magnitudes, with the same interpolation of 
+            scipy.stats.scoreatpercentile.
+            
+            per - Percentile to calculate, in the range 0-100.
+            
+        """
+        
+        sorted_mags = self.__sorted()
+        
+        idx = per / 100. * (len(sorted_mags) - 1)
+        i = int(idx)
+        
+        if i == idx:
+            return sorted_mags[i]
+        else:
+            j = i + 1
+            
+            return (sorted_mags[i] * (j - idx) + sorted_mags[j] * (idx - i)) / \
+                ((j - idx) + (idx - i))
+    
+    def __median(self):
+        """ Returns the median of the magnitudes, as np.median. """
+        
+        sorted_mags = self.__sorted()
+        
+        half = len(sorted_mags) // 2
+        
+        if len(sorted_mags) % 2 == 1:
+            return sorted_mags[half]
+        else:
+            return (sorted_mags[half - 1] + sorted_mags[half]) / 2.0
+        
+    def __min_max(self):
+        """ Returns the minimum and maximum magnitudes. """
+        
+        sorted_mags = self.__sorted()
+        
+        return sorted_mags[0], sorted_mags[-1]
+
     def amplitude_dif(self):
         """ Return half the difference between the maximum and the minimum
             magnitude.
@@ -85,8 +148,7 @@ class NonPeriodicFeature(object):
         """
 
         # Get the maximum and minimum values of the magnitude.
-        max_mag = self.nmags[np.argmax(self.nmags)]
-        min_mag = self.nmags[np.argmin(self.nmags)]
+        min_mag, max_mag = self.__min_max()
 
         return (max_mag - min_mag) / 2, NonPeriodicFeature.__AMP_DIF_FEAT_NAME
 
@@ -101,7 +163,7 @@ class NonPeriodicFeature(object):
 
         # Calculate weighted average and standard deviation of the flux.
         avg = np.average(self.nmags)
-        std = np.std(self.nmags)
+        std = self.__std()
 
         # Count the number of measures beyond average plus-minus std.
         for n in range(len(self.nmags)):
@@ -121,24 +183,60 @@ class NonPeriodicFeature(object):
 
         return slope, NonPeriodicFeature.__LINEAR_TREND_FEAT_NAME
 
+    def __std(self):
+        """ Returns the standard deviation of the magnitudes, it is 
+            calculated only once.
+            
+        """
+        
+        if self.__std_mags is None:
+            self.__std_mags = np.std(self.nmags)
+            
+        return self.__std_mags
+    
+    def __diffs(self):
+        """ Returns the differences between consecutive times and between
+            consecutive magnitudes, they are calculated only once.
+            
+        """
+        
+        if self.__time_diffs is None:
+            self.__time_diffs = np.diff(np.asarray(self.ntimes, dtype=float))
+            self.__mag_diffs = np.diff(np.asarray(self.nmags, dtype=float))
+            
+        return self.__time_diffs, self.__mag_diffs
+
     def __interval_avg_and_std(self):
         """ Calculate average and standard deviation of time intervals. """
         
-        intervals = []
-
-        # As iterations use current index plus 1, range must be reduced in 1.
-        for n in range(len(self.ntimes) - 1):
-            intervals.append(self.ntimes[n + 1] - self.ntimes[n])
-
-        interval_avg = np.average(intervals)
-        interval_std = np.std(intervals)
+        if self.__interval_stats is None:
+            intervals, mag_diffs = self.__diffs()
+            
+            self.__interval_stats = (np.average(intervals), np.std(intervals))
 
-        return interval_avg, interval_std
+        return self.__interval_stats
 
-    def __calculate_slope(self, x1, x2, y1, y2):
-        """ Calculate the slope for two points. """
+    def __slopes(self):
+        """ Returns the slopes between consecutive measures and a mask of 
+            the intervals of time that must be taken in account, those
+            shorter than the average plus the standard deviation of the 
+            intervals. 
+            
+        """
+        
+        time_diffs, mag_diffs = self.__diffs()
+        
+        # Calculate average and standard deviation of time intervals.
+        interval_avg, interval_std = self.__interval_avg_and_std()
 
-        return (y2 - y1) / (x2 - x1)
+        # The maximum interval considered is the weighted average plus
+        # standard deviation.
+        interval_max_size = interval_avg + interval_std
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = mag_diffs / time_diffs
+        
+        return slopes, time_diffs < interval_max_size
 
     def max_slope(self):
         """ Maximum absolute of the flux slope between two consecutive 
@@ -150,41 +248,32 @@ class NonPeriodicFeature(object):
 
         max_slp = 0
 
-        # Calculate average and standard deviation of time intervals.
-        interval_avg, interval_std = self.__interval_avg_and_std()
-
-        # The maximum interval considered is the weighted average plus
-        # standard deviation.
-        interval_max_size = interval_avg + interval_std
-
-        # Search the max slope.
-        for n in range(len(self.ntimes) - 1):
-
-            # If the interval must be taken in account.
-            if self.ntimes[n + 1] - self.ntimes[n] < interval_max_size:
-
-                # Calculate slope
-                current_slope = self.__calculate_slope(
-                    self.ntimes[n], self.ntimes[n + 1],
-                    self.nmags[n], self.nmags[n + 1])
-
-                if current_slope > max_slp:
-                    max_slp = current_slope
+        slopes, valid = self.__slopes()
+        
+        # Only the positive slopes of the intervals taken in account.
+        candidates = slopes[valid & (slopes > max_slp)]
+        
+        if len(candidates) > 0:
+            max_slp = candidates.max()
 
         return max_slp, NonPeriodicFeature.__MAX_SLOPE_FEAT_NAME
 
     def median_absolute_deviation(self):
         """ Median discrepancy of the fluxes from the median flux. """
 
-        num_elements = len(self.nmags)
-        med_calc = []
-
-        median = np.median(self.nmags)
-
-        for n in range(num_elements):
-            med_calc.append(math.fabs(self.nmags[n] - median))
+        deviations = np.abs(self.__sorted() - self.__median())
+        
+        # The median of the deviations only needs the middle values, 
+        # partitioned around them instead of sorting all the deviations.
+        half = len(deviations) // 2
+        
+        if len(deviations) % 2 == 1:
+            mad = np.partition(deviations, half)[half]
+        else:
+            middle = np.partition(deviations, [half - 1, half])
+            mad = (middle[half - 1] + middle[half]) / 2.0
                        
-        return np.median(med_calc), NonPeriodicFeature.__MED_ABS_DEV_FEAT_NAME
+        return mad, NonPeriodicFeature.__MED_ABS_DEV_FEAT_NAME
 
     def median_buffer_range_percentage(self):
         """ Percentage of fluxes within 10% of the amplitude from the median. """
@@ -193,7 +282,7 @@ class NonPeriodicFeature(object):
         number_values = 0
 
         # Get the median.
-        median = np.median(self.nmags)
+        median = self.__median()
 
         # Range with the maximum and minimum value.
         upper_value = median + 0.1 * median
@@ -221,30 +310,15 @@ class NonPeriodicFeature(object):
         if number > len(self.ntimes):
             number = len(self.ntimes)
 
-        num_positive_slopes = 0
-
-        # Calculate average and standard deviation of time intervals.
-        interval_avg, interval_std = self.__interval_avg_and_std()
-
-        # The maximum interval considered is the weighted average plus
-        # standard deviation.
-        interval_max_size = interval_avg + interval_std
-
-        # Search the number of consecutive intervals with positive slope.
-        # The search uses two elements of the array, current element and 2, 
-        # so the range to iterate must be reduced in 1 element.
-        for n in range(len(self.ntimes) - number, len(self.ntimes) - 1):
-
-            # If the interval must be taken in account.
-            if self.ntimes[n + 1] - self.ntimes[n] < interval_max_size:
-
-                # Calculate slope
-                current_slope = self.__calculate_slope(
-                    self.ntimes[n], self.ntimes[n + 1],
-                    self.nmags[n], self.nmags[n + 1])
+        slopes, valid = self.__slopes()
 
-                if current_slope > 0:
-                    num_positive_slopes += 1
+        # Count the consecutive intervals with positive slope among the
+        # last ones. The search uses two elements of the array, current 
+        # element and the next one, so the last interval used is that of 
+        # the two last elements.
+        last = slice(len(self.ntimes) - number, len(self.ntimes) - 1)
+        
+        num_positive_slopes = np.count_nonzero(valid[last] & (slopes[last] > 0))
 
         # Calculate the percentage using the number of positive slopes and
         # the total number of intervals, this is the number of samples minus 1.
@@ -257,11 +331,10 @@ class NonPeriodicFeature(object):
         """
             
         # Get the median.
-        median = np.median(self.nmags)    
+        median = self.__median()
         
         # Get max and min values of the curve.
-        max_mag = self.nmags[np.argmax(self.nmags)]
-        min_mag = self.nmags[np.argmin(self.nmags)]
+        min_mag, max_mag = self.__min_max()
         
         # Calculate the difference between maximum and minimum values
         # and the median.
@@ -278,10 +351,10 @@ class NonPeriodicFeature(object):
             
         """
             
-        percentile_05 = scipy.stats.scoreatpercentile(self.nmags, 5)
-        percentile_95 = scipy.stats.scoreatpercentile(self.nmags, 95)
+        percentile_05 = self.__percentile(5)
+        percentile_95 = self.__percentile(95)
         
-        return np.median(self.nmags)  * 100 / (percentile_95 - percentile_05), \
+        return self.__median() * 100 / (percentile_95 - percentile_05), \
             NonPeriodicFeature.__PER_DIF_FLUX_PER_FEAT_NAME
 
     def skew(self):
@@ -297,7 +370,7 @@ class NonPeriodicFeature(object):
     def std(self):
         """ Standard deviation of the fluxes. """
         
-        return np.std(self.nmags), NonPeriodicFeature.__STD_FEAT_NAME
+        return self.__std(), NonPeriodicFeature.__STD_FEAT_NAME
     
     def __flux_percentile_ratio_midXX(self, lower_perc, upper_perc):
         """ The difference between upper_perc and lower_perc percentiles flux 
@@ -305,10 +378,8 @@ class NonPeriodicFeature(object):
             
         """
             
-        return (scipy.stats.scoreatpercentile(self.nmags, upper_perc) - \
-                    scipy.stats.scoreatpercentile(self.nmags, lower_perc)) / \
-                    (scipy.stats.scoreatpercentile(self.nmags, 95) - \
-                    scipy.stats.scoreatpercentile(self.nmags, 5))    
+        return (self.__percentile(upper_perc) - self.__percentile(lower_perc)) / \
+            (self.__percentile(95) - self.__percentile(5))
     
     def flux_percentile_ratio_mid20(self):
         """ The difference between 60% and 40% flux values divided by 
@@ -351,4 +422,285 @@ class NonPeriodicFeature(object):
         """
             
         return self.__flux_percentile_ratio_midXX(10, 90), \
-            NonPeriodicFeature.__FLUX_PERC_RAT_MID80_FEAT_NAME                  
\ No newline at end of file
+            NonPeriodicFeature.__FLUX_PERC_RAT_MID80_FEAT_NAME
+    
+    @staticmethod
+    def features_names():
+        """ Returns the names of the features calculated by this class, in 
+            the order used by StarsFeatures.save_feature.
+            
+        """
+        
+        return [NonPeriodicFeature.__AMP_DIF_FEAT_NAME,
+                NonPeriodicFeature.__BEY1ST_FEAT_NAME,
+                NonPeriodicFeature.__LINEAR_TREND_FEAT_NAME,
+                NonPeriodicFeature.__MAX_SLOPE_FEAT_NAME,
+                NonPeriodicFeature.__MED_ABS_DEV_FEAT_NAME,
+                NonPeriodicFeature.__MED_BUF_RAN_PER_FEAT_NAME,
+                NonPeriodicFeature.__PAIR_SLOPE_TREND_FEAT_NAME,
+                NonPeriodicFeature.__PER_AMP_FEAT_NAME,
+                NonPeriodicFeature.__PER_DIF_FLUX_PER_FEAT_NAME,
+                NonPeriodicFeature.__SKEW_FEAT_NAME,
+                NonPeriodicFeature.__KURTOSIS_FEAT_NAME,
+                NonPeriodicFeature.__STD_FEAT_NAME,
+                NonPeriodicFeature.__FLUX_PERC_RAT_MID20_FEAT_NAME,
+                NonPeriodicFeature.__FLUX_PERC_RAT_MID35_FEAT_NAME,
+                NonPeriodicFeature.__FLUX_PERC_RAT_MID50_FEAT_NAME,
+                NonPeriodicFeature.__FLUX_PERC_RAT_MID65_FEAT_NAME,
+                NonPeriodicFeature.__FLUX_PERC_RAT_MID80_FEAT_NAME]
+    
+    @staticmethod
+    def __segment_percentile(sorted_mags, starts, lengths, per):
+        """ Returns the percentile of the magnitudes of each curve, with the
+            interpolation of scipy.stats.scoreatpercentile.
+            
+            sorted_mags - Magnitudes of the curves concatenated, sorted 
+                inside each curve.
+            starts - Position of the first magnitude of each curve.
+            lengths - Number of magnitudes of each curve.
+            per - Percentile to calculate, in the range 0-100.
+            
+        """
+        
+        idx = per / 100. * (lengths - 1)
+        i = np.floor(idx).astype(int)
+        j = np.minimum(i + 1, lengths - 1)
+        
+        lower = sorted_mags[starts + i]
+        upper = sorted_mags[starts + j]
+        
+        interpolated = (lower * (i + 1 - idx) + upper * (idx - i)) / \
+            ((i + 1 - idx) + (idx - i))
+        
+        return np.where(idx == i, lower, interpolated)
+    
+    @staticmethod
+    def __segment_median(sorted_mags, starts, lengths):
+        """ Returns the median of the magnitudes of each curve, as np.median.
+            
+            sorted_mags - Magnitudes of the curves concatenated, sorted 
+                inside each curve.
+            starts - Position of the first magnitude of each curve.
+            lengths - Number of magnitudes of each curve.
+            
+        """
+        
+        lower = sorted_mags[starts + (lengths - 1) // 2]
+        upper = sorted_mags[starts + lengths // 2]
+        
+        return np.where(lengths % 2 == 1, upper, (lower + upper) / 2.0)
+    
+    @staticmethod
+    def features_batch(mags, times, offsets, columns = None):
+        """ Calculates at once the non periodic features of several curves.
+            Returns a matrix with the features of each curve in a row, in 
+            the order of features_names, and the names of the features. 
+            The features are calculated with reductions over the segments of
+            each curve in the vectors of all the measures, and have the 
+            same definitions that the methods of this class. The values
+            shared by several features, as the sorted magnitudes, are only
+            calculated if a feature selected needs them.
+            
+            mags - Magnitudes of all the curves concatenated.
+            times - Times of all the curves concatenated, each curve 
+                beginning at time 0.
+            offsets - Position of the first measure of each curve and the 
+                total number of measures, as returned by 
+                lightcurve.concatenate_curves. The curves can't be empty.
+            columns - Positions in features_names of the features to 
+                calculate, None to calculate all of them.
+            
+        """
+        
+        mags = np.asarray(mags, dtype=float)
+        times = np.asarray(times, dtype=float)
+        offsets = np.asarray(offsets, dtype=int)
+        
+        names = NonPeriodicFeature.features_names()
+        
+        if columns is None:
+            columns = range(len(names))
+        
+        starts = offsets[:-1]
+        ends = offsets[1:]
+        lengths = ends - starts
+        n_curves = len(lengths)
+        
+        # Curve of each measure.
+        ids = np.repeat(np.arange(n_curves), lengths)
+        
+        def segment_sum(values, segments = ids):
+            return np.bincount(segments, weights=values, minlength=n_curves)
+        
+        # Values shared by several features, calculated the first time a
+        # feature needs them.
+        values = {}
+        
+        def shared(name, function):
+            if name not in values:
+                values[name] = function()
+                
+            return values[name]
+        
+        def sorted_mags():
+            # Magnitudes sorted inside each curve.
+            return shared('sorted_mags', lambda: mags[np.lexsort((mags, ids))])
+        
+        def median():
+            return shared('median', lambda: NonPeriodicFeature.__segment_median(
+                sorted_mags(), starts, lengths))
+        
+        def percentile(per):
+            return shared(('percentile', per), 
+                          lambda: NonPeriodicFeature.__segment_percentile(
+                              sorted_mags(), starts, lengths, per))
+        
+        def moments():
+            # Central moments of the magnitudes.
+            def calculate():
+                mean = segment_sum(mags) / lengths
+                deviations = mags - mean[ids]
+                
+                m2 = segment_sum(deviations ** 2) / lengths
+                
+                return mean, deviations, m2
+            
+            return shared('moments', calculate)
+        
+        def std():
+            return np.sqrt(moments()[2])
+        
+        def central_moment(order):
+            return shared(('moment', order), 
+                          lambda: segment_sum(moments()[1] ** order) / lengths)
+        
+        def constant():
+            # The moments of constant curves are undefined, as in scipy.
+            mean, deviations, m2 = moments()
+            
+            return m2 <= (np.finfo(float).eps * mean) ** 2
+        
+        def slopes():
+            # Differences of consecutive measures of the same curve, and 
+            # the slopes of the intervals shorter than the gap threshold.
+            def calculate():
+                inside = ids[1:] == ids[:-1]
+                diff_ids = ids[:-1][inside]
+                time_diffs = np.diff(times)[inside]
+                mag_diffs = np.diff(mags)[inside]
+                
+                n_diffs = np.maximum(lengths - 1, 0)
+                
+                interval_avg = segment_sum(time_diffs, diff_ids) / n_diffs
+                interval_std = np.sqrt(segment_sum(
+                    (time_diffs - interval_avg[diff_ids]) ** 2, diff_ids) / n_diffs)
+                
+                slopes = mag_diffs / time_diffs
+                valid = time_diffs < (interval_avg + interval_std)[diff_ids]
+                positive = valid & (slopes > 0)
+                
+                return diff_ids, n_diffs, slopes, positive
+            
+            return shared('slopes', calculate)
+        
+        def amplitude_dif():
+            sorted_values = sorted_mags()
+            
+            return (sorted_values[ends - 1] - sorted_values[starts]) / 2
+        
+        def beyond1st():
+            mean = moments()[0]
+            
+            beyond = (mags < (mean - std())[ids]) | (mags > (mean + std())[ids])
+            
+            return segment_sum(beyond) * 100.0 / lengths
+        
+        def linear_trend():
+            # Linear fit of the magnitudes.
+            time_deviations = times - (segment_sum(times) / lengths)[ids]
+            
+            return segment_sum(time_deviations * moments()[1]) / \
+                segment_sum(time_deviations ** 2)
+        
+        def max_slope():
+            diff_ids, n_diffs, slopes_values, positive = slopes()
+            
+            max_slope = np.zeros(n_curves)
+            np.maximum.at(max_slope, diff_ids[positive], slopes_values[positive])
+            
+            return max_slope
+        
+        def median_absolute_deviation():
+            # Median of the absolute deviations from the median.
+            abs_deviations = np.abs(sorted_mags() - median()[ids])
+            abs_deviations = abs_deviations[np.lexsort((abs_deviations, ids))]
+            
+            return NonPeriodicFeature.__segment_median(abs_deviations, starts,
+                                                       lengths)
+        
+        def median_buffer_range_percentage():
+            # The median buffer range doesn't use the last measure.
+            not_last = np.ones(len(mags), dtype=bool)
+            not_last[ends - 1] = False
+            
+            out_of_buffer = (mags < (median() - 0.1 * median())[ids]) | \
+                (mags > (median() + 0.1 * median())[ids])
+            
+            return segment_sum(out_of_buffer & not_last) * 100.0 / lengths
+        
+        def pair_slope_trend():
+            diff_ids, n_diffs, slopes_values, positive = slopes()
+            
+            # Position of each difference in its curve, to take the last ones.
+            diff_starts = np.concatenate(([0], np.cumsum(n_diffs)))[:-1]
+            diff_positions = np.arange(len(diff_ids)) - diff_starts[diff_ids]
+            
+            number = np.minimum(30, lengths)
+            last = diff_positions >= (lengths - number)[diff_ids]
+            
+            return segment_sum(positive[last], diff_ids[last]) * \
+                100.0 / (number - 1)
+        
+        def percent_amplitude():
+            sorted_values = sorted_mags()
+            
+            dif_max_med = sorted_values[ends - 1] - median()
+            dif_min_med = median() - sorted_values[starts]
+            
+            return np.where(dif_max_med > dif_min_med, dif_max_med, 
+                            dif_min_med) * 100.0 / \
+                (sorted_values[ends - 1] - sorted_values[starts])
+        
+        def percent_difference_flux_percentile():
+            return median() * 100 / (percentile(95) - percentile(5))
+        
+        def skew():
+            return np.where(constant(), np.nan, 
+                            central_moment(3) / moments()[2] ** 1.5)
+        
+        def kurtosis():
+            return np.where(constant(), np.nan, 
+                            central_moment(4) / moments()[2] ** 2 - 3)
+        
+        def flux_percentile_ratio(lower_perc, upper_perc):
+            return lambda: (percentile(upper_perc) - percentile(lower_perc)) / \
+                (percentile(95) - percentile(5))
+        
+        # Function of each feature, in the order of features_names.
+        functions = [amplitude_dif, beyond1st, linear_trend, max_slope,
+                     median_absolute_deviation, median_buffer_range_percentage,
+                     pair_slope_trend, percent_amplitude,
+                     percent_difference_flux_percentile, skew, kurtosis, std,
+                     flux_percentile_ratio(40, 60), 
+                     flux_percentile_ratio(32.5, 67.5), 
+                     flux_percentile_ratio(25, 75),
+                     flux_percentile_ratio(17.5, 82.5), 
+                     flux_percentile_ratio(10, 90)]
+        
+        features = np.zeros((n_curves, len(columns)))
+        
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for i, column in enumerate(columns):
+                features[:, i] = functions[column]()
+                
+        return features, [names[column] for column in columns]
@@ -0,0 +1,947 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module calculates the non periodic features of a light curve reading
+its measures in chunks, with a memory that doesn't depend on the length of
+the curve. The moments are updated with the formulas of Welford and Pebay,
+the percentiles are estimated with a quantile sketch of weighted centroids
+similar to the t-digest, and the statistics of the slopes are calculated
+exactly keeping only the candidates to maximum slope and the last measures.
+The state of a curve can be merged with the state of the measures that
+follow it and saved to a file, so the features are updated with the new
+measures without calculating them again from the whole curve.
+The percentiles are exact up to 5 * COMPRESSION measures, for longer curves
+the features of APPROXIMATE_METHODS are estimates, so these features are
+only used when they are requested to update the features of the stars.
+
+"""
+
+import os
+import math
+import logging
+import numpy as np
+import incremental
+import featureregistry
+import nonperiodicfeature
+
+# Number of last measures used by pair_slope_trend.
+PAIR_SLOPE_MEASURES = 30
+
+# Default parameter of the size of the quantile sketches, they keep about
+# COMPRESSION / 2 centroids, and the error of the percentiles of the features
+# is lower than 1% of the range 5-95.
+COMPRESSION = 1000
+
+# Default number of measures of each chunk read from a curve.
+CHUNK_SIZE = 10000
+
+# Methods whose features are estimated from the quantile sketch for the
+# curves with more than 5 * COMPRESSION measures, the rest are exact.
+APPROXIMATE_METHODS = ['beyond1st', 'median_absolute_deviation',
+                       'median_buffer_range_percentage', 'percent_amplitude',
+                       'percent_difference_flux_percentile',
+                       'flux_percentile_ratio_mid20', 'flux_percentile_ratio_mid35',
+                       'flux_percentile_ratio_mid50', 'flux_percentile_ratio_mid65',
+                       'flux_percentile_ratio_mid80']
+
+def merge_moments(count_a, mean_a, m2_a, m3_a, m4_a,
+                  count_b, mean_b, m2_b, m3_b, m4_b):
+    """ Returns the number of values, the mean and the sums of the second,
+        third and fourth powers of the deviations from the mean of the union
+        of two sets of values, from those of each set (Pebay, 2008).
+
+        count_a, mean_a, m2_a, m3_a, m4_a - Moments of the first set.
+        count_b, mean_b, m2_b, m3_b, m4_b - Moments of the second set.
+
+    """
+
+    count = count_a + count_b
+
+    if count_a == 0:
+        return count_b, mean_b, m2_b, m3_b, m4_b
+    elif count_b == 0:
+        return count_a, mean_a, m2_a, m3_a, m4_a
+
+    delta = mean_b - mean_a
+    delta_n = delta / count
+
+    mean = mean_a + count_b * delta_n
+
+    m2 = m2_a + m2_b + delta * delta_n * count_a * count_b
+
+    m3 = m3_a + m3_b + \
+        delta * delta_n ** 2 * count_a * count_b * (count_a - count_b) + \
+        3 * delta_n * (count_a * m2_b - count_b * m2_a)
+
+    m4 = m4_a + m4_b + \
+        delta * delta_n ** 3 * count_a * count_b * \
+        (count_a ** 2 - count_a * count_b + count_b ** 2) + \
+        6 * delta_n ** 2 * (count_a ** 2 * m2_b + count_b ** 2 * m2_a) + \
+        4 * delta_n * (count_a * m3_b - count_b * m3_a)
+
+    return count, mean, m2, m3, m4
+
+def chunk_moments(values):
+    """ Returns the number of values, the mean and the sums of the second,
+        third and fourth powers of the deviations from the mean of a chunk
+        of values.
+
+        values - Values of the chunk.
+
+    """
+
+    count = len(values)
+
+    if count == 0:
+        return 0, 0.0, 0.0, 0.0, 0.0
+
+    mean = np.mean(values)
+    deviations = values - mean
+
+    return count, mean, np.sum(deviations ** 2), np.sum(deviations ** 3), \
+        np.sum(deviations ** 4)
+
+def slope_frontier(intervals, slopes):
+    """ Returns the intervals and slopes that can be the maximum slope for
+        some maximum interval, those whose slope is greater than the slopes
+        of all the shorter intervals, sorted by interval.
+
+        intervals - Intervals of time between consecutive measures.
+        slopes - Slopes of the magnitudes in each interval.
+
+    """
+
+    order = np.lexsort((-slopes, intervals))
+
+    intervals = intervals[order]
+    slopes = slopes[order]
+
+    previous_max = np.concatenate(([-np.inf], np.maximum.accumulate(slopes)[:-1]))
+
+    candidates = slopes > previous_max
+
+    return intervals[candidates], slopes[candidates]
+
+class QuantileSketch(object):
+    """ Estimates the quantiles of a set of values keeping weighted
+        centroids, as the merging t-digest. The values near the extremes are
+        kept in smaller centroids, so the error of a quantile q is about
+        proportional to q * (1 - q). Up to a maximum number of centroids the
+        values are kept and the quantiles are exact. Two sketches can be
+        merged.
+
+    """
+
+    def __init__(self, compression_ = COMPRESSION):
+        """ Instantiation method for the QuantileSketch class.
+
+            compression_ - Parameter of the size of the sketch, the
+                centroids are compressed to about compression_ / 2 and
+                they are kept without compression up to 5 * compression_.
+
+        """
+
+        self.__compression = compression_
+        self.__means = np.zeros(0)
+        self.__weights = np.zeros(0)
+
+    @property
+    def compression(self):
+        return self.__compression
+
+    @property
+    def means(self):
+        return self.__means
+
+    @property
+    def weights(self):
+        return self.__weights
+
+    @property
+    def count(self):
+        return self.__weights.sum()
+
+    @staticmethod
+    def from_centroids(means, weights, compression = COMPRESSION):
+        """ Returns a sketch with the centroids received.
+
+            means - Means of the centroids, sorted.
+            weights - Weights of the centroids.
+            compression - Parameter of the size of the sketch.
+
+        """
+
+        sketch = QuantileSketch(compression)
+        sketch.__means = np.asarray(means, dtype=float)
+        sketch.__weights = np.asarray(weights, dtype=float)
+
+        return sketch
+
+    def __add_centroids(self, means, weights):
+        """ Adds some centroids to the sketch and compresses them if they
+            exceed the maximum number.
+
+            means - Means of the centroids.
+            weights - Weights of the centroids.
+
+        """
+
+        means = np.concatenate((self.__means, means))
+        weights = np.concatenate((self.__weights, weights))
+
+        order = np.argsort(means, kind='mergesort')
+
+        means = means[order]
+        weights = weights[order]
+
+        if len(means) > 5 * self.__compression:
+            # Each centroid is assigned to a bucket of the scale function
+            # k(q) = compression / (2 pi) * asin(2 q - 1) by the quantile of
+            # its center, and the centroids of each bucket are merged.
+            cumulative = np.cumsum(weights)
+            centers = (cumulative - weights / 2) / cumulative[-1]
+
+            k = self.__compression / (2 * math.pi) * \
+                np.arcsin(np.clip(2 * centers - 1, -1, 1))
+
+            buckets = np.floor(k - k[0]).astype(int)
+
+            # The buckets are consecutive, the extremes are kept alone.
+            buckets = np.concatenate(([0], buckets[1:-1] + 1,
+                                      [buckets[-2] + 2 if len(buckets) > 2 else 1]))
+
+            merged_weights = np.bincount(buckets, weights=weights)
+            merged_sums = np.bincount(buckets, weights=means * weights)
+
+            used = merged_weights > 0
+
+            weights = merged_weights[used]
+            means = merged_sums[used] / weights
+
+        self.__means = means
+        self.__weights = weights
+
+    def update(self, values):
+        """ Adds some values to the sketch.
+
+            values - Values to add.
+
+        """
+
+        values = np.asarray(values, dtype=float)
+
+        if len(values) > 0:
+            self.__add_centroids(values, np.ones(len(values)))
+
+    def merge(self, other):
+        """ Adds to the sketch the values of another sketch.
+
+            other - QuantileSketch to merge.
+
+        """
+
+        if len(other.means) > 0:
+            self.__add_centroids(other.means, other.weights)
+
+    def __centers(self):
+        """ Returns the position of the center of each centroid, with the
+            values of weight 1 at positions 0, 1, 2 ...
+
+        """
+
+        return np.cumsum(self.__weights) - self.__weights / 2 - 0.5
+
+    def percentile(self, per):
+        """ Returns the estimated percentile of the values, with the
+            interpolation of scipy.stats.scoreatpercentile.
+
+            per - Percentile to calculate, in the range 0-100.
+
+        """
+
+        return np.interp(per / 100. * (self.count - 1), self.__centers(),
+                         self.__means)
+
+    def median(self):
+        """ Returns the estimated median of the values. """
+
+        return self.percentile(50)
+
+    def count_below(self, value):
+        """ Returns the estimated number of values lower than a value.
+
+            value - Value to compare.
+
+        """
+
+        if len(self.__means) == 0 or value <= self.__means[0]:
+            return 0
+        elif value > self.__means[-1]:
+            return self.count
+
+        # The values lower than the value are those of the centroids lower
+        # than it, the centroid that contains it is interpolated.
+        position = np.searchsorted(self.__means, value)
+
+        lower = np.sum(self.__weights[:position - 1])
+
+        fraction = (value - self.__means[position - 1]) / \
+            (self.__means[position] - self.__means[position - 1])
+
+        return lower + self.__weights[position - 1] + \
+            (fraction - 1) * (self.__weights[position - 1] - 1) / 2 + \
+            fraction * (self.__weights[position] - 1) / 2
+
+    def count_above(self, value):
+        """ Returns the estimated number of values greater than a value.
+
+            value - Value to compare.
+
+        """
+
+        if len(self.__means) == 0 or value >= self.__means[-1]:
+            return 0
+        elif value < self.__means[0]:
+            return self.count
+
+        position = np.searchsorted(self.__means, value, side='right')
+
+        upper = np.sum(self.__weights[position + 1:])
+
+        fraction = (self.__means[position] - value) / \
+            (self.__means[position] - self.__means[position - 1])
+
+        return upper + self.__weights[position] + \
+            (fraction - 1) * (self.__weights[position] - 1) / 2 + \
+            fraction * (self.__weights[position - 1] - 1) / 2
+
+    def deviations_sketch(self, center):
+        """ Returns a sketch of the absolute deviations of the values from
+            a center, estimated with the deviations of the centroids.
+
+            center - Value whose deviations are calculated.
+
+        """
+
+        deviations = np.abs(self.__means - center)
+
+        order = np.argsort(deviations, kind='mergesort')
+
+        return QuantileSketch.from_centroids(deviations[order],
+                                             self.__weights[order],
+                                             self.__compression)
+
+class OnlineNonPeriodicFeature(object):
+    """ Non periodic features of a light curve read in chunks, with the same
+        methods that NonPeriodicFeature. The moments, the linear trend, the
+        extremes and the slopes are exact, the features derived from the
+        percentiles and the counts of values around the mean or the median,
+        those of APPROXIMATE_METHODS, are estimated with a QuantileSketch.
+        The chunks must be added in the order of the times of the curve.
+
+    """
+
+    # Names of the features for each method, as NonPeriodicFeature.
+    __NAMES = dict(zip(featureregistry.NON_PERIODIC_METHODS,
+                       nonperiodicfeature.NonPeriodicFeature.features_names()))
+
+    # Files to save the state.
+    FILE_EXT = '.npz'
+
+    def __init__(self, compression_ = COMPRESSION):
+        """ Instantiation method for the OnlineNonPeriodicFeature class.
+
+            compression_ - Parameter of the size of the quantile sketch.
+
+        """
+
+        # Moments of the magnitudes.
+        self.__moments = (0, 0.0, 0.0, 0.0, 0.0)
+
+        # Means of the times and magnitudes and sums of the squared
+        # deviations of the times and of the products of the deviations.
+        self.__trend = (0, 0.0, 0.0, 0.0, 0.0)
+
+        # Moments of the intervals of time, only the first ones are used.
+        self.__intervals = (0, 0.0, 0.0, 0.0, 0.0)
+
+        self.__min_mag = np.inf
+        self.__max_mag = -np.inf
+
+        self.__sketch = QuantileSketch(compression_)
+
+        # Intervals and slopes that can be the maximum slope.
+        self.__frontier_intervals = np.zeros(0)
+        self.__frontier_slopes = np.zeros(0)
+
+        # First measure and last measures, to calculate the slopes between
+        # the chunks and the pair slope trend.
+        self.__first = None
+        self.__tail_times = np.zeros(0)
+        self.__tail_mags = np.zeros(0)
+
+    @property
+    def count(self):
+        return self.__moments[0]
+
+    def __add_slopes(self, intervals, slopes):
+        """ Adds to the state the intervals between consecutive measures
+            and their slopes.
+
+            intervals - Intervals of time.
+            slopes - Slopes of the magnitudes.
+
+        """
+
+        self.__intervals = merge_moments(*(self.__intervals +
+                                           chunk_moments(intervals)))
+
+        self.__frontier_intervals, self.__frontier_slopes = slope_frontier(
+            np.concatenate((self.__frontier_intervals, intervals)),
+            np.concatenate((self.__frontier_slopes, slopes)))
+
+    def update(self, mags, times):
+        """ Adds a chunk of measures of the curve, after those already
+            added.
+
+            mags - Magnitudes of the chunk.
+            times - Times of the chunk, from the same origin of times of
+                the previous chunks.
+
+        """
+
+        mags = np.asarray(mags, dtype=float)
+        times = np.asarray(times, dtype=float)
+
+        if len(mags) == 0:
+            return
+
+        self.__moments = merge_moments(*(self.__moments + chunk_moments(mags)))
+
+        # The trend is updated with the moments of the times, the product
+        # of the deviations is kept in the place of the third moment.
+        count, mean_times = len(times), np.mean(times)
+        mean_mags = np.mean(mags)
+
+        self.__trend = self.__merge_trend(
+            self.__trend,
+            (count, mean_times, mean_mags, np.sum((times - mean_times) ** 2),
+             np.sum((times - mean_times) * (mags - mean_mags))))
+
+        self.__min_mag = min(self.__min_mag, mags.min())
+        self.__max_mag = max(self.__max_mag, mags.max())
+
+        self.__sketch.update(mags)
+
+        # Slopes of the chunk and between the chunk and the last measure.
+        if self.__first is None:
+            self.__first = (times[0], mags[0])
+
+            all_times = times
+            all_mags = mags
+        else:
+            all_times = np.concatenate((self.__tail_times[-1:], times))
+            all_mags = np.concatenate((self.__tail_mags[-1:], mags))
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intervals = np.diff(all_times)
+
+            self.__add_slopes(intervals, np.diff(all_mags) / intervals)
+
+        self.__tail_times = np.concatenate((self.__tail_times, times))[-PAIR_SLOPE_MEASURES:]
+        self.__tail_mags = np.concatenate((self.__tail_mags, mags))[-PAIR_SLOPE_MEASURES:]
+
+    @staticmethod
+    def __merge_trend(trend_a, trend_b):
+        """ Returns the means and sums of the deviations of the times and
+            magnitudes of the union of two sets of measures.
+
+            trend_a - Number of measures, means of times and magnitudes and
+                sums of squared deviations of times and of products of the
+                deviations of the first set.
+            trend_b - The same values of the second set.
+
+        """
+
+        count_a, times_a, mags_a, sxx_a, sxy_a = trend_a
+        count_b, times_b, mags_b, sxx_b, sxy_b = trend_b
+
+        if count_a == 0:
+            return trend_b
+        elif count_b == 0:
+            return trend_a
+
+        count = count_a + count_b
+        factor = float(count_a) * count_b / count
+
+        return (count, times_a + (times_b - times_a) * count_b / count,
+                mags_a + (mags_b - mags_a) * count_b / count,
+                sxx_a + sxx_b + (times_b - times_a) ** 2 * factor,
+                sxy_a + sxy_b + (times_b - times_a) * (mags_b - mags_a) * factor)
+
+    def merge(self, other):
+        """ Adds the state of the measures that follow those of this curve.
+
+            other - OnlineNonPeriodicFeature of the following measures.
+
+        """
+
+        if other.count == 0:
+            return
+
+        self.__moments = merge_moments(*(self.__moments + other.__moments))
+        self.__trend = self.__merge_trend(self.__trend, other.__trend)
+
+        self.__min_mag = min(self.__min_mag, other.__min_mag)
+        self.__max_mag = max(self.__max_mag, other.__max_mag)
+
+        self.__sketch.merge(other.__sketch)
+
+        if self.__first is None:
+            self.__first = other.__first
+        else:
+            # Slope between the last measure and the first of the other.
+            with np.errstate(divide='ignore', invalid='ignore'):
+                interval = np.array([other.__first[0] - self.__tail_times[-1]])
+
+                self.__add_slopes(interval, np.array([other.__first[1] -
+                                                      self.__tail_mags[-1]]) / interval)
+
+        self.__intervals = merge_moments(*(self.__intervals + other.__intervals))
+
+        self.__frontier_intervals, self.__frontier_slopes = slope_frontier(
+            np.concatenate((self.__frontier_intervals, other.__frontier_intervals)),
+            np.concatenate((self.__frontier_slopes, other.__frontier_slopes)))
+
+        self.__tail_times = np.concatenate((self.__tail_times,
+                                            other.__tail_times))[-PAIR_SLOPE_MEASURES:]
+        self.__tail_mags = np.concatenate((self.__tail_mags,
+                                           other.__tail_mags))[-PAIR_SLOPE_MEASURES:]
+
+    @staticmethod
+    def from_curve(mags, times, chunk_size = CHUNK_SIZE, compression = COMPRESSION):
+        """ Returns the online features of a curve read in chunks.
+
+            mags - Magnitudes of the curve.
+            times - Times of the curve.
+            chunk_size - Number of measures of each chunk.
+            compression - Parameter of the size of the quantile sketch.
+
+        """
+
+        feature = OnlineNonPeriodicFeature(compression)
+
+        for first in range(0, len(mags), chunk_size):
+            feature.update(mags[first:first + chunk_size],
+                           times[first:first + chunk_size])
+
+        return feature
+
+    def state(self):
+        """ Returns a dictionary of arrays with the state, to save it. """
+
+        return dict(moments = np.array(self.__moments, dtype=float),
+                    trend = np.array(self.__trend, dtype=float),
+                    intervals = np.array(self.__intervals, dtype=float),
+                    extremes = np.array([self.__min_mag, self.__max_mag]),
+                    compression = self.__sketch.compression,
+                    sketch_means = self.__sketch.means,
+                    sketch_weights = self.__sketch.weights,
+                    frontier_intervals = self.__frontier_intervals,
+                    frontier_slopes = self.__frontier_slopes,
+                    first = np.array(self.__first if self.__first is not None
+                                     else [], dtype=float),
+                    tail_times = self.__tail_times,
+                    tail_mags = self.__tail_mags)
+
+    @staticmethod
+    def from_state(data):
+        """ Returns the online features with a state returned by state.
+            Raises KeyError if a value of the state is missing.
+
+            data - Dictionary of arrays with the state.
+
+        """
+
+        feature = OnlineNonPeriodicFeature(int(data['compression']))
+
+        moments = data['moments']
+        trend = data['trend']
+        intervals = data['intervals']
+
+        feature.__moments = (int(moments[0]),) + tuple(moments[1:])
+        feature.__trend = (int(trend[0]),) + tuple(trend[1:])
+        feature.__intervals = (int(intervals[0]),) + tuple(intervals[1:])
+        feature.__min_mag, feature.__max_mag = data['extremes']
+        feature.__sketch = QuantileSketch.from_centroids(
+            data['sketch_means'], data['sketch_weights'],
+            int(data['compression']))
+        feature.__frontier_intervals = np.array(data['frontier_intervals'])
+        feature.__frontier_slopes = np.array(data['frontier_slopes'])
+        feature.__first = tuple(data['first']) \
+            if len(data['first']) > 0 else None
+        feature.__tail_times = np.array(data['tail_times'])
+        feature.__tail_mags = np.array(data['tail_mags'])
+
+        return feature
+
+    def save(self, filename):
+        """ Saves the state to a file.
+
+            filename - Name of the file.
+
+        """
+
+        # The file is written with another name and renamed, so a partial
+        # file is never read.
+        temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+
+        with open(temp_filename, 'wb') as temp_file:
+            np.savez(temp_file, **self.state())
+
+        os.rename(temp_filename, filename)
+
+    @staticmethod
+    def load(filename):
+        """ Returns the online features whose state is saved in a file, or
+            None if it can't be read.
+
+            filename - Name of the file.
+
+        """
+
+        try:
+            data = np.load(filename)
+
+            try:
+                return OnlineNonPeriodicFeature.from_state(data)
+            finally:
+                data.close()
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def __name(self, method):
+
+        return OnlineNonPeriodicFeature.__NAMES[method]
+
+    def __interval_max_size(self):
+        """ Returns the maximum interval of time used for the slopes, the
+            average plus the standard deviation of the intervals.
+
+        """
+
+        count, mean, m2, m3, m4 = self.__intervals
+
+        return mean + math.sqrt(m2 / count) if count > 0 else np.nan
+
+    def __std(self):
+
+        count, mean, m2, m3, m4 = self.__moments
+
+        return math.sqrt(m2 / count)
+
+    def __percentile_range(self, lower_perc, upper_perc):
+
+        return self.__sketch.percentile(upper_perc) - \
+            self.__sketch.percentile(lower_perc)
+
+    def amplitude_dif(self):
+        """ Return half the difference between the maximum and the minimum
+            magnitude.
+
+        """
+
+        return (self.__max_mag - self.__min_mag) / 2, self.__name('amplitude_dif')
+
+    def beyond1st(self):
+        """ Percentage of points beyond one standard deviation from the
+            mean, estimated.
+
+        """
+
+        mean = self.__moments[1]
+        std = self.__std()
+
+        number_of_points = self.__sketch.count_below(mean - std) + \
+            self.__sketch.count_above(mean + std)
+
+        return number_of_points * 100.0 / self.count, self.__name('beyond1st')
+
+    def linear_trend(self):
+        """ Slope of a linear fit to the light curve flux. """
+
+        count, mean_times, mean_mags, sxx, sxy = self.__trend
+
+        return sxy / sxx, self.__name('linear_trend')
+
+    def max_slope(self):
+        """ Maximum slope between two consecutive observations whose
+            interval is shorter than the average plus the standard deviation
+            of the intervals.
+
+        """
+
+        valid = (self.__frontier_intervals < self.__interval_max_size()) & \
+            (self.__frontier_slopes > 0)
+
+        max_slp = self.__frontier_slopes[valid].max() if np.any(valid) else 0
+
+        return max_slp, self.__name('max_slope')
+
+    def median_absolute_deviation(self):
+        """ Median discrepancy of the fluxes from the median flux, estimated. """
+
+        deviations = self.__sketch.deviations_sketch(self.__sketch.median())
+
+        return deviations.median(), self.__name('median_absolute_deviation')
+
+    def median_buffer_range_percentage(self):
+        """ Percentage of fluxes out of 10% of the median, without the last
+            measure as NonPeriodicFeature, estimated.
+
+        """
+
+        median = self.__sketch.median()
+
+        lower_value = median - 0.1 * median
+        upper_value = median + 0.1 * median
+
+        number_values = self.__sketch.count_below(lower_value) + \
+            self.__sketch.count_above(upper_value)
+
+        last_mag = self.__tail_mags[-1]
+
+        if last_mag < lower_value or last_mag > upper_value:
+            number_values = max(number_values - 1, 0)
+
+        return number_values * 100.0 / self.count, \
+            self.__name('median_buffer_range_percentage')
+
+    def pair_slope_trend(self):
+        """ Percentage of the last pairs of consecutive measures with
+            positive slope.
+
+        """
+
+        number = len(self.__tail_times)
+
+        intervals = np.diff(self.__tail_times)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slopes = np.diff(self.__tail_mags) / intervals
+
+        num_positive_slopes = np.count_nonzero(
+            (intervals < self.__interval_max_size()) & (slopes > 0))
+
+        return num_positive_slopes * 100.0 / (number - 1), \
+            self.__name('pair_slope_trend')
+
+    def percent_amplitude(self):
+        """ Largest percentage difference between either the max or min
+            magnitude and the median, estimated.
+
+        """
+
+        median = self.__sketch.median()
+
+        max_dif = max(self.__max_mag - median, median - self.__min_mag)
+
+        return max_dif * 100.0 / (self.__max_mag - self.__min_mag), \
+            self.__name('percent_amplitude')
+
+    def percent_difference_flux_percentile(self):
+        """ Median divided by the difference between the 5th and 95th
+            percentiles, estimated.
+
+        """
+
+        return self.__sketch.median() * 100 / self.__percentile_range(5, 95), \
+            self.__name('percent_difference_flux_percentile')
+
+    def skew(self):
+        """ Skew of the flux. """
+
+        count, mean, m2, m3, m4 = self.__moments
+
+        return (m3 / count) / (m2 / count) ** 1.5, self.__name('skew')
+
+    def kurtosis(self):
+        """ Kurtosis of the fluxes. """
+
+        count, mean, m2, m3, m4 = self.__moments
+
+        return (m4 / count) / (m2 / count) ** 2 - 3, self.__name('kurtosis')
+
+    def std(self):
+        """ Standard deviation of the fluxes. """
+
+        return self.__std(), self.__name('std')
+
+    def __flux_percentile_ratio(self, lower_perc, upper_perc, method):
+
+        return self.__percentile_range(lower_perc, upper_perc) / \
+            self.__percentile_range(5, 95), self.__name(method)
+
+    def flux_percentile_ratio_mid20(self):
+        """ Ratio of the percentiles 40-60 and 5-95, estimated. """
+
+        return self.__flux_percentile_ratio(40, 60, 'flux_percentile_ratio_mid20')
+
+    def flux_percentile_ratio_mid35(self):
+        """ Ratio of the percentiles 32.5-67.5 and 5-95, estimated. """
+
+        return self.__flux_percentile_ratio(32.5, 67.5, 'flux_percentile_ratio_mid35')
+
+    def flux_percentile_ratio_mid50(self):
+        """ Ratio of the percentiles 25-75 and 5-95, estimated. """
+
+        return self.__flux_percentile_ratio(25, 75, 'flux_percentile_ratio_mid50')
+
+    def flux_percentile_ratio_mid65(self):
+        """ Ratio of the percentiles 17.5-82.5 and 5-95, estimated. """
+
+        return self.__flux_percentile_ratio(17.5, 82.5, 'flux_percentile_ratio_mid65')
+
+    def flux_percentile_ratio_mid80(self):
+        """ Ratio of the percentiles 10-90 and 5-95, estimated. """
+
+        return self.__flux_percentile_ratio(10, 90, 'flux_percentile_ratio_mid80')
+
+class OnlineFeatureStore(object):
+    """ Stores in a directory the state of the online features of the
+        stars, a file for each star and filter, with the origin of times
+        and a hash of the measures added. When the first measures of a 
+        curve are those already added, the state is updated only with the
+        new measures, otherwise it is calculated again from the whole curve.
+
+    """
+
+    FILE_EXT = '.npz'
+
+    def __init__(self, directory_):
+        """ Instantiation method for the OnlineFeatureStore class.
+
+            directory_ - Directory to store the states, it is created if it
+                doesn't exist.
+
+        """
+
+        self.__directory = directory_
+
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+
+        self.updates = 0
+        self.recomputes = 0
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    def __path(self, star_id, pfilter):
+
+        return os.path.join(self.__directory, '%s_%s%s' %
+                            (star_id, pfilter, OnlineFeatureStore.FILE_EXT))
+
+    def load(self, star_id, pfilter):
+        """ Returns the online features stored for a star and filter, the
+            origin of times, the number of measures and the hash of the
+            measures added, or None if they don't exist.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+
+        """
+
+        try:
+            data = np.load(self.__path(star_id, pfilter))
+
+            try:
+                return OnlineNonPeriodicFeature.from_state(data), \
+                    float(data['origin']), int(data['number_of_obs']), \
+                    str(data['measures_digest'])
+            finally:
+                data.close()
+        except (IOError, OSError, KeyError, ValueError):
+            return None
+
+    def save(self, star_id, pfilter, feature, origin, measures_digest):
+        """ Stores the online features of a star and filter.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+            feature - OnlineNonPeriodicFeature to store.
+            origin - Origin of the times of the measures added.
+            measures_digest - Hash of the times and magnitudes added.
+
+        """
+
+        path = self.__path(star_id, pfilter)
+
+        # The file is written with another name and renamed, so a partial
+        # file is never read.
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+
+        with open(temp_path, 'wb') as temp_file:
+            np.savez(temp_file, origin = origin, number_of_obs = feature.count,
+                     measures_digest = measures_digest, **feature.state())
+
+        os.rename(temp_path, path)
+
+    def features(self, star_id, pfilter, curve):
+        """ Returns the online features of the curve of a star updated with
+            its new measures, and stores them.
+
+            star_id - Identifier of the star.
+            pfilter - Filter of the curve.
+            curve - PreparedCurve of the star.
+
+        """
+
+        stored = self.load(star_id, pfilter)
+
+        feature = None
+
+        if stored is not None:
+            feature, origin, number_of_obs, measures_digest = stored
+
+            if origin != curve.first_time or number_of_obs > len(curve) or \
+                incremental.array_digest(curve.times[:number_of_obs], 
+                                         curve.mags[:number_of_obs]) != measures_digest:
+                feature = None
+
+        if feature is None:
+            feature = OnlineNonPeriodicFeature.from_curve(curve.mags, curve.times)
+
+            self.recomputes += 1
+        else:
+            feature.merge(OnlineNonPeriodicFeature.from_curve(
+                curve.mags[number_of_obs:], curve.times[number_of_obs:]))
+
+            self.updates += 1
+
+        self.save(star_id, pfilter, feature, curve.first_time,
+                  incremental.array_digest(curve.times, curve.mags))
+
+        return feature
+
+    def log_stats(self):
+        """ Logs the number of online features updated and calculated again. """
+
+        logging.info('Online features: %d updated with the new measures, %d calculated from the whole curve.' %
+                     (self.updates, self.recomputes))
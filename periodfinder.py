@@ -0,0 +1,357 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module defines the interface of the methods used to search the periods
+of the light curves and implements several of these methods, besides the
+Lomb Scargle method of the lombscargle module. All of them calculate at
+once the values of several curves for a block of frequencies.
+
+"""
+
+import numpy as np
+
+# Maximum number of bytes of the temporary arrays, by default.
+MEMORY_BUDGET = 2 ** 27
+
+class PeriodEngine(object):
+    """ Interface of the methods to search the periods of light curves.
+        Each method returns a value, the power, for each frequency, and the
+        highest values indicate the most probable periods.
+
+    """
+
+    def power(self, times, mags, freqs, mask = None):
+        """ Returns a matrix with the power of each curve for the
+            frequencies in a row.
+
+            times - Matrix with the times of a curve in each row.
+            mags - Matrix with the magnitudes of a curve in each row.
+            freqs - Angular frequencies to calculate, a vector when all the
+                curves use the same frequencies or a matrix with the
+                frequencies of each curve in a row.
+            mask - Boolean matrix that indicates the valid values of times
+                and mags, used when the curves are padded to the same length.
+
+        """
+
+        raise NotImplementedError
+
+class BinnedEngine(PeriodEngine):
+    """ Base class of the methods that fold the curves with each frequency
+        and sum the magnitudes of the measures that fall in the same bin of
+        phase. The frequencies are calculated in blocks that fit in the
+        memory budget.
+
+    """
+
+    # Bytes of the temporary arrays for each measure and frequency.
+    BYTES_PER_ELEMENT = 40
+
+    def __init__(self, memory_budget_ = MEMORY_BUDGET):
+        """ Instantiation method for the BinnedEngine class.
+
+            memory_budget_ - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        self.memory_budget = memory_budget_
+
+    @staticmethod
+    def phase_bins(times, freqs, number_of_bins):
+        """ Returns the bin of phase of each measure folded with each
+            frequency, as an array of curves x frequencies x measures.
+
+            times - Matrix with the times of a curve in each row.
+            freqs - Matrix with the angular frequencies of each curve in a
+                row, or of all the curves in one row.
+            number_of_bins - Number of bins of phase.
+
+        """
+
+        cycles = (freqs[:, :, np.newaxis] / (2 * np.pi)) * times[:, np.newaxis, :]
+
+        bins = ((cycles - np.floor(cycles)) * number_of_bins).astype(int)
+
+        # Rounding could give a phase of 1.
+        return np.minimum(bins, number_of_bins - 1, out=bins)
+
+    @staticmethod
+    def binned_sums(bins, values, number_of_bins):
+        """ Returns the sums of the values of the measures in each bin, as an
+            array of curves x frequencies x bins.
+
+            bins - Array of curves x frequencies x measures with the bin of
+                each measure.
+            values - Matrix with the value of each measure of a curve in a
+                row, the same for all the frequencies.
+            number_of_bins - Number of bins.
+
+        """
+
+        n_curves, n_freqs, n_obs = bins.shape
+
+        # Each curve and frequency use their own range of bins.
+        offsets = (np.arange(n_curves * n_freqs) *
+                   number_of_bins).reshape((n_curves, n_freqs, 1))
+
+        weights = np.broadcast_to(values[:, np.newaxis, :], bins.shape)
+
+        return np.bincount((bins + offsets).ravel(), weights=weights.ravel(),
+                           minlength=n_curves * n_freqs *
+                           number_of_bins).reshape((n_curves, n_freqs,
+                                                    number_of_bins))
+
+    def block_power(self, times, mags, freqs, weights):
+        """ Returns the power of each curve for a block of frequencies.
+
+            times - Matrix with the times of a curve in each row.
+            mags - Matrix with the magnitudes of a curve in each row.
+            freqs - Matrix with the frequencies of each curve in a row, or
+                of all the curves in one row.
+            weights - Matrix with 1 for the valid measures and 0 for the
+                padded ones.
+
+        """
+
+        raise NotImplementedError
+
+    def power(self, times, mags, freqs, mask = None):
+        """ Returns a matrix with the power of each curve for the
+            frequencies in a row.
+
+            times - Matrix with the times of a curve in each row.
+            mags - Matrix with the magnitudes of a curve in each row.
+            freqs - Angular frequencies to calculate, a vector when all the
+                curves use the same frequencies or a matrix with the
+                frequencies of each curve in a row.
+            mask - Boolean matrix that indicates the valid values of times
+                and mags, used when the curves are padded to the same length.
+
+        """
+
+        times = np.atleast_2d(np.asarray(times, dtype=float))
+        mags = np.atleast_2d(np.asarray(mags, dtype=float))
+        freqs = np.atleast_2d(np.asarray(freqs, dtype=float))
+
+        if mask is None:
+            weights = np.ones(times.shape)
+        else:
+            weights = np.atleast_2d(mask).astype(float)
+
+        # The origin of times doesn't change the periods, the first time is
+        # used to keep the phases precise.
+        times = (times - times[:, :1]) * weights
+
+        n_curves, n_obs = times.shape
+        n_freqs = freqs.shape[1]
+
+        pgrams = np.empty((n_curves, n_freqs))
+
+        step = max(1, int(self.memory_budget //
+                          max(1, n_curves * n_obs * BinnedEngine.BYTES_PER_ELEMENT)))
+
+        for first in range(0, n_freqs, step):
+            last = min(first + step, n_freqs)
+
+            pgrams[:, first:last] = self.block_power(times, mags,
+                                                     freqs[:, first:last],
+                                                     weights)
+
+        return pgrams
+
+class PhaseDispersionMinimization(BinnedEngine):
+    """ Phase dispersion minimization of Stellingwerf (1978). The statistic
+        theta is the ratio between the variance of the magnitudes in the
+        bins of phase and the total variance, and it is lower for the
+        correct period. The power returned is 1 - theta.
+
+    """
+
+    def __init__(self, number_of_bins_ = 10, memory_budget_ = MEMORY_BUDGET):
+        """ Instantiation method for the PhaseDispersionMinimization class.
+
+            number_of_bins_ - Number of bins of phase.
+            memory_budget_ - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        BinnedEngine.__init__(self, memory_budget_)
+
+        self.number_of_bins = number_of_bins_
+
+    def block_power(self, times, mags, freqs, weights):
+
+        bins = BinnedEngine.phase_bins(times, freqs, self.number_of_bins)
+
+        counts = BinnedEngine.binned_sums(bins, weights, self.number_of_bins)
+        sums = BinnedEngine.binned_sums(bins, mags * weights, self.number_of_bins)
+        squares = BinnedEngine.binned_sums(bins, mags * mags * weights,
+                                           self.number_of_bins)
+
+        # Sum of the squared deviations from the mean of each bin.
+        within = (squares - sums * sums / np.maximum(counts, 1)).sum(axis=2)
+        nonempty = (counts > 0).sum(axis=2)
+
+        n_obs = weights.sum(axis=1)[:, np.newaxis]
+        mean = (mags * weights).sum(axis=1)[:, np.newaxis] / np.maximum(n_obs, 1)
+        total = ((((mags - mean) * weights) ** 2).sum(axis=1)[:, np.newaxis] /
+                 np.maximum(n_obs - 1, 1))
+
+        theta = within / np.maximum(n_obs - nonempty, 1) / \
+            np.where(total > 0, total, 1)
+
+        return 1 - theta
+
+class ConditionalEntropy(BinnedEngine):
+    """ Conditional entropy of the magnitudes given the phase, of Graham et
+        al. (2013). The magnitudes are normalized to the unit interval and
+        the curve folded is divided in bins of phase and magnitude. The
+        entropy is lower for the correct period, the power returned is one
+        minus the entropy relative to its maximum value.
+
+    """
+
+    def __init__(self, phase_bins_ = 10, mag_bins_ = 5,
+                 memory_budget_ = MEMORY_BUDGET):
+        """ Instantiation method for the ConditionalEntropy class.
+
+            phase_bins_ - Number of bins of phase.
+            mag_bins_ - Number of bins of magnitude.
+            memory_budget_ - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        BinnedEngine.__init__(self, memory_budget_)
+
+        self.phase_bins_number = phase_bins_
+        self.mag_bins_number = mag_bins_
+
+    def block_power(self, times, mags, freqs, weights):
+
+        valid = weights > 0
+
+        # Magnitudes normalized using the valid measures of each curve.
+        low = np.where(valid, mags, np.inf).min(axis=1)[:, np.newaxis]
+        high = np.where(valid, mags, -np.inf).max(axis=1)[:, np.newaxis]
+        scale = np.where(high > low, high - low, 1)
+
+        mag_bins = np.clip(((mags - low) / scale * self.mag_bins_number).astype(int),
+                           0, self.mag_bins_number - 1)
+
+        bins = BinnedEngine.phase_bins(times, freqs, self.phase_bins_number) * \
+            self.mag_bins_number + mag_bins[:, np.newaxis, :]
+
+        counts = BinnedEngine.binned_sums(
+            bins, weights, self.phase_bins_number *
+            self.mag_bins_number).reshape(bins.shape[:2] +
+                                          (self.phase_bins_number,
+                                           self.mag_bins_number))
+
+        n_obs = np.maximum(weights.sum(axis=1), 1)[:, np.newaxis, np.newaxis, np.newaxis]
+
+        p_joint = counts / n_obs
+        p_phase = p_joint.sum(axis=3)[:, :, :, np.newaxis]
+
+        terms = np.zeros(p_joint.shape)
+        nonzero = p_joint > 0
+        terms[nonzero] = p_joint[nonzero] * \
+            np.log(np.broadcast_to(p_phase, p_joint.shape)[nonzero] / p_joint[nonzero])
+
+        return 1 - terms.sum(axis=(2, 3)) / np.log(self.mag_bins_number)
+
+class BoxLeastSquares(BinnedEngine):
+    """ Box least squares of Kovacs et al. (2002), it searches periodic
+        transits or eclipses. The curve folded is divided in bins of phase
+        and the power is the signal residue of the best box of consecutive
+        bins, up to a maximum duration.
+
+    """
+
+    def __init__(self, number_of_bins_ = 100, max_duration_ = 0.1,
+                 memory_budget_ = MEMORY_BUDGET):
+        """ Instantiation method for the BoxLeastSquares class.
+
+            number_of_bins_ - Number of bins of phase.
+            max_duration_ - Maximum duration of the box, as fraction of the
+                period.
+            memory_budget_ - Maximum number of bytes of the temporary arrays.
+
+        """
+
+        BinnedEngine.__init__(self, memory_budget_)
+
+        self.number_of_bins = number_of_bins_
+        self.max_duration = max_duration_
+
+    def block_power(self, times, mags, freqs, weights):
+
+        n_bins = self.number_of_bins
+        max_width = max(1, int(round(self.max_duration * n_bins)))
+
+        n_obs = np.maximum(weights.sum(axis=1), 1)[:, np.newaxis]
+        mean = (mags * weights).sum(axis=1)[:, np.newaxis] / n_obs
+
+        bins = BinnedEngine.phase_bins(times, freqs, n_bins)
+
+        counts = BinnedEngine.binned_sums(bins, weights, n_bins)
+        sums = BinnedEngine.binned_sums(bins, (mags - mean) * weights, n_bins)
+
+        # The boxes can wrap around the phase, so the first bins are
+        # repeated at the end before the cumulative sums.
+        zeros = np.zeros(counts.shape[:2] + (1,))
+        cum_counts = np.concatenate((zeros, counts, counts[:, :, :max_width]),
+                                    axis=2).cumsum(axis=2)
+        cum_sums = np.concatenate((zeros, sums, sums[:, :, :max_width]),
+                                  axis=2).cumsum(axis=2)
+
+        n_obs = n_obs[:, :, np.newaxis]
+
+        best = np.zeros(counts.shape[:2])
+
+        for width in range(1, max_width + 1):
+            r = (cum_counts[:, :, width:width + n_bins] -
+                 cum_counts[:, :, :n_bins]) / n_obs
+            s = (cum_sums[:, :, width:width + n_bins] -
+                 cum_sums[:, :, :n_bins]) / n_obs
+
+            valid = (r > 0) & (r < 1)
+
+            residue = np.zeros(r.shape)
+            residue[valid] = s[valid] ** 2 / (r[valid] * (1 - r[valid]))
+
+            np.maximum(best, residue.max(axis=2), out=best)
+
+        return np.sqrt(best)
+
+def create_engine(name, memory_budget = MEMORY_BUDGET):
+    """ Returns the engine with the name received.
+
+        name - Name of the engine, one of the keys of ENGINES.
+        memory_budget - Maximum number of bytes of the temporary arrays.
+
+    """
+
+    try:
+        return ENGINES[name](memory_budget_ = memory_budget)
+    except KeyError:
+        raise ValueError("Engine '%s' to search periods is not valid" % name)
+
+# Engines to search periods besides the Lomb Scargle method.
+ENGINES = { 'pdm' : PhaseDispersionMinimization,
+            'ce' : ConditionalEntropy,
+            'bls' : BoxLeastSquares }
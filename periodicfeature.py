@@ -23,6 +23,8 @@ periodic light variations.
 
 """
 
+import numpy as np
+
 class PeriodicFeature(object):
     """ Encapsulates the calculation of periodic features of a light curve.
 
@@ -36,6 +38,7 @@ class PeriodicFeature(object):
     __FUND_AMP_FEAT_NAME= "Fund_Amp_"
     __AMP_HARM_FEAT_NAME = "Amp_Harm_"
     __FREQ_OFFSET_FEAT_NAME = "Freq_Offset"
+    __FAP_FEAT_NAME = "FAP_"
 
     def __init__(self, pgram_, lsprop_, num_freq_ = 3):
         """ Instantiation method for the PeriodicFeature class.
@@ -82,12 +85,37 @@ class PeriodicFeature(object):
 
         return freq
 
+    @staticmethod
+    def __uses_peaks_of(lsprop):
+        """ Returns if the frequencies and values of the maximums are those
+            found by the search of maximums instead of being calculated from
+            their indexes. It happens when the maximums have been refined or
+            the grid of frequencies is not the fixed one.
+            
+            lsprop - Properties used to calculate the periodgrams.
+            
+        """
+        
+        return lsprop.search_mode == lsprop.ZOOM_SEARCH or \
+            lsprop.grid_mode == lsprop.BASELINE_GRID
+
+    def __uses_peaks(self):
+        """ Returns if the frequencies and values of the maximums are those
+            found by the search of maximums.
+            
+        """
+        
+        return PeriodicFeature.__uses_peaks_of(self.lsprop)
+
     def __get_freq_n(self, num_freq):
         """ Return the n frequency of the periodgram. """
 
         # Check frequency requested is in the range of frequencies calculated,
         # and in that case get the frequency.
         try:
+            if self.__uses_peaks():
+                return self.lsprop.peak_freqs[num_freq]
+            
             index = self.lsprop.index_max_values[num_freq]
             return self.__get_freq_from_index(index)
         except IndexError:
@@ -100,6 +128,9 @@ class PeriodicFeature(object):
         # Check that at least the number of frequency indicated has been 
         # calculated.
         if num_freq < len(self.lsprop.index_max_values):
+            if self.__uses_peaks():
+                return self.lsprop.peak_values[num_freq]
+            
             # Get the index for this frequency.
             index = self.lsprop.index_max_values[num_freq]
 
@@ -176,7 +207,17 @@ class PeriodicFeature(object):
         # and the number of the harmonic requested plus 1. i.e. first harmonic 
         # is twice the fundamental frequency, second harmonic is triple and so 
         # on.
-        actual_harm_index = self.lsprop.index_max_values[num_freq] * (harm + 1)
+        if self.__uses_peaks():
+            # The grid doesn't begin at frequency 0, so the index is searched
+            # for the frequency of the harmonic.
+            harm_freq = self.lsprop.peak_freqs[num_freq] * (harm + 1)
+            
+            if harm_freq > self.lsprop.freqs[-1]:
+                return amplitude
+            
+            actual_harm_index = np.searchsorted(self.lsprop.freqs, harm_freq)
+        else:
+            actual_harm_index = self.lsprop.index_max_values[num_freq] * (harm + 1)
 
         # Check if this harmonic exists in the periodgram calculated.
         if actual_harm_index < len(self.__pgram):
@@ -227,10 +268,173 @@ class PeriodicFeature(object):
             
         """
                         
-        offset = self.__pgram[0]
+        offset = np.min(self.__pgram)
         
-        for i in range(len(self.__pgram)):
-            if self.__pgram[i] < offset:
-                offset = self.__pgram[i]
+        return offset, PeriodicFeature.__FREQ_OFFSET_FEAT_NAME
+    
+    def get_fap(self, n):
+        """ Return the false alarm probability of the n maximum frequency of 
+            the periodgram.
+            
+        """
+        
+        param_name = PeriodicFeature.faps_names(n + 1)[n]
+        
+        if n < len(self.lsprop.faps):
+            return self.lsprop.faps[n], param_name
+        else:
+            msg = "False alarm probability requested %d is out of range (0-%d)" \
+                % (n, len(self.lsprop.faps))
+            raise IndexError(msg)
+    
+    @staticmethod
+    def faps_names(num_freq = 3):
+        """ Returns the names of the false alarm probabilities of the 
+            maximums.
+            
+            num_freq - Number of maximum frequencies used.
+            
+        """
+        
+        return ["%s%d" % (PeriodicFeature.__FAP_FEAT_NAME, n) 
+                for n in range(num_freq)]
+    
+    @staticmethod
+    def features_names(num_freq = 3):
+        """ Returns the names of the features calculated by features_batch,
+            in the order used by StarsFeatures.save_feature.
+            
+            num_freq - Number of maximum frequencies used.
+            
+        """
+        
+        names = []
+        
+        for n in range(num_freq):
+            names.append("%s%d" % (PeriodicFeature.__FUND_FREQ_FEAT_NAME, n))
+            names.append("%s%d" % (PeriodicFeature.__FUND_AMP_FEAT_NAME, n))
+            names.extend(["%s%d" % (PeriodicFeature.__AMP_HARM_FEAT_NAME, h)
+                          for h in range(4)])
+            
+        names.append(PeriodicFeature.__FREQ_OFFSET_FEAT_NAME)
+        
+        return names
+    
+    @staticmethod
+    def features_batch(pgrams, index_max_values, lsprop, freqs = None,
+                       peak_freqs = None, peak_values = None, num_freq = 3,
+                       columns = None):
+        """ Calculates at once the periodic features of several curves. 
+            Returns a matrix with the features of each curve in a row, with
+            the same values and order that the methods of this class give
+            to StarsFeatures.save_feature, and the names of the features.
+            The amplitudes of the harmonics and the offset are only 
+            calculated if any of them is selected.
+            
+            pgrams - Matrix with a periodgram in each row, or list of 
+                periodgrams of different lengths.
+            index_max_values - Matrix with the indexes of the maximums of
+                each periodgram in a row.
+            lsprop - Properties used to calculate the periodgrams.
+            freqs - Frequencies of the periodgrams, a matrix or a list like
+                pgrams. Only needed if the maximums have been searched.
+            peak_freqs - Matrix with the frequencies of the maximums of each
+                periodgram in a row. Only needed if the maximums have been
+                searched.
+            peak_values - Matrix with the values of the maximums of each
+                periodgram in a row. Only needed if the maximums have been
+                searched.
+            num_freq - Number of maximum frequencies used.
+            columns - Positions in features_names of the features to 
+                calculate, None to calculate all of them.
+            
+        """
+        
+        names = PeriodicFeature.features_names(num_freq)
+        
+        if columns is None:
+            columns = range(len(names))
+            
+        # Each frequency has its fundamental frequency, its amplitude and 
+        # the amplitudes of 4 harmonics, and the offset is the last feature.
+        features_per_freq = 6
+        offset_column = num_freq * features_per_freq
+        
+        uses_harmonics = any(c < offset_column and c % features_per_freq >= 2
+                             for c in columns)
+        uses_offset = offset_column in columns
+        
+        uses_peaks = PeriodicFeature.__uses_peaks_of(lsprop)
+        
+        lengths = np.array([len(pgram) for pgram in pgrams], dtype=int)
+        
+        n_curves = len(lengths)
+        
+        # The periodgrams of different lengths are padded with infinite 
+        # values, never used as amplitudes and ignored by the minimum.
+        if isinstance(pgrams, np.ndarray) and pgrams.ndim == 2:
+            matrix = pgrams
+        elif uses_harmonics or uses_offset or not uses_peaks:
+            matrix = np.full((n_curves, lengths.max() if n_curves > 0 else 0), 
+                             np.inf)
+            for i in range(n_curves):
+                matrix[i, :lengths[i]] = pgrams[i]
+        else:
+            matrix = None
+        
+        rows = np.arange(n_curves)[:, np.newaxis]
+        
+        indexes = np.asarray(index_max_values, dtype=int)[:, :num_freq]
+        
+        # Multiples of the fundamental frequencies for the harmonics.
+        multiples = np.arange(1, 5)
+        
+        if uses_peaks:
+            fund_freqs = np.asarray(peak_freqs, dtype=float)[:, :num_freq]
+            fund_amps = np.asarray(peak_values, dtype=float)[:, :num_freq]
+        else:
+            # The frequencies of the default mode keep the values calculated
+            # from the indexes of the maximums, as the models trained use
+            # them, only the refined or baseline modes use the angular
+            # frequencies of the maximums.
+            interval = (lsprop.max_freq - lsprop.first_freq) / \
+                lsprop.freq_to_calculate
+            
+            fund_freqs = lsprop.first_freq + indexes * interval
+            fund_amps = matrix[rows, indexes]
+            
+        harm_amps = np.zeros((n_curves, num_freq, len(multiples)))
+        
+        if uses_harmonics:
+            if uses_peaks:
+                harm_freqs = fund_freqs[:, :, np.newaxis] * multiples
+                
+                harm_indexes = np.zeros(harm_freqs.shape, dtype=int)
+                in_range = np.zeros(harm_freqs.shape, dtype=bool)
+                
+                for i in range(n_curves):
+                    curve_freqs = freqs[i]
+                    
+                    harm_indexes[i] = np.searchsorted(curve_freqs, harm_freqs[i])
+                    in_range[i] = harm_freqs[i] <= curve_freqs[-1]
+            else:
+                harm_indexes = indexes[:, :, np.newaxis] * multiples
+                in_range = np.ones(harm_indexes.shape, dtype=bool)
+            
+            in_range &= harm_indexes < lengths[:, np.newaxis, np.newaxis]
+            
+            harm_amps[in_range] = matrix[np.broadcast_to(rows[:, :, np.newaxis], 
+                                                         harm_indexes.shape)[in_range],
+                                         harm_indexes[in_range]]
+        
+        features = np.concatenate((fund_freqs[:, :, np.newaxis], 
+                                   fund_amps[:, :, np.newaxis],
+                                   harm_amps), axis=2).reshape((n_curves, -1))
+        
+        if uses_offset and matrix.shape[1] > 0:
+            offsets = matrix.min(axis=1)[:, np.newaxis]
+        else:
+            offsets = np.zeros((n_curves, 1))
         
-        return offset, PeriodicFeature.__FREQ_OFFSET_FEAT_NAME
\ No newline at end of file
+        return np.hstack((features, offsets))[:, columns], \
+            [names[column] for column in columns]
@@ -0,0 +1,279 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module keeps on disk the periodgrams calculated, so they are not
+calculated again for the same curve and properties. Each periodgram is
+stored in a file whose name is a hash of the values of the curve and the
+properties used to calculate it.
+
+"""
+
+import os
+import hashlib
+import logging
+import threading
+import numpy as np
+
+# Environment variable with the directory of the cache used by the
+# programs that don't receive it as argument.
+CACHE_DIR_VARIABLE = 'CLAVEL_PGRAM_CACHE'
+
+class PeriodgramCache(object):
+    """ Cache of periodgrams stored in a directory. The periodgrams are
+        saved with the precision they are calculated, so a periodgram read
+        has the same values than the one calculated, and read as memory
+        mapped arrays. When the size of the files exceeds the maximum, the
+        periodgrams used least recently are removed until the size is
+        LOW_WATER_RATIO of the maximum, using the time of modification of
+        the files as the time of last use.
+        The cache can be shared by several threads, the size of the files
+        is updated and the periodgrams evicted holding a lock.
+
+    """
+
+    FILE_EXT = '.npy'
+
+    # Ratio of the maximum size of the cache left after an eviction, so the
+    # files aren't listed again in each periodgram stored.
+    LOW_WATER_RATIO = 0.9
+
+    def __init__(self, directory_, max_bytes_ = 2 ** 30):
+        """ Instantiation method for the PeriodgramCache class.
+
+            directory_ - Directory to store the periodgrams, it is created
+                if it doesn't exist.
+            max_bytes_ - Maximum size of the files of the cache.
+
+        """
+
+        self.__directory = directory_
+        self.__max_bytes = max_bytes_
+        self.__hits = 0
+        self.__misses = 0
+        self.__lock = threading.RLock()
+
+        if not os.path.isdir(self.__directory):
+            os.makedirs(self.__directory)
+
+        self.__size = sum([size for path, mtime, size in self.__entries()])
+
+        logging.info('Using periodgram cache in %s with %d bytes.' %
+                     (self.__directory, self.__size))
+
+    def __getstate__(self):
+        """ Returns the state to pickle the cache for other processes,
+            without the lock.
+
+        """
+
+        state = self.__dict__.copy()
+        del state['_PeriodgramCache__lock']
+
+        return state
+
+    def __setstate__(self, state):
+        """ Restores the state of a cache pickled, with a new lock. """
+
+        self.__dict__.update(state)
+        self.__lock = threading.RLock()
+
+    @property
+    def directory(self):
+        return self.__directory
+
+    @property
+    def hits(self):
+        return self.__hits
+
+    @property
+    def misses(self):
+        return self.__misses
+
+    @property
+    def size(self):
+        return self.__size
+
+    @staticmethod
+    def key(curve, settings):
+        """ Returns the key of the periodgram of a curve.
+
+            curve - PreparedCurve whose periodgram is stored.
+            settings - Tuple with the properties used to calculate the
+                periodgram.
+
+        """
+
+        digest = hashlib.sha1()
+
+        digest.update(np.ascontiguousarray(curve.times, dtype=float).tobytes())
+        digest.update(np.ascontiguousarray(curve.mags, dtype=float).tobytes())
+        digest.update(repr(settings).encode('ascii'))
+
+        return digest.hexdigest()
+
+    def __path(self, key):
+
+        return os.path.join(self.__directory, key + PeriodgramCache.FILE_EXT)
+
+    def __entries(self):
+        """ Returns the path, time of modification and size of the files of
+            the cache.
+
+        """
+
+        entries = []
+
+        for filename in os.listdir(self.__directory):
+            if filename.endswith(PeriodgramCache.FILE_EXT):
+                path = os.path.join(self.__directory, filename)
+
+                try:
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_mtime, stat.st_size))
+                except OSError:
+                    # Removed by another process.
+                    pass
+
+        return entries
+
+    def get(self, key):
+        """ Returns the periodgram stored for the key as a read only memory
+            mapped array, or None if it is not in the cache.
+
+            key - Key of the periodgram.
+
+        """
+
+        path = self.__path(key)
+
+        try:
+            pgram = np.load(path, mmap_mode='r')
+
+            # Mark the periodgram as used recently.
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            with self.__lock:
+                self.__misses += 1
+
+            return None
+
+        with self.__lock:
+            self.__hits += 1
+
+        return pgram
+
+    def put(self, key, pgram):
+        """ Stores a periodgram in the cache.
+
+            key - Key of the periodgram.
+            pgram - Periodgram to store.
+
+        """
+
+        path = self.__path(key)
+
+        # The file is written with another name, different for each process
+        # and thread, and renamed, so a partial file is never read.
+        temp_path = '%s.%d.%d.tmp' % (path, os.getpid(), 
+                                      threading.current_thread().ident)
+
+        with open(temp_path, 'wb') as temp_file:
+            np.save(temp_file, np.asarray(pgram))
+
+        with self.__lock:
+            # The file may be replaced or removed by another thread or
+            # process at any moment.
+            try:
+                self.__size -= os.path.getsize(path)
+            except OSError:
+                pass
+
+            os.rename(temp_path, path)
+
+            try:
+                self.__size += os.path.getsize(path)
+            except OSError:
+                pass
+
+            if self.__size > self.__max_bytes:
+                self.evict()
+
+    def evict(self):
+        """ Removes the periodgrams used least recently until the size of
+            the cache is LOW_WATER_RATIO of the maximum.
+
+        """
+
+        with self.__lock:
+            entries = sorted(self.__entries(), key=lambda entry: entry[1])
+
+            self.__size = sum([size for path, mtime, size in entries])
+
+            low_water = PeriodgramCache.LOW_WATER_RATIO * self.__max_bytes
+
+            removed = 0
+
+            for path, mtime, size in entries:
+                if self.__size <= low_water:
+                    break
+
+                try:
+                    os.remove(path)
+                    removed += 1
+                except OSError:
+                    pass
+
+                self.__size -= size
+
+        logging.debug('Removed %d periodgrams from cache %s.' %
+                     (removed, self.__directory))
+
+    def clear(self):
+        """ Removes all the periodgrams of the cache. """
+
+        with self.__lock:
+            for path, mtime, size in self.__entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+            self.__size = 0
+
+    def log_stats(self):
+        """ Writes to the log the number of hits and misses of the cache. """
+
+        requests = self.__hits + self.__misses
+
+        logging.info('Periodgram cache %s: %d hits, %d misses (%.1f%% hits), %d bytes.' %
+                     (self.__directory, self.__hits, self.__misses,
+                      100.0 * self.__hits / requests if requests > 0 else 0.0,
+                      self.__size))
+
+def cache_from_environment():
+    """ Returns a PeriodgramCache in the directory indicated by the
+        environment variable CACHE_DIR_VARIABLE, or None if it is not set.
+
+    """
+
+    directory = os.environ.get(CACHE_DIR_VARIABLE)
+
+    if directory:
+        return PeriodgramCache(directory)
+    else:
+        return None
@@ -0,0 +1,411 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module runs a sequence of tasks in a pipeline of three stages: reader
+threads that read the data of each task, compute threads that process the
+data read, and a writer that receives the results in the order of the
+tasks. The stages are connected by bounded queues, so a stage that goes
+ahead waits for the next one, and the time each stage is busy is measured
+to know which one limits the pipeline.
+
+"""
+
+import time
+import logging
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+class StageStats(object):
+    """ Time used by the threads of a stage of the pipeline and number of
+        tasks processed.
+
+    """
+
+    def __init__(self, name_, threads_):
+        """ Instantiation method for the StageStats class.
+
+            name_ - Name of the stage.
+            threads_ - Number of threads of the stage.
+
+        """
+
+        self.__name = name_
+        self.__threads = threads_
+        self.__busy = 0.0
+        self.__tasks = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def threads(self):
+        return self.__threads
+
+    @property
+    def busy(self):
+        return self.__busy
+
+    @property
+    def tasks(self):
+        return self.__tasks
+
+    def add(self, busy):
+        """ Adds a task processed by a thread of the stage.
+
+            busy - Seconds used by the task.
+
+        """
+
+        with self.__lock:
+            self.__busy += busy
+            self.__tasks += 1
+
+    def occupancy(self, elapsed):
+        """ Returns the fraction of the time the threads of the stage have
+            been busy.
+
+            elapsed - Seconds elapsed running the pipeline.
+
+        """
+
+        return self.__busy / (elapsed * self.__threads) if elapsed > 0 else 0.0
+
+class QueueStats(object):
+    """ Length of a queue of the pipeline, sampled each time an element is
+        taken from it.
+
+    """
+
+    def __init__(self, name_, max_size_):
+        """ Instantiation method for the QueueStats class.
+
+            name_ - Name of the queue.
+            max_size_ - Maximum number of elements of the queue.
+
+        """
+
+        self.__name = name_
+        self.__max_size = max_size_
+        self.__sum_lengths = 0
+        self.__samples = 0
+        self.__lock = threading.Lock()
+
+    @property
+    def name(self):
+        return self.__name
+
+    @property
+    def max_size(self):
+        return self.__max_size
+
+    def sample(self, length):
+        """ Adds a sample of the length of the queue.
+
+            length - Length of the queue.
+
+        """
+
+        with self.__lock:
+            self.__sum_lengths += length
+            self.__samples += 1
+
+    def mean_length(self):
+        """ Returns the mean length of the queue sampled. """
+
+        return float(self.__sum_lengths) / self.__samples if self.__samples > 0 else 0.0
+
+class Pipeline(object):
+    """ Runs tasks in reader threads, compute threads and a writer in the
+        thread that calls run. Each reader and compute thread creates its
+        own objects with a factory, as the connections to databases can't
+        be shared between threads.
+
+    """
+
+    # Marks the end of the tasks in the queues.
+    __END = object()
+
+    def __init__(self, reader_factory_, compute_factory_, writer_,
+                 readers_ = 1, computers_ = 1, queue_size_ = 4):
+        """ Instantiation method for the Pipeline class.
+
+            reader_factory_ - Function called in each reader thread that
+                returns a function that reads the data of a task.
+            compute_factory_ - Function called in each compute thread that
+                returns a function that receives a task and its data and
+                returns its result.
+            writer_ - Function that receives each task and its result, in
+                the order of the tasks.
+            readers_ - Number of reader threads.
+            computers_ - Number of compute threads.
+            queue_size_ - Maximum number of tasks waiting in each queue.
+
+        """
+
+        self.__reader_factory = reader_factory_
+        self.__compute_factory = compute_factory_
+        self.__writer = writer_
+        self.__readers = readers_
+        self.__computers = computers_
+        self.__queue_size = queue_size_
+
+        self.__stages = []
+        self.__queues = []
+        self.__elapsed = 0.0
+
+    @property
+    def stages(self):
+        return self.__stages
+
+    @property
+    def queues(self):
+        return self.__queues
+
+    @property
+    def elapsed(self):
+        return self.__elapsed
+
+    @staticmethod
+    def __put(target_queue, item, stop):
+        """ Puts an item in a queue, waiting while it is full unless the
+            pipeline is stopped. Returns False if it is stopped.
+
+            target_queue - Queue of the item.
+            item - Item to put.
+            stop - Event that stops the pipeline.
+
+        """
+
+        while not stop.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+
+                return True
+            except queue.Full:
+                pass
+
+        return False
+
+    @staticmethod
+    def __acquire(semaphore, stop):
+        """ Acquires a semaphore, waiting unless the pipeline is stopped.
+            Returns False if it is stopped.
+
+            semaphore - Semaphore to acquire.
+            stop - Event that stops the pipeline.
+
+        """
+
+        while not stop.is_set():
+            if semaphore.acquire(False):
+                return True
+
+            time.sleep(0.01)
+
+        return False
+
+    def __read(self, tasks, read_queue, in_flight, readers_alive, stats,
+               stop, errors):
+        """ Body of the reader threads, reads the data of the tasks. """
+
+        try:
+            read = self.__reader_factory()
+
+            while Pipeline.__acquire(in_flight, stop):
+                try:
+                    index, task = tasks.get_nowait()
+                except queue.Empty:
+                    in_flight.release()
+                    break
+
+                start = time.time()
+
+                data = read(task)
+
+                stats.add(time.time() - start)
+
+                if not Pipeline.__put(read_queue, (index, task, data), stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            # The last reader marks the end of the data for each compute
+            # thread.
+            with readers_alive[0]:
+                readers_alive[1] -= 1
+
+                if readers_alive[1] == 0:
+                    for i in range(self.__computers):
+                        Pipeline.__put(read_queue, Pipeline.__END, stop)
+
+    def __compute(self, read_queue, result_queue, stats, read_queue_stats,
+                  stop, errors):
+        """ Body of the compute threads, processes the data read. """
+
+        try:
+            compute = self.__compute_factory()
+
+            while not stop.is_set():
+                read_queue_stats.sample(read_queue.qsize())
+
+                try:
+                    item = read_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if item is Pipeline.__END:
+                    break
+
+                index, task, data = item
+
+                start = time.time()
+
+                result = compute(task, data)
+
+                stats.add(time.time() - start)
+
+                if not Pipeline.__put(result_queue, (index, task, result), stop):
+                    break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            Pipeline.__put(result_queue, Pipeline.__END, stop)
+
+    def run(self, tasks):
+        """ Runs the tasks in the pipeline. An exception raised by any stage
+            stops the pipeline and it is raised again.
+
+            tasks - List of tasks.
+
+        """
+
+        read_stats = StageStats('read', self.__readers)
+        compute_stats = StageStats('compute', self.__computers)
+        write_stats = StageStats('write', 1)
+
+        read_queue_stats = QueueStats('read', self.__queue_size)
+        result_queue_stats = QueueStats('results', self.__queue_size)
+
+        self.__stages = [read_stats, compute_stats, write_stats]
+        self.__queues = [read_queue_stats, result_queue_stats]
+
+        pending_tasks = queue.Queue()
+
+        for index, task in enumerate(tasks):
+            pending_tasks.put((index, task))
+
+        read_queue = queue.Queue(self.__queue_size)
+        result_queue = queue.Queue(self.__queue_size)
+
+        # The tasks read and not written yet are limited, so the results
+        # waiting for their turn to be written are also limited.
+        in_flight = threading.Semaphore(2 * self.__queue_size + self.__readers +
+                                        self.__computers)
+
+        readers_alive = [threading.Lock(), self.__readers]
+
+        stop = threading.Event()
+        errors = []
+
+        threads = [threading.Thread(target=self.__read,
+                                    args=(pending_tasks, read_queue, in_flight,
+                                          readers_alive, read_stats, stop,
+                                          errors))
+                   for i in range(self.__readers)]
+
+        threads += [threading.Thread(target=self.__compute,
+                                     args=(read_queue, result_queue,
+                                           compute_stats, read_queue_stats,
+                                           stop, errors))
+                    for i in range(self.__computers)]
+
+        start = time.time()
+
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            # The results received before their turn wait to be written.
+            results = {}
+            next_index = 0
+            computers_ended = 0
+
+            while computers_ended < self.__computers and not stop.is_set():
+                result_queue_stats.sample(result_queue.qsize())
+
+                try:
+                    item = result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+
+                if item is Pipeline.__END:
+                    computers_ended += 1
+                    continue
+
+                index, task, result = item
+
+                results[index] = (task, result)
+
+                while next_index in results:
+                    task, result = results.pop(next_index)
+
+                    write_start = time.time()
+
+                    self.__writer(task, result)
+
+                    write_stats.add(time.time() - write_start)
+
+                    in_flight.release()
+
+                    next_index += 1
+        finally:
+            stop.set()
+
+            for thread in threads:
+                thread.join()
+
+            self.__elapsed = time.time() - start
+
+        if len(errors) > 0:
+            raise errors[0]
+
+    def log_stats(self):
+        """ Logs the occupancy of each stage and the mean length of the
+            queues of the last run, the stage with the highest occupancy
+            limits the pipeline.
+
+        """
+
+        for stage in self.__stages:
+            logging.info('Pipeline stage %s: %d threads, %d tasks, %.2f s busy, occupancy %.0f%%.' %
+                         (stage.name, stage.threads, stage.tasks, stage.busy,
+                          stage.occupancy(self.__elapsed) * 100))
+
+        for queue_stats in self.__queues:
+            logging.info('Pipeline queue %s: mean length %.1f of %d.' %
+                         (queue_stats.name, queue_stats.mean_length(),
+                          queue_stats.max_size))
@@ -24,7 +24,9 @@ It is intended to be used from a command line indicating the star to use.
 
 import sys
 import database
+import lcloader
 import lombscargle
+import pgramcache
 
 def plot_stars(filename, star_identifiers):
     """ . """       
@@ -41,26 +43,39 @@ def plot_stars(filename, star_identifiers):
     
     # Properties for the Lomb Scargle method.
     lsprop = lombscargle.LSProperties()  
-    ls = lombscargle.LombScargle(lsprop)
+    ls = lombscargle.LombScargle(lsprop, pgramcache.cache_from_environment())
     
-    # For all the stars in the database.
-    for star_id in star_identifiers:           
-        # For all the filters of current star.
-        for filter_index in range(len(filters)):
-            # Get the filter.
-            pfilter = filters[filter_index]
+    loader = lcloader.open_loader(filename)
+    
+    try:
+        # Curves of all the stars in each filter, read at once.
+        filters_curves = {}
+    
+        # For all the stars in the database.
+        for star_index, star_id in enumerate(star_identifiers):           
+            # For all the filters of current star.
+            for filter_index in range(len(filters)):
+                # Get the filter.
+                pfilter = filters[filter_index]
+            
+                if filter_index not in filters_curves:
+                    filters_curves[filter_index] = lcloader.curves_of_stars(
+                        db, loader, pfilter, [int(s) for s in star_identifiers])
 
-            curve = db.get_light_curve(int(star_id), pfilter)
-            # Get the object that will calculate the periodgram of the curve
-            # (not normalized).
-            try:
-                # Calculate and plot the periodgram.
-                ls.calculate_periodgram(pfilter, curve, True)
+                curve = filters_curves[filter_index][star_index]
+                # Get the object that will calculate the periodgram of the curve
+                # (not normalized).
+                try:
+                    # Calculate and plot the periodgram.
+                    ls.calculate_periodgram(pfilter, curve, True)
 
-            except TypeError:
-                print "Error reading from DB star with identifier %s for filter %s" % (star_id, str(pfilter))
+                except TypeError:
+                    print "Error reading from DB star with identifier %s for filter %s" % (star_id, str(pfilter))
                 
-            break
+                break
+    finally:
+        if loader is not None:
+            loader.close()
                  
     print 'Finished the reading of stars from LEMON db.'
 
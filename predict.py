@@ -23,11 +23,14 @@ It is intended to be used from a command line indicating the star to predict.
 
 import sys
 import database
+import lcloader
 import lombscargle
+import pgramcache
 import modelserial
 import periodicfeature
 import nonperiodicfeature
 import starfeatures
+import featureregistry
 
 def predict_stars_class(star_features_in_current_filter, pfilter, clf, filters_names, scn):
     """  Predict star classes using the model and the stars received. """    
@@ -57,8 +60,18 @@ def predict_stars_class(star_features_in_current_filter, pfilter, clf, filters_n
                 print "ERROR: %s" % e
             break
 
-def predict_star(database_filename, starsclasses_filename, model_name, star_id):
-    """ Predict the class of a star. """       
+def predict_star(database_filename, starsclasses_filename, model_name, star_id,
+                 registry = None):
+    """ Predict the class of a star. 
+    
+        database_filename - Name of the LEMON database file.
+        starsclasses_filename - Name of the file of the classes of stars.
+        model_name - Name of the files of the classification model.
+        star_id - Identifier of the star.
+        registry - FeatureRegistry with the features used to train the 
+            model, None for all the features.
+    
+    """       
     
     #print 'Opening LEMON db %s for star %s.' % (database_filename, star_id)
     
@@ -87,35 +100,42 @@ def predict_star(database_filename, starsclasses_filename, model_name, star_id):
         
         # Properties for the Lomb Scargle method.
         lsprop = lombscargle.LSProperties()  
-        ls = lombscargle.LombScargle(lsprop)
-                
-        # For all the filters of current star.
-        for filter_index in range(len(filters)):
-            # Get the filter.
-            pfilter = filters[filter_index]
-    
-            curve = db.get_light_curve(int(star_id), pfilter)
-            # Get the object that will calculate the periodgram of the curve
-            # (not normalized).
-            try:
-                print "Calculating features."
-                # Calculate and plot the periodgram.
-                pgram, nmags, ntimes = ls.calculate_periodgram(pfilter, curve)
+        ls = lombscargle.LombScargle(lsprop, pgramcache.cache_from_environment())
+        
+        loader = lcloader.open_loader(database_filename)
+        
+        try:
+            # For all the filters of current star.
+            for filter_index in range(len(filters)):
+                # Get the filter.
+                pfilter = filters[filter_index]
+    
+                curve = lcloader.curves_of_stars(db, loader, pfilter, [int(star_id)])[0]
+                # Get the object that will calculate the periodgram of the curve
+                # (not normalized).
+                try:
+                    print "Calculating features."
+                    # Calculate and plot the periodgram.
+                    pgram, nmags, ntimes = ls.calculate_periodgram(pfilter, curve)
                 
-                # Calculate periodic features of stars.
-                perfeat = periodicfeature.PeriodicFeature(pgram, lsprop)
+                    # Calculate periodic features of stars.
+                    perfeat = periodicfeature.PeriodicFeature(pgram, lsprop)
     
-                # Calculate no periodic features of stars.
-                noperfeat = nonperiodicfeature.NonPeriodicFeature(nmags, ntimes)
+                    # Calculate no periodic features of stars.
+                    noperfeat = nonperiodicfeature.NonPeriodicFeature(nmags, ntimes)
     
-                # Store all the features of this star in a list.
-                star_features_in_current_filter, features_names = \
-                    starfeatures.StarsFeatures.save_feature(perfeat, noperfeat)  
+                    # Store all the features of this star in a list.
+                    star_features_in_current_filter, features_names = \
+                        starfeatures.StarsFeatures.save_feature(perfeat, noperfeat,
+                                                                registry)  
                 
-                predict_stars_class(star_features_in_current_filter, str(pfilter), clf, filters_names, scn)          
+                    predict_stars_class(star_features_in_current_filter, str(pfilter), clf, filters_names, scn)          
     
-            except TypeError:
-                print "Error reading from DB star with identifier %s for filter %s" % (star_id, str(pfilter))
+                except TypeError:
+                    print "Error reading from DB star with identifier %s for filter %s" % (star_id, str(pfilter))
+        finally:
+            if loader is not None:
+                loader.close()
     else:
         print "ERROR: No classifier has been read."
                  
@@ -124,9 +144,18 @@ def predict_star(database_filename, starsclasses_filename, model_name, star_id):
 def predict():
     
     if len(sys.argv) < 5:
-        print "Not enough arguments have been provided -> %s database-file star-classes-file model star-id" % sys.argv[0]
+        print "Not enough arguments have been provided -> %s database-file star-classes-file model star-id [features]" % sys.argv[0]
     else:    
-        predict_star(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4])       
+        # The features selected to train the model, separated by commas
+        # as in the argument --features of the classifier.
+        try:
+            registry = featureregistry.registry_from_names(
+                sys.argv[5] if len(sys.argv) > 5 else None)
+        except ValueError as ve:
+            print "ERROR: %s" % ve
+        else:
+            predict_star(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4],
+                         registry)       
 
 if __name__ == "__main__":
     predict()
\ No newline at end of file
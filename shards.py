@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+
+# Copyright (c) 2012 Felipe Gallego. All rights reserved.
+#
+# CLAVEL is free software: you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+This module divides the stars in shards whose features are calculated by
+different processes, possibly in different nodes that share the files, and
+merges the features files of the shards in the features files of all the
+stars. The shard of each star is given by a hash of its identifier, so each
+process selects its stars without communicating with the others.
+
+"""
+
+import os
+import csv
+import hashlib
+import logging
+import csvdata
+
+def parse_shard(text):
+    """ Returns a tuple with the index of a shard and the number of shards
+        from a text 'i/N', the index is between 0 and N - 1. Raises
+        ValueError if the text isn't valid.
+
+        text - Text of the shard.
+
+    """
+
+    index, separator, shards = text.partition('/')
+
+    if len(separator) == 0:
+        raise ValueError("The shard '%s' isn't in the format i/N." % text)
+
+    index = int(index)
+    shards = int(shards)
+
+    if shards < 1 or not 0 <= index < shards:
+        raise ValueError("The shard '%s' isn't between 0 and the number of shards minus one." %
+                         text)
+
+    return index, shards
+
+def star_shard(star_id, shards):
+    """ Returns the index of the shard of a star.
+
+        star_id - Identifier of the star.
+        shards - Number of shards.
+
+    """
+
+    # The built-in hash of a string isn't the same in all the processes.
+    digest = hashlib.md5(str(int(star_id)).encode('ascii')).hexdigest()
+
+    return int(digest, 16) % shards
+
+def shard_file_name(features_file_name, shard):
+    """ Returns the prefix of the names of the features files of a shard,
+        the name of the filter is added at the end as in the features files
+        of all the stars. The name of the shard is added at the beginning
+        so the files of the shards aren't found as features files of all
+        the stars.
+
+        features_file_name - Prefix of the names of the features files.
+        shard - Tuple with the index of the shard and the number of shards.
+
+    """
+
+    head, tail = os.path.split(features_file_name)
+
+    return os.path.join(head, 'shard%dof%d_%s' % (shard[0], shard[1], tail))
+
+def select_shard(star_classes, shard):
+    """ Keeps in star_classes only the stars of a shard.
+
+        star_classes - StarClasses object, it contains all the information
+            related to the stars.
+        shard - Tuple with the index of the shard and the number of shards.
+
+    """
+
+    index, shards = shard
+
+    selected = [n for n in range(star_classes.number_of_stars)
+                if star_shard(star_classes.star_identifier(n), shards) == index]
+
+    logging.info('Selected %d of %d stars for the shard %d of %d.' %
+                 (len(selected), star_classes.number_of_stars, index, shards))
+
+    star_classes.set_star_id_and_classes(
+        [star_classes.star_identifier(n) for n in selected],
+        [star_classes.class_name(n) for n in selected])
+
+def shard_files(features_file_name, shard):
+    """ Returns a dictionary with the name of the features file of each
+        filter of a shard.
+
+        features_file_name - Prefix of the names of the features files.
+        shard - Tuple with the index of the shard and the number of shards.
+
+    """
+
+    features_file = csvdata.FeaturesFile()
+
+    directory, prefix = os.path.split(shard_file_name(features_file_name, shard))
+
+    # The name of the filter is between the prefix and the extension.
+    prefix = features_file.get_file_name('', prefix)[:-len(csvdata.CsvUtil.FILE_EXT)]
+
+    files = {}
+
+    for file_name in os.listdir(directory if len(directory) > 0 else '.'):
+        if file_name.startswith(prefix) and \
+            file_name.endswith(csvdata.CsvUtil.FILE_EXT):
+            filter_name = file_name[len(prefix):-len(csvdata.CsvUtil.FILE_EXT)]
+
+            files[filter_name] = os.path.join(directory, file_name)
+
+    return files
+
+def merge_shards(features_file_name, shards, star_classes):
+    """ Merges the features files of the shards in a features file for
+        each filter, with the stars in the order of star_classes. Raises
+        ValueError if the files of a shard aren't found or have other
+        features.
+
+        features_file_name - Prefix of the names of the features files.
+        shards - Number of shards.
+        star_classes - StarClasses object with the identifiers of the
+            stars.
+
+    """
+
+    files_of_shards = [shard_files(features_file_name, (index, shards))
+                       for index in range(shards)]
+
+    for index in range(shards):
+        if len(files_of_shards[index]) == 0:
+            raise ValueError('The features files of the shard %d of %d have not been found.' %
+                             (index, shards))
+
+    filters_names = sorted(set([filter_name for files in files_of_shards
+                                for filter_name in files]))
+
+    features_file = csvdata.FeaturesFile()
+
+    for filter_name in filters_names:
+        header = None
+
+        # The rows of the stars of all the shards, by star identifier.
+        rows = {}
+
+        for index in range(shards):
+            if filter_name not in files_of_shards[index]:
+                logging.warning('The shard %d of %d has no features file for filter %s.' %
+                                (index, shards, filter_name))
+                continue
+
+            file_name = files_of_shards[index][filter_name]
+
+            logging.info('Reading features of shard %d of %d from file %s.' %
+                         (index, shards, file_name))
+
+            with open(file_name, 'rb') as csvfile:
+                reader = csv.reader(csvfile, delimiter=',', quotechar='"')
+
+                shard_header = next(reader)
+
+                if header is None:
+                    header = shard_header
+                elif shard_header != header:
+                    raise ValueError('The features of the file %s are not those of the other shards.' %
+                                     file_name)
+
+                id_col = header.index(csvdata.CsvUtil.ID)
+
+                for row in reader:
+                    rows[row[id_col]] = row
+
+        merged_file_name = features_file.get_file_name(filter_name,
+                                                       features_file_name)
+
+        logging.info('Writing the features of %d stars of the shards to file %s.' %
+                     (len(rows), merged_file_name))
+
+        with open(merged_file_name, 'wb') as csvfile:
+            csv_file = csv.writer(csvfile, delimiter=',', quotechar='"')
+
+            csv_file.writerow(header)
+
+            for star_id in star_classes.stars_identifiers:
+                row = rows.pop(str(star_id), None)
+
+                if row is not None:
+                    csv_file.writerow(row)
+
+        if len(rows) > 0:
+            logging.warning('%d stars of the shards for filter %s are not in the list of stars.' %
+                            (len(rows), filter_name))
@@ -20,15 +20,358 @@ This module read and writes to file the features of a set of stars.
 
 """
 
+import os
 import logging
+import collections
+import multiprocessing
+import numpy as np
 import csvdata
 import database
+import lcloader
+import lightcurve
 import lombscargle
+import pipeline
+import manifest
+import checkpoint
+import shards
+import pgramcache
+import incremental
+import harmonicfit
+import onlinefeature
+import featureregistry
 import periodicfeature
 import nonperiodicfeature    
 
+def calculate_batch_features(ls, lsprop, registry, pfilter, stars_ids, 
+                             stars_curves, online_store = None):
+    """ Calculate the features of a batch of stars in a filter. The
+        features of each source are calculated at once for all the 
+        stars of the batch, and the periodgrams only if any feature 
+        selected needs them. Returns a list with the features of each 
+        star, None for the stars whose light curve couldn't be read or
+        isn't valid.
+        
+        ls - LombScargle object used to calculate the periodgrams.
+        lsprop - Properties of the Lomb Scargle method used by ls.
+        registry - FeatureRegistry with the features to calculate.
+        pfilter - Filter of the light curves.
+        stars_ids - Identifiers of the stars of the batch.
+        stars_curves - Light curves of the stars read from the database,
+            None for the stars without curve.
+        online_store - OnlineFeatureStore to update the non periodic 
+            features of the stars only with their new measures, some of 
+            them are estimated. None to calculate them exactly from all
+            the measures.
+        
+    """
+    
+    curves = []
+    
+    for star_id, curve in zip(stars_ids, stars_curves):
+        try:
+            unix_times, mags, snrs = lcloader.curve_columns(curve)
+            
+            curves.append(ls.prepare_curve(mags, unix_times))
+        except TypeError:
+            # The curve couldn't be read.
+            curves.append(None)
+        except ValueError as ve:
+            # The features of the curve can't be calculated.
+            logging.warning('Invalid light curve of star %s in filter %s: %s' %
+                            (star_id, pfilter, ve))
+            
+            curves.append(None)
+            
+    # Features of each source calculated at once for all the curves, only
+    # the features selected.
+    source_features = {}
+    
+    uses_periodic = registry.uses(featureregistry.PERIODIC, lsprop)
+    uses_faps = registry.uses(featureregistry.FAP, lsprop)
+    uses_harmonic = registry.uses(featureregistry.HARMONIC, lsprop)
+        
+    # Calculate the periodgrams of all the curves read.
+    valid_curves = [c for c in curves if c is not None]
+    valid_ids = [star_id for star_id, c in zip(stars_ids, curves) 
+                 if c is not None]
+    
+    if len(valid_curves) > 0 and (uses_periodic or uses_faps or uses_harmonic):
+        if isinstance(ls, incremental.IncrementalLombScargle):
+            pgrams, freqs, index_max_values, peak_freqs, peak_values = \
+                ls.calculate_periodgrams_of_stars(valid_curves, valid_ids,
+                                                  pfilter)
+        else:
+            pgrams, freqs, index_max_values, peak_freqs, peak_values = \
+                ls.calculate_periodgrams(valid_curves)
+            
+        # Calculate periodic features of all the stars.
+        if uses_periodic:
+            periodic, periodic_names = \
+                periodicfeature.PeriodicFeature.features_batch(
+                    pgrams, index_max_values, lsprop, freqs, peak_freqs, 
+                    peak_values, featureregistry.NUMBER_OF_FREQ,
+                    registry.columns(featureregistry.PERIODIC))
+            
+            source_features[featureregistry.PERIODIC] = periodic
+            
+        if uses_faps:
+            # The probabilities are calculated only for the maximums selected.
+            source_features[featureregistry.FAP] = ls.calculate_faps(
+                valid_curves, freqs, 
+                peak_freqs[:, registry.columns(featureregistry.FAP)])
+            
+        # Fit the harmonics of the frequencies of the maximums.
+        if uses_harmonic:
+            harmonic, harmonic_names = harmonicfit.fit_features(
+                [(c.mags, c.times) for c in valid_curves], 
+                peak_freqs[:, :featureregistry.NUMBER_OF_FREQ], 
+                memory_budget = lsprop.memory_budget)
+            
+            source_features[featureregistry.HARMONIC] = \
+                harmonic[:, registry.columns(featureregistry.HARMONIC)]
+            
+    # Calculate no periodic features of all the stars.
+    if len(valid_curves) > 0 and registry.uses(featureregistry.NON_PERIODIC):
+        non_periodic_columns = registry.columns(featureregistry.NON_PERIODIC)
+        
+        if online_store is None:
+            mags, times, offsets = lightcurve.concatenate_curves(valid_curves)
+            
+            non_periodic, non_periodic_names = \
+                nonperiodicfeature.NonPeriodicFeature.features_batch(
+                    mags, times, offsets, non_periodic_columns)
+        else:
+            non_periodic = np.array(
+                [[getattr(noperfeat, featureregistry.NON_PERIODIC_METHODS[c])()[0] 
+                  for c in non_periodic_columns]
+                 for noperfeat in [online_store.features(star_id, pfilter, c) 
+                                   for star_id, c in zip(valid_ids, valid_curves)]])
+        
+        source_features[featureregistry.NON_PERIODIC] = non_periodic
+        
+    # The features are stored in the order of the sources in the registry.
+    batch_features = [source_features[source] for source in 
+                      featureregistry.SOURCES if source in source_features]
+            
+    features = []
+    n_curve = 0
+    
+    # The features of each star are joined in the order of the registry.
+    for curve in curves:
+        if curve is None:
+            features.append(None)
+        else:
+            star_features = []
+            
+            for source_features in batch_features:
+                star_features.extend(source_features[n_curve].tolist())
+                
+            features.append(star_features)
+                
+            n_curve += 1
+            
+    return features
+
+def calculate_star_features(ls, lsprop, registry, pfilter, star_id, 
+                            star_curve, online_store = None):
+    """ Calculates the features of a star as calculate_batch_features.
+        Returns None if the features can't be calculated, to disable the
+        star in the filter.
+        
+        ls - LombScargle object used to calculate the periodgrams.
+        lsprop - Properties of the Lomb Scargle method used by ls.
+        registry - FeatureRegistry with the features to calculate.
+        pfilter - Filter of the light curve.
+        star_id - Identifier of the star.
+        star_curve - Light curve of the star read from the database, None
+            if the star hasn't curve.
+        online_store - OnlineFeatureStore or None.
+        
+    """
+    
+    try:
+        return calculate_batch_features(ls, lsprop, registry, pfilter, 
+                                        [star_id], [star_curve], 
+                                        online_store)[0]
+    except Exception as e:
+        logging.error('Error calculating the features of star %s in filter %s: %s' %
+                      (star_id, pfilter, e))
+        
+        return None
+
+def calculate_group_features(db, ls, lsprop, registry, pfilter, stars_ids,
+                             batch_size, loader = None, features_manifest = None,
+                             online_store = None):
+    """ Reads the light curves of a group of stars in a filter and 
+        calculates their features in batches, as calculate_batch_features.
+        
+        db - LEMON database that contains the light curves.
+        ls - LombScargle object used to calculate the periodgrams.
+        lsprop - Properties of the Lomb Scargle method used by ls.
+        registry - FeatureRegistry with the features to calculate.
+        pfilter - Filter of the light curves.
+        stars_ids - Identifiers of the stars of the group.
+        batch_size - Number of stars of each batch.
+        loader - LightCurveLoader of the database to read the curves of the
+            group at once, None to read them star by star.
+        features_manifest - FeaturesManifest with the features of the 
+            previous calculation, None to calculate all the features.
+        online_store - OnlineFeatureStore or None.
+        
+    """
+    
+    stars_curves = lcloader.curves_of_stars(db, loader, pfilter, stars_ids)
+    
+    return calculate_curves_features(ls, lsprop, registry, pfilter, stars_ids,
+                                     stars_curves, batch_size, 
+                                     features_manifest, online_store)
+
+def calculate_curves_features(ls, lsprop, registry, pfilter, stars_ids,
+                              stars_curves, batch_size, features_manifest = None,
+                              online_store = None):
+    """ Calculates the features of the light curves read of a group of 
+        stars in batches, as calculate_batch_features. The stars whose 
+        curve has the fingerprint of the previous calculation keep their 
+        previous features. Returns the features and the fingerprint of the
+        curve of each star.
+        
+        ls - LombScargle object used to calculate the periodgrams.
+        lsprop - Properties of the Lomb Scargle method used by ls.
+        registry - FeatureRegistry with the features to calculate.
+        pfilter - Filter of the light curves.
+        stars_ids - Identifiers of the stars of the group.
+        stars_curves - Light curves of the stars read from the database,
+            None for the stars without curve.
+        batch_size - Number of stars of each batch.
+        features_manifest - FeaturesManifest with the features of the 
+            previous calculation, None to calculate all the features.
+        online_store - OnlineFeatureStore or None.
+        
+    """
+    
+    fingerprints = [manifest.curve_fingerprint(curve) for curve in stars_curves]
+    
+    features = [None] * len(stars_ids)
+    
+    # Positions of the stars whose features are calculated.
+    pending = []
+    
+    for n in range(len(stars_ids)):
+        previous_features = None
+        
+        if features_manifest is not None:
+            previous_features = features_manifest.unchanged_features(
+                str(pfilter), stars_ids[n], fingerprints[n])
+            
+        if previous_features is None:
+            pending.append(n)
+        else:
+            features[n] = previous_features
+    
+    for first in range(0, len(pending), batch_size):
+        batch = pending[first:first + batch_size]
+        
+        try:
+            batch_features = calculate_batch_features(
+                ls, lsprop, registry, pfilter, [stars_ids[n] for n in batch],
+                [stars_curves[n] for n in batch], online_store)
+        except Exception as e:
+            # An error of a star shouldn't stop the calculation of the 
+            # others, so the features are calculated again star by star.
+            logging.warning('Error calculating the features of a batch of stars in filter %s, calculating them star by star: %s' %
+                            (pfilter, e))
+            
+            batch_features = [calculate_star_features(ls, lsprop, registry,
+                                                      pfilter, stars_ids[n],
+                                                      stars_curves[n], 
+                                                      online_store)
+                              for n in batch]
+        
+        for n, star_features in zip(batch, batch_features):
+            features[n] = star_features
+        
+    return features, fingerprints
+
+# Objects used by each process of a pool that calculates features, created
+# once for each process by init_worker.
+worker_objects = {}
+
+def init_worker(filename, lsprop, cache, store, registry, batch_size,
+                features_manifest, online_store):
+    """ Initializes a process of a pool that calculates features, opening
+        its own handle of the database.
+        
+        filename - Name of the LEMON database file.
+        lsprop - Properties for the Lomb Scargle method.
+        cache - PeriodgramCache or None.
+        store - AccumulatorStore or None.
+        registry - FeatureRegistry with the features to calculate.
+        batch_size - Number of stars whose periodgrams are calculated at
+            once.
+        features_manifest - FeaturesManifest with the features of the 
+            previous calculation or None.
+        online_store - OnlineFeatureStore or None.
+        
+    """
+    
+    worker_objects['db'] = database.LEMONdB(filename)
+    worker_objects['loader'] = lcloader.open_loader(filename)
+    worker_objects['ls'] = new_lomb_scargle(lsprop, cache, store)
+    worker_objects['lsprop'] = lsprop
+    worker_objects['registry'] = registry
+    worker_objects['batch_size'] = batch_size
+    worker_objects['features_manifest'] = features_manifest
+    worker_objects['online_store'] = online_store
+    
+def calculate_group_in_worker(task):
+    """ Calculates in a process of a pool the features of a group of stars
+        in a filter, as calculate_group_features.
+        
+        task - Index of the filter and identifiers of the stars.
+        
+    """
+    
+    filter_index, stars_ids = task
+    
+    db = worker_objects['db']
+    
+    return calculate_group_features(db, worker_objects['ls'], 
+                                    worker_objects['lsprop'],
+                                    worker_objects['registry'], 
+                                    db.pfilters[filter_index], stars_ids,
+                                    worker_objects['batch_size'],
+                                    worker_objects['loader'],
+                                    worker_objects['features_manifest'],
+                                    worker_objects['online_store'])
+
+def new_lomb_scargle(lsprop, cache = None, store = None):
+    """ Returns the object that calculates the periodgrams, incremental if
+        a store of the sums is received.
+        
+        lsprop - Properties for the Lomb Scargle method.
+        cache - PeriodgramCache or None.
+        store - AccumulatorStore or None.
+        
+    """
+    
+    if store is None:
+        return lombscargle.LombScargle(lsprop, cache)
+    else:
+        return incremental.IncrementalLombScargle(lsprop, store)
+
 class StarsFeatures(object):
     
+    # Number of stars whose periodgrams are calculated at once.
+    BATCH_SIZE = 64
+    
+    # Number of stars whose periodgrams are calculated at once when the
+    # sines and cosines are shared by the stars observed at the same epochs.
+    SHARED_BATCH_SIZE = 1024
+    
+    # Number of stars whose light curves are read at once, a multiple of
+    # the sizes of the batches.
+    READ_SIZE = 1024
+    
     def __init__(self, star_classes_):
         """ Initializes variables.
         
@@ -46,129 +389,243 @@ class StarsFeatures(object):
         self.__features_names = []
         
     @staticmethod
-    def save_feature(perfeat, noperfeat):
+    def save_feature(perfeat, noperfeat, registry = None):
         """ Receives two object with features and returns a vector with all the
             features and another with the name of the features. 
         
             perfeat - Features calculated from the periodgram.
             noperfeat - Features corresponding a statistical calculations
                 using the light curve data.
+            registry - FeatureRegistry with the features to calculate, None
+                to calculate all the features.
             
         """
+        
+        if registry is None:
+            registry = featureregistry.FeatureRegistry()
             
-        feature = []
-        feat_names = []
-        
-        # Three frequencies are used.
-        for n in range(3):
-            # Append frequency attribute.
-            value, name = perfeat.get_fund_freq(n)
-            feature.append(value)
-            feat_names.append(name)
-            
-            # Append amplitude attribute.
-            value, name = perfeat.get_amplitude(n)
-            feature.append(value)
-            feat_names.append(name)
-            
-            # Append amplitude of three first harmonics.
-            value, name = perfeat.get_amplitude_firsts_harm(n)
-            feature.extend(value)
-            feat_names.extend(name)
-            
-        # Append frequencies offset
-        value, name = perfeat.freq_y_offset()
-        feature.append(value)
-        feat_names.append(name)
-            
-        # Add difference of amplitudes        
-        value, name = noperfeat.amplitude_dif()
-        feature.append(value)
-        feat_names.append(name)        
-                        
-        # Add percentage of values beyond 1 standard deviation.
-        value, name = noperfeat.beyond1st()
-        feature.append(value)
-        feat_names.append(name)        
-                        
-        # Add linear trend.
-        value, name = noperfeat.linear_trend()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add maximum slope.
-        value, name = noperfeat.max_slope()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add median_absolute_deviation.
-        value, name = noperfeat.median_absolute_deviation()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add percentage of values beyond 20% of median.
-        value, name = noperfeat.median_buffer_range_percentage()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add percentage o consecutive values with positive slope.
-        value, name = noperfeat.pair_slope_trend()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add percentage of biggest difference between maximum and minimum magnitude. 
-        value, name = noperfeat.percent_amplitude()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add differences of magnitudes between percentile 5 and 95.
-        value, name = noperfeat.percent_difference_flux_percentile()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add skew.
-        value, name = noperfeat.skew()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add Kurtosis.
-        value, name = noperfeat.kurtosis()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add standard deviation.
-        value, name = noperfeat.std()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add flux ratio at percentile 20.
-        value, name = noperfeat.flux_percentile_ratio_mid20()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add flux ratio at percentile 35.
-        value, name = noperfeat.flux_percentile_ratio_mid35()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add flux ratio at percentile 50.
-        value, name = noperfeat.flux_percentile_ratio_mid50()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add flux ratio at percentile 65.
-        value, name = noperfeat.flux_percentile_ratio_mid65()
-        feature.append(value)
-        feat_names.append(name)        
-        
-        # Add flux ratio at percentile 80.
-        value, name = noperfeat.flux_percentile_ratio_mid80()
-        feature.append(value)
-        feat_names.append(name)
-            
-        return feature, feat_names
-        
-    def calculate_features(self, filename):
+        return registry.evaluate(perfeat, noperfeat)
+        
+    def __disable_star_in_filter(self, star_id, pfilter, filter_index):
+        """ Disable a star whose features couldn't be calculated.
+        
+            star_id - Identifier of the star.
+            pfilter - Filter used for the measures.
+            filter_index - Index of the filter.
+            
+        """
+        
+        logging.error("Error reading from DB star with identifier %d for filter %s" % (star_id, pfilter))
+        
+        self.__star_classes.disable_star(star_id)
+        
+        # Save fake feature for this star. Necessary to avoid an 
+        # error accessing with a sequential index to a non 
+        # existing feature. This feature wouldn't be accessed as 
+        # this has been disabled.
+        self.__star_classes.add_feature(filter_index, [])
+        
+    def __store_group_features(self, stars_ids, features, pfilter,
+                               filter_index):
+        """ Stores the features of a group of stars in a filter, in the
+            order of the stars, and disables the stars without features.
+            
+            stars_ids - Identifiers of the stars of the group.
+            features - Features of each star, None if they couldn't be
+                calculated.
+            pfilter - Filter of the light curves.
+            filter_index - Index of the filter.
+            
+        """
+        
+        for star_id, star_features in zip(stars_ids, features):
+            if star_features is None:
+                self.__disable_star_in_filter(star_id, pfilter, filter_index)
+            else:
+                # Add the features calculated in the appropriate filter
+                # data structure.
+                self.__star_classes.add_feature(filter_index, star_features)
+        
+    def __group_tasks(self, number_of_filters, lsprop, jobs = 1):
+        """ Returns the number of stars of each batch and the groups of
+            stars whose light curves are read at once in each filter, as
+            tuples with the index of the filter and the identifiers of the
+            stars.
+            
+            number_of_filters - Number of filters of the light curves.
+            lsprop - Properties for the Lomb Scargle method.
+            jobs - Number of processes that calculate the groups.
+            
+        """
+        
+        number_of_stars = self.__star_classes.number_of_stars
+        
+        # The stars of a filter observed at the same epochs share the 
+        # calculation of sines and cosines inside each batch, so bigger
+        # batches are used.
+        batch_size = StarsFeatures.SHARED_BATCH_SIZE if lsprop.shared_basis \
+            else StarsFeatures.BATCH_SIZE
+        
+        stars_ids = [self.__star_classes.get_instance_id(star_index)
+                     for star_index in range(number_of_stars)]
+        
+        # The light curves of the stars of each filter are read in groups,
+        # and their periodgrams calculated in batches.
+        read_size = max(StarsFeatures.READ_SIZE, batch_size)
+        
+        # With several processes the stars of each filter are divided in 
+        # at least four groups for each process, so all of them are busy,
+        # of a multiple of the size of the batches.
+        if jobs > 1:
+            stars_per_group = -(-number_of_stars // (4 * jobs))
+            
+            read_size = min(read_size, 
+                            batch_size * max(1, -(-stars_per_group // batch_size)))
+        
+        tasks = [(filter_index, stars_ids[first_star:first_star + read_size])
+                 for filter_index in range(number_of_filters)
+                 for first_star in range(0, number_of_stars, read_size)]
+        
+        return batch_size, tasks
+        
+    @staticmethod
+    def get_lsproperties(classifarg):
+        """ Returns the properties for the Lomb Scargle method indicated
+            by the program arguments.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        lsprop = lombscargle.LSProperties(method_ = classifarg.ls_method,
+                                          search_mode_ = classifarg.ls_search,
+                                          grid_mode_ = classifarg.ls_grid,
+                                          shared_basis_ = classifarg.shared_basis,
+                                          precision_ = classifarg.ls_precision,
+                                          engine_ = classifarg.engine,
+                                          fap_method_ = classifarg.fap_method,
+                                          harmonic_fit_ = classifarg.harmonic_fit)
+        
+        if classifarg.ls_freqs is not None:
+            lsprop.freq_to_calculate = classifarg.ls_freqs
+            
+        if classifarg.fap_shuffles is not None:
+            lsprop.bootstrap_shuffles = classifarg.fap_shuffles
+            
+        if classifarg.memory_budget is not None:
+            lsprop.memory_budget = classifarg.memory_budget * 2 ** 20
+            
+        return lsprop
+        
+    @staticmethod
+    def get_pgram_cache(classifarg):
+        """ Returns the cache of periodgrams indicated by the program 
+            arguments, or None if no cache has been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if classifarg.pgram_cache_dir is None:
+            return None
+        else:
+            return pgramcache.PeriodgramCache(classifarg.pgram_cache_dir,
+                                              classifarg.pgram_cache_size * 2 ** 20)
+        
+    @staticmethod
+    def get_accumulator_store(classifarg):
+        """ Returns the store of the sums to update the periodgrams 
+            indicated by the program arguments, or None if no store has 
+            been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if classifarg.incremental_dir is None:
+            return None
+        else:
+            return incremental.AccumulatorStore(classifarg.incremental_dir)
+        
+    @staticmethod
+    def get_online_store(classifarg):
+        """ Returns the store of the states of the non periodic features 
+            indicated by the program arguments, or None if no store has 
+            been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if classifarg.online_features_dir is None:
+            return None
+        else:
+            return onlinefeature.OnlineFeatureStore(classifarg.online_features_dir)
+        
+    @staticmethod
+    def get_features_file_name(classifarg):
+        """ Returns the prefix of the names of the features files, those of
+            the shard of the stars if a shard has been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if classifarg.shard is None:
+            return classifarg.features_file_name
+        else:
+            return shards.shard_file_name(classifarg.features_file_name,
+                                          classifarg.shard)
+        
+    @staticmethod
+    def get_checkpoint(classifarg):
+        """ Returns the checkpoint of the features of the stars calculated, 
+            next to the features file, or None if no features file has 
+            been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if not classifarg.features_file_provided:
+            if classifarg.resume:
+                logging.warning('A features file is needed to resume the calculation of features.')
+                
+            return None
+        else:
+            features_file_name = StarsFeatures.get_features_file_name(classifarg)
+            
+            return checkpoint.FeaturesCheckpoint(features_file_name + 
+                                                 checkpoint.FeaturesCheckpoint.FILE_EXT,
+                                                 classifarg.resume)
+            
+    @staticmethod
+    def get_manifest(classifarg):
+        """ Returns the manifest with the fingerprints of the light curves
+            whose features are in the features file, or None if no features
+            file has been indicated.
+            
+            classifarg - ClassifierArguments object, it contains the
+                information of all program arguments received.
+                
+        """
+        
+        if not classifarg.features_file_provided:
+            return None
+        else:
+            return manifest.FeaturesManifest(
+                StarsFeatures.get_features_file_name(classifarg))
+        
+    def calculate_features(self, filename, lsprop = None, cache = None, 
+                           store = None, registry = None, jobs = 1,
+                           pipeline_threads = None, checkpoint = None,
+                           features_manifest = None, online_store = None):
         """ Calculate features of the stars. Read the light curves from
             database, calculate periodic and no periodic features and store
             all the features in a data structure that is accessed using
@@ -177,6 +634,31 @@ class StarsFeatures(object):
             
             filename - Name of the LEMON database file that contains the
             light curves of the stars.
+            lsprop - Properties for the Lomb Scargle method, the default 
+            ones are used if not provided.
+            cache - PeriodgramCache with the periodgrams already calculated,
+            None to calculate all the periodgrams.
+            store - AccumulatorStore with the sums of the periodgrams of
+            the stars, to update them only with the new measures. None to
+            calculate the periodgrams from all the measures.
+            registry - FeatureRegistry with the features to calculate, None
+            to calculate all the features.
+            jobs - Number of processes that calculate the features, each one
+            with its own handle of the database.
+            pipeline_threads - Number of threads that calculate the features
+            while another thread reads the light curves, None to read and
+            calculate in turns. Not used with several processes.
+            checkpoint - FeaturesCheckpoint where the features of each group
+            of stars are saved as they are calculated, and read to not
+            calculate them again when resuming. None to not save them.
+            features_manifest - FeaturesManifest with the fingerprints of 
+            the light curves, the stars whose curve hasn't changed since
+            the previous calculation keep their previous features. None to
+            calculate the features of all the stars.
+            online_store - OnlineFeatureStore with the states of the non
+            periodic features of the stars, to update them only with the 
+            new measures, some of them are estimated. None to calculate 
+            them exactly from all the measures.
             
         """       
         
@@ -198,62 +680,345 @@ class StarsFeatures(object):
                      (self.__star_classes.number_of_stars, self.__star_classes.filters_names) )    
         
         # Properties for the Lomb Scargle method.
-        lsprop = lombscargle.LSProperties()  
-        ls = lombscargle.LombScargle(lsprop)
-        
-        # Percentage of calculation completed.
-        perc_completed = 0
-        
-        # For all the stars in the database.
-        for star_index in range(self.__star_classes.number_of_stars):           
-            # For all the filters of current star.
-            for filter_index in range(len(filters)):
-                # Get the filter.
-                pfilter = filters[filter_index]
-
-                # Get the curve of the current star in the current filter.
-                star_id = self.__star_classes.get_instance_id(star_index)
-
-                curve = db.get_light_curve(star_id, pfilter)
-                # Get the object that will calculate the periodgram of the curve
-                # (not normalized).
-                try:
-                    # Calculate the periodgram.
-                    pgram, nmags, ntimes = ls.calculate_periodgram(pfilter, curve)
-
-                    # Calculate periodic features of stars.
-                    perfeat = periodicfeature.PeriodicFeature(pgram, lsprop)
-
-                    # Calculate no periodic features of stars.
-                    noperfeat = nonperiodicfeature.NonPeriodicFeature(nmags, ntimes)
-
-                    # Store all the features of this star in a list.
-                    star_features_in_current_filter, self.__features_names = \
-                        StarsFeatures.save_feature(perfeat, noperfeat)
-      
-                    # Add the features calculated in the appropriate filter
-                    # data structure.
-                    self.__star_classes.add_feature(filter_index, star_features_in_current_filter)
-                except TypeError:
-                    logging.error("Error reading from DB star with identifier %d for filter %s" % (star_id, pfilter))
+        if lsprop is None:
+            lsprop = lombscargle.LSProperties()  
+        if registry is None:
+            registry = featureregistry.FeatureRegistry()
+            
+        self.__features_names = registry.names(lsprop)
+        
+        number_of_stars = self.__star_classes.number_of_stars
+        
+        batch_size, tasks = self.__group_tasks(len(filters), lsprop, jobs)
+        
+        settings = repr((os.path.abspath(filename), self.__features_names,
+                         lsprop.features_settings(), online_store is not None))
+        
+        # Features of the stars calculated by a previous run.
+        restored = {}
+        
+        if checkpoint is not None:
+            restored = checkpoint.open(settings)
+            
+        if features_manifest is not None:
+            features_manifest.open(settings)
+            
+        def is_restored(filter_index, star_id):
+            return checkpoint is not None and \
+                checkpoint.star_key(filter_index, star_id) in restored
+        
+        # Only the stars not restored of each group are calculated, the 
+        # groups of the previous run could be others if the number of 
+        # processes has changed.
+        remaining_tasks = []
+        
+        for filter_index, group_stars_ids in tasks:
+            remaining_stars_ids = [star_id for star_id in group_stars_ids
+                                   if not is_restored(filter_index, star_id)]
+            
+            if len(remaining_stars_ids) > 0:
+                remaining_tasks.append((filter_index, remaining_stars_ids))
+        
+        # Percentage of calculation completed and number of stars whose
+        # features have been stored.
+        progress = [0, 0]
+        
+        def store_group(task, features, fingerprints):
+            filter_index, group_stars_ids = task
+            
+            self.__store_group_features(group_stars_ids, features, 
+                                        filters[filter_index], filter_index)
+            
+            # Only the fingerprints of the stars with features are kept.
+            if features_manifest is not None and fingerprints is not None:
+                features_manifest.update(str(filters[filter_index]), 
+                                         group_stars_ids,
+                                         [fingerprint if star_features is not None
+                                          else None for star_features, fingerprint
+                                          in zip(features, fingerprints)])
+            
+            progress[1] += len(group_stars_ids)
+            
+            # Only to print a progress message of the calculation each 10% of advance.
+            perc = progress[1] * 100 / (len(filters) * number_of_stars)
+            if perc // 10 > progress[0] // 10:
+                logging.info('Calculating features for stars:%3.f%% done.', perc)
+                progress[0] = perc
+                
+        # Index of the next task whose features are stored.
+        next_task = [0]
+        
+        def store_next_task(calculated = None):
+            # Stores the features of the next task, those of the stars 
+            # calculated or restored otherwise.
+            filter_index, group_stars_ids = tasks[next_task[0]]
+            
+            features = []
+            fingerprints = []
+            
+            for star_id in group_stars_ids:
+                if calculated is not None and star_id in calculated:
+                    star_features, fingerprint = calculated[star_id]
+                else:
+                    star_features, fingerprint = \
+                        restored[checkpoint.star_key(filter_index, star_id)]
+                    
+                features.append(star_features)
+                fingerprints.append(fingerprint)
+                
+            store_group(tasks[next_task[0]], features, fingerprints)
+            
+            next_task[0] += 1
+        
+        def store_restored():
+            # The groups restored are stored in their turn.
+            while next_task[0] < len(tasks) and \
+                all([is_restored(tasks[next_task[0]][0], star_id) 
+                     for star_id in tasks[next_task[0]][1]]):
+                store_next_task()
+                
+        def write_group(task, result):
+            features, fingerprints = result
+            
+            store_restored()
+            
+            store_next_task(dict(zip(task[1], zip(features, fingerprints))))
+            
+            if checkpoint is not None:
+                checkpoint.append(task[0], task[1], features, fingerprints)
+                
+        pool = None
+        loader = None
+        ls = None
+        
+        try:
+            if jobs > 1:
+                logging.info('Calculating features with %d processes.' % jobs)
+                
+                pool = multiprocessing.Pool(jobs, init_worker, 
+                                            (filename, lsprop, cache, store, 
+                                             registry, batch_size, 
+                                             features_manifest, online_store))
+                
+                # The results are received in the order of the tasks.
+                for task_index, features in enumerate(
+                    pool.imap(calculate_group_in_worker, remaining_tasks)):
+                    write_group(remaining_tasks[task_index], features)
                     
-                    self.__star_classes.disable_star(star_id)
+                pool.close()
+                pool.join()
+                
+            elif pipeline_threads is not None:
+                logging.info('Calculating features with a pipeline of %d threads.' %
+                             pipeline_threads)
+                
+                # Each thread opens its own handles of the database.
+                def reader_factory():
+                    reader_db = database.LEMONdB(filename)
+                    reader_loader = lcloader.open_loader(filename)
                     
-                    # Save fake feature for this star. Necessary to avoid an 
-                    # error accessing with a sequential index to a non 
-                    # existing feature. This feature wouldn't be accessed as 
-                    # this has been disabled.
-                    self.__star_classes.add_feature(filter_index, [])
+                    return lambda task: lcloader.curves_of_stars(
+                        reader_db, reader_loader, reader_db.pfilters[task[0]], 
+                        task[1])
+                
+                def compute_factory():
+                    compute_ls = new_lomb_scargle(lsprop, cache, store)
                     
-            # Only to print a progress message of the calculation each 10% of advance.
-            perc = star_index * 100 / self.__star_classes.number_of_stars 
-            perc_module = perc % 10                    
-            if perc >= 10 and perc_module == 0 and perc != perc_completed :
-                logging.info('Calculating features for stars:%3.f%% done.', perc)
-                perc_completed = perc
+                    return lambda task, stars_curves: calculate_curves_features(
+                        compute_ls, lsprop, registry, filters[task[0]], task[1],
+                        stars_curves, batch_size, features_manifest,
+                        online_store)
+                
+                features_pipeline = pipeline.Pipeline(reader_factory, 
+                                                      compute_factory,
+                                                      write_group,
+                                                      computers_ = pipeline_threads)
+                
+                features_pipeline.run(remaining_tasks)
+                
+                features_pipeline.log_stats()
+            else:
+                ls = new_lomb_scargle(lsprop, cache, store)
+                
+                # The curves of each group are read with one query.
+                loader = lcloader.open_loader(filename)
+                
+                for filter_index, group_stars_ids in remaining_tasks:
+                    write_group((filter_index, group_stars_ids),
+                                calculate_group_features(db, ls, lsprop, registry, 
+                                                         filters[filter_index], 
+                                                         group_stars_ids, 
+                                                         batch_size, loader,
+                                                         features_manifest,
+                                                         online_store))
+        except:
+            # The tasks waiting in the pool aren't calculated after an error
+            # or an interruption.
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+                
+            raise
+        finally:
+            if loader is not None:
+                loader.close()
+                
+            if checkpoint is not None:
+                checkpoint.close()
+                
+        store_restored()
+                     
+        # The statistics are only collected by the objects of this process.
+        if pool is None and cache is not None:
+            cache.log_stats()
+                
+        if ls is not None and store is not None:
+            ls.log_stats()
+            
+        if pool is None and online_store is not None:
+            online_store.log_stats()
                      
         logging.info('Finished the calculation of features from LEMON db.')
                     
+    def iter_features(self, filename, lsprop = None, cache = None, 
+                      store = None, registry = None, jobs = 1,
+                      online_store = None):
+        """ Generator that calculates the features of the stars group by 
+            group and yields the identifier of each star, the name of the
+            filter and its features, without storing them. Each group of
+            stars is yielded in all the filters before the next group, in
+            the order of star_classes. As the stars disabled by 
+            calculate_features, those without features in a filter aren't
+            yielded in any filter.
+            
+            filename - Name of the LEMON database file that contains the
+            light curves of the stars.
+            lsprop - Properties for the Lomb Scargle method, the default 
+            ones are used if not provided.
+            cache - PeriodgramCache with the periodgrams already calculated,
+            None to calculate all the periodgrams.
+            store - AccumulatorStore with the sums of the periodgrams of
+            the stars, None to calculate the periodgrams from all the 
+            measures.
+            registry - FeatureRegistry with the features to calculate, None
+            to calculate all the features.
+            jobs - Number of processes that calculate the features, each one
+            with its own handle of the database.
+            online_store - OnlineFeatureStore with the states of the non
+            periodic features of the stars, None to calculate them exactly
+            from all the measures.
+            
+        """
+        
+        logging.info('Opening LEMON db %s.' % filename)
+        
+        db = database.LEMONdB(filename)
+        
+        filters = db.pfilters
+        
+        if lsprop is None:
+            lsprop = lombscargle.LSProperties()  
+        if registry is None:
+            registry = featureregistry.FeatureRegistry()
+            
+        self.__features_names = registry.names(lsprop)
+        
+        batch_size, tasks = self.__group_tasks(len(filters), lsprop, jobs)
+        
+        # The tasks are ordered by group of stars and then by filter, to 
+        # know the stars with features in all the filters of a group.
+        number_of_groups = len(tasks) // len(filters) if len(filters) > 0 else 0
+        
+        tasks = [tasks[filter_index * number_of_groups + group_index]
+                 for group_index in range(number_of_groups)
+                 for filter_index in range(len(filters))]
+        
+        # Features of the current group in the filters calculated.
+        group_results = []
+        
+        def group_features(task, result):
+            group_results.append((task, result[0]))
+            
+            if len(group_results) < len(filters):
+                return
+            
+            group_stars_ids = task[1]
+            
+            # Stars with features in all the filters.
+            enabled = [True] * len(group_stars_ids)
+            
+            for (filter_index, stars_ids), features in group_results:
+                for n, star_features in enumerate(features):
+                    if star_features is None:
+                        logging.warning("Features couldn't be calculated for star %s in filter %s, it isn't used in any filter." % 
+                                        (stars_ids[n], filters[filter_index]))
+                        
+                        enabled[n] = False
+                        
+            for (filter_index, stars_ids), features in group_results:
+                for star_id, star_features, star_enabled in \
+                    zip(stars_ids, features, enabled):
+                    if star_enabled:
+                        yield star_id, str(filters[filter_index]), star_features
+                        
+            del group_results[:]
+        
+        pool = None
+        loader = None
+        
+        try:
+            if jobs > 1:
+                logging.info('Calculating features with %d processes.' % jobs)
+                
+                pool = multiprocessing.Pool(jobs, init_worker, 
+                                            (filename, lsprop, cache, store, 
+                                             registry, batch_size, None,
+                                             online_store))
+                
+                # Only a few groups are sent to the processes ahead of 
+                # those consumed, so the results waiting are limited.
+                pending = collections.deque()
+                
+                for task in tasks:
+                    pending.append((task, pool.apply_async(calculate_group_in_worker,
+                                                           (task,))))
+                    
+                    if len(pending) > 2 * jobs:
+                        task, result = pending.popleft()
+                        
+                        for item in group_features(task, result.get()):
+                            yield item
+                            
+                while len(pending) > 0:
+                    task, result = pending.popleft()
+                    
+                    for item in group_features(task, result.get()):
+                        yield item
+            else:
+                ls = new_lomb_scargle(lsprop, cache, store)
+                
+                loader = lcloader.open_loader(filename)
+                
+                for filter_index, group_stars_ids in tasks:
+                    result = calculate_group_features(db, ls, lsprop, registry,
+                                                      filters[filter_index],
+                                                      group_stars_ids,
+                                                      batch_size, loader,
+                                                      online_store = online_store)
+                    
+                    for item in group_features((filter_index, group_stars_ids),
+                                               result):
+                        yield item
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+                
+            if loader is not None:
+                loader.close()
+                
+        logging.info('Finished the calculation of features from LEMON db.')
+                    
     def write_features(self, filename):
         """ Write to file the features calculated. 
         
@@ -301,17 +1066,36 @@ class StarsFeatures(object):
             logging.info('Calculating star features from the light curves of LEMON database %s.' %
                          classifarg.database_file_name)
             
+            features_checkpoint = StarsFeatures.get_checkpoint(classifarg)
+            
+            features_manifest = StarsFeatures.get_manifest(classifarg)
+            
             # Calculate the features from the light curves of a LEMON db.
-            self.calculate_features(classifarg.database_file_name)        
+            self.calculate_features(classifarg.database_file_name,
+                                    StarsFeatures.get_lsproperties(classifarg),
+                                    StarsFeatures.get_pgram_cache(classifarg),
+                                    StarsFeatures.get_accumulator_store(classifarg),
+                                    featureregistry.registry_from_names(classifarg.features),
+                                    classifarg.jobs, classifarg.pipeline,
+                                    features_checkpoint, features_manifest,
+                                    StarsFeatures.get_online_store(classifarg))        
         
             # If a features file has been given.
             if classifarg.features_file_provided:
                 # Write the features to file.
-                self.write_features(classifarg.features_file_name)
+                self.write_features(StarsFeatures.get_features_file_name(classifarg))
+                
+                # The checkpoint is no longer needed once the features
+                # are written.
+                features_checkpoint.remove()
+                
+                # The fingerprints are written after the features they
+                # correspond to.
+                features_manifest.write()
         
         elif classifarg.features_file_provided:            
             # Try to read the features from a file.
-            if self.read_features(classifarg.features_file_name) == False:
+            if self.read_features(StarsFeatures.get_features_file_name(classifarg)) == False:
                 
                 logging.info("Star features couldn't be read from file")
         else: